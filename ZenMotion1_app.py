@@ -1,6 +1,9 @@
+import sys
+import time
 import cv2
 import mediapipe as mp
 import numpy as np
+import zenmotion_core
 
 # Initialize MediaPipe Pose
 mp_drawing = mp.solutions.drawing_utils
@@ -19,16 +22,49 @@ def calculate_angle(a, b, c):
         angle = 360 - angle
     return angle
 
+# Optional recording: python ZenMotion1_app.py --record [out_dir]
+# Started before the camera and MediaPipe so its encoder process forks first.
+recorder = None
+if "--record" in sys.argv:
+    i = sys.argv.index("--record")
+    out_dir = sys.argv[i + 1] if len(sys.argv) > i + 1 and not sys.argv[i + 1].startswith("--") \
+        else time.strftime("recordings/%Y%m%d-%H%M%S")
+    import zenmotion_recorder
+    recorder = zenmotion_recorder.Recorder(out_dir).start()
+    print(f"Recording to {out_dir}")
+
+# Optional auto-tuning: python ZenMotion1_app.py --target-fps 20
+# picks the pose model for this machine (calibrated once, then cached) and
+# steps it down/up when inference gets slower/faster than the budget.
+# The current setting is shown on the frame.
+tuning = "--target-fps" in sys.argv
+if tuning:
+    import zenmotion_tune
+    pose_model = zenmotion_tune.AdaptivePose(target_fps=float(sys.argv[sys.argv.index("--target-fps") + 1]))
+    pose_status = pose_model.governor.describe()
+else:
+    pose_model = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
+
+# Optional workout log: python ZenMotion1_app.py --user NAME puts every rep in
+# the SQLite workout log (python zenmotion_log.py weekly --user NAME)
+workout_log = None
+if "--user" in sys.argv:
+    import zenmotion_log
+    user = sys.argv[sys.argv.index("--user") + 1]
+    workout_log = zenmotion_log.WorkoutLog()
+
 # Video capture
 cap = cv2.VideoCapture(0)
 
-# Rep counter variables
+# Rep counter: same thresholds as before (zenmotion_core.EXERCISES["squat"]);
+# it also keeps each rep's angle extremes and timing for the log
+reps = zenmotion_core.RepCounter("squat")
 counter = 0
-stage = None  # "up" or "down"
 
-with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
+with pose_model as pose:
     while cap.isOpened():
         ret, frame = cap.read()
+        rep_done = False
         
         # Recolor image to RGB
         image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -61,20 +97,15 @@ with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as
                         cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2, cv2.LINE_AA
                         )
             
-            # Rep counting logic
-            if angle > 160:
-                stage = "up"
-            if angle < 70 and stage == "up":
-                stage = "down"
-                counter += 1
+            # Rep counting logic and feedback
+            feedback = reps.update(angle)
+            if reps.counter != counter:
+                counter = reps.counter
                 print(f"Squat count: {counter}")
-            
-            # Feedback
-            feedback = ""
-            if angle > 170:
-                feedback = "Stand straight"
-            elif angle < 50:
-                feedback = "Go lower"
+            # back at the top: the rep is finished and its clip ends here
+            rep_done = reps.last_rep is not None
+            if rep_done and workout_log:
+                workout_log.log(reps.last_rep.as_dict(), user)
             
             # Display rep counter and feedback
             cv2.rectangle(image, (0,0), (300,100), (245,117,16), -1)
@@ -92,13 +123,25 @@ with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as
         except:
             pass
         
+        if tuning:
+            if pose.changed:
+                pose_status = pose.governor.describe()
+            cv2.putText(image, f"Pose: {pose_status}", (10, 470),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+        
         # Render pose landmarks
         mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
         
         cv2.imshow('AI Trainer - Squats', image)
+        if recorder:
+            recorder.push(image, rep_done, {"index": counter} if rep_done else None)
         
         if cv2.waitKey(10) & 0xFF == ord('q'):
             break
 
 cap.release()
 cv2.destroyAllWindows()
+if workout_log:
+    workout_log.close()
+if recorder:
+    print(f"Recording saved: {recorder.close()}")
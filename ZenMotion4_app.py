@@ -11,6 +11,7 @@ from google.colab import output
 import io
 from PIL import Image
 import ipywidgets as widgets
+import time
 
 # --- Webcam helpers ---
 def js_to_image(js_reply):
@@ -52,81 +53,101 @@ def video_stream():
     display(js)
 
 # --- Pose + logic ---
+# Angle/rep rules live in zenmotion_core.py, form scoring in zenmotion_form.py
+# and exercise auto-detection in zenmotion_detect.py; upload them next to
+# this notebook.
+import zenmotion_core
+import zenmotion_detect
+import zenmotion_form
+import zenmotion_log
+import zenmotion_recorder
+import zenmotion_tune
+
 mp_drawing = mp.solutions.drawing_utils
 mp_pose = mp.solutions.pose
 
-def calculate_angle(a, b, c):
-    a, b, c = np.array(a), np.array(b), np.array(c)
-    radians = np.arctan2(c[1]-b[1], c[0]-b[0]) - np.arctan2(a[1]-b[1], a[0]-b[0])
-    angle = np.abs(radians*180.0/np.pi)
-    return 360 - angle if angle > 180.0 else angle
-
 # --- State ---
 exercise = "squat"  # default
-counter = 0
-stage = None
-pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
+auto = False        # "auto" picked: exercise follows the detector
+reps = zenmotion_core.RepCounter(exercise)
+form = zenmotion_form.FormScorer()  # memory-mapped template library
+detector = zenmotion_detect.ExerciseDetector()
+last_form = None
+recorder = None     # set while the Record button is on
+USER = "me"         # name the reps are logged under
+workout_log = zenmotion_log.WorkoutLog()  # SQLite, written by a background thread
+# Set a target FPS to auto-tune the pose model to this runtime (calibrated
+# once, cached, then stepped down/up as inference slows down or speeds up;
+# the current setting is shown on the frame)
+TARGET_FPS = None
+if TARGET_FPS:
+    pose = zenmotion_tune.AdaptivePose(target_fps=TARGET_FPS)
+    pose_status = pose.governor.describe()
+else:
+    pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
 
 def process_frame(image):
-    global counter, stage, exercise
+    global exercise, last_form, pose_status
     results = pose.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
     feedback = ""
 
     if results.pose_landmarks:
-        lm = results.pose_landmarks.landmark
-
-        if exercise == "squat":
-            hip = [lm[mp_pose.PoseLandmark.LEFT_HIP.value].x, lm[mp_pose.PoseLandmark.LEFT_HIP.value].y]
-            knee = [lm[mp_pose.PoseLandmark.LEFT_KNEE.value].x, lm[mp_pose.PoseLandmark.LEFT_KNEE.value].y]
-            ankle = [lm[mp_pose.PoseLandmark.LEFT_ANKLE.value].x, lm[mp_pose.PoseLandmark.LEFT_ANKLE.value].y]
-            angle = calculate_angle(hip, knee, ankle)
-            if angle > 160: stage = "up"
-            if angle < 70 and stage == "up": stage, counter = "down", counter + 1
-            feedback = "Stand straight" if angle > 170 else ("Go lower" if angle < 50 else "")
-
-        elif exercise == "pushup":
-            shoulder = [lm[mp_pose.PoseLandmark.LEFT_SHOULDER.value].x, lm[mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
-            elbow = [lm[mp_pose.PoseLandmark.LEFT_ELBOW.value].x, lm[mp_pose.PoseLandmark.LEFT_ELBOW.value].y]
-            wrist = [lm[mp_pose.PoseLandmark.LEFT_WRIST.value].x, lm[mp_pose.PoseLandmark.LEFT_WRIST.value].y]
-            angle = calculate_angle(shoulder, elbow, wrist)
-            if angle > 160: stage = "up"
-            if angle < 90 and stage == "up": stage, counter = "down", counter + 1
-            feedback = "Locking out too much" if angle > 170 else ("Too low" if angle < 80 else "")
-
-        elif exercise == "curl":
-            shoulder = [lm[mp_pose.PoseLandmark.LEFT_SHOULDER.value].x, lm[mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
-            elbow = [lm[mp_pose.PoseLandmark.LEFT_ELBOW.value].x, lm[mp_pose.PoseLandmark.LEFT_ELBOW.value].y]
-            wrist = [lm[mp_pose.PoseLandmark.LEFT_WRIST.value].x, lm[mp_pose.PoseLandmark.LEFT_WRIST.value].y]
-            angle = calculate_angle(shoulder, elbow, wrist)
-            if angle > 160: stage = "down"
-            if angle < 50 and stage == "down": stage, counter = "up", counter + 1
-            feedback = "Arm too straight" if angle > 170 else ("Curl complete" if angle < 40 else "")
+        lm = zenmotion_core.landmarks_to_array(results.pose_landmarks.landmark)
+        if auto:
+            detected = detector.update(lm)
+            if detected and detected != exercise:
+                exercise = detected
+                reps.reset(exercise)
+                last_form = None
+        feedback = reps.update(zenmotion_core.joint_angle(lm, exercise))
+        # back at the top: score the rep that just finished
+        if reps.last_rep is not None:
+            last_form = form.score(reps.last_rep)
+            workout_log.log(dict(reps.last_rep.as_dict(), form=last_form), USER)
 
         mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
 
-    cv2.putText(image, f"{exercise.upper()} REPS: {counter}", (10,30),
+    label = f"AUTO: {exercise.upper()}" if auto else exercise.upper()
+    cv2.putText(image, f"{label} REPS: {reps.counter}", (10,30),
                 cv2.FONT_HERSHEY_SIMPLEX, 1, (255,255,255), 2, cv2.LINE_AA)
     cv2.putText(image, feedback, (10,70),
                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,255), 2, cv2.LINE_AA)
+    if last_form:
+        cv2.putText(image, f"FORM {last_form['score']}: {last_form['message']}", (10,110),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0,255,255), 2, cv2.LINE_AA)
+    if TARGET_FPS:
+        if pose.changed:
+            pose_status = pose.governor.describe()
+        cv2.putText(image, f"POSE: {pose_status}", (10,470),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,255), 1, cv2.LINE_AA)
     return image
 
 def handle_frame(js_reply):
     image = js_to_image(js_reply)
     image = cv2.resize(image, (640,480))
     processed = process_frame(image)
+    if recorder:
+        # copied into shared memory; encoding happens in the recorder's process
+        rep = reps.last_rep
+        recorder.push(processed, rep is not None, dict(rep.as_dict(), form=last_form) if rep else None)
     return bbox_to_bytes(processed)
 
 output.register_callback('notebook.run_frame', handle_frame)
 
 # --- UI Buttons ---
 def set_exercise(change):
-    global exercise, counter, stage
-    exercise = change['new']
-    counter, stage = 0, None
+    global exercise, auto, last_form
+    auto = change['new'] == 'auto'
+    if auto:
+        detector.reset()
+    else:
+        exercise = change['new']
+    reps.reset(exercise)
+    last_form = None
     print(f"Switched to: {exercise}")
 
 exercise_selector = widgets.ToggleButtons(
-    options=['squat', 'pushup', 'curl'],
+    options=['squat', 'pushup', 'curl', 'auto'],
     description='Exercise:',
     disabled=False,
     button_style='info'
@@ -134,5 +155,20 @@ exercise_selector = widgets.ToggleButtons(
 exercise_selector.observe(set_exercise, names='value')
 display(exercise_selector)
 
+def toggle_recording(change):
+    global recorder
+    if change['new']:
+        # spawn: MediaPipe's threads already exist, forking now could deadlock
+        recorder = zenmotion_recorder.Recorder(time.strftime("recordings/%Y%m%d-%H%M%S"),
+                                               start_method="spawn").start()
+        print(f"Recording to {recorder.out_dir}")
+    elif recorder:
+        rec, recorder = recorder, None
+        print(f"Saved {rec.out_dir}: {rec.close()}")
+
+record_button = widgets.ToggleButton(value=False, description='Record', icon='circle', button_style='danger')
+record_button.observe(toggle_recording, names='value')
+display(record_button)
+
 # --- Start video stream ---
 video_stream()
@@ -2,6 +2,9 @@ import streamlit as st
 import cv2
 import mediapipe as mp
 import numpy as np
+import time
+import zenmotion_core
+import zenmotion_log
 
 # --- Streamlit UI setup ---
 st.set_page_config(page_title="ZenMotion AI", layout="wide")
@@ -10,6 +13,14 @@ st.title("🏋️ ZenMotion AI – Your Smart Fitness & Wellness Coach")
 # Sidebar controls
 exercise = st.sidebar.radio("Choose Exercise", ["Squat", "Pushup", "Curl"])
 st.sidebar.write("Selected Exercise:", exercise)
+user = st.sidebar.text_input("Your name", value="me")
+
+# --- Workout log: every rep is kept in SQLite, across restarts and resets ---
+@st.cache_resource
+def get_workout_log():
+    return zenmotion_log.WorkoutLog()  # one background writer for all sessions
+
+workout_log = get_workout_log()
 
 # --- Mediapipe setup ---
 mp_drawing = mp.solutions.drawing_utils
@@ -25,12 +36,16 @@ def calculate_angle(a, b, c):
 
 # State variables
 if "counter" not in st.session_state: st.session_state.counter = 0
-if "stage" not in st.session_state: st.session_state.stage = None
+# RepCounter follows each rep from the top back to the top, so the logged rep
+# has its real lowest/highest angle and duration, and is logged once finished
+if "reps" not in st.session_state: st.session_state.reps = zenmotion_core.RepCounter(exercise.lower())
+if st.session_state.reps.exercise != exercise.lower(): st.session_state.reps.reset(exercise.lower())
 
 def process_exercise(image, exercise):
     global feedback
     results = pose.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
     feedback = ""
+    reps = st.session_state.reps
 
     if results.pose_landmarks:
         lm = results.pose_landmarks.landmark
@@ -41,10 +56,6 @@ def process_exercise(image, exercise):
             ankle = [lm[mp_pose.PoseLandmark.LEFT_ANKLE.value].x, lm[mp_pose.PoseLandmark.LEFT_ANKLE.value].y]
             angle = calculate_angle(hip, knee, ankle)
 
-            if angle > 160: st.session_state.stage = "up"
-            if angle < 70 and st.session_state.stage == "up":
-                st.session_state.stage = "down"
-                st.session_state.counter += 1
             feedback = "Stand tall" if angle > 170 else ("Go deeper" if angle < 50 else "")
 
         elif exercise == "Pushup":
@@ -53,10 +64,6 @@ def process_exercise(image, exercise):
             wrist = [lm[mp_pose.PoseLandmark.LEFT_WRIST.value].x, lm[mp_pose.PoseLandmark.LEFT_WRIST.value].y]
             angle = calculate_angle(shoulder, elbow, wrist)
 
-            if angle > 160: st.session_state.stage = "up"
-            if angle < 90 and st.session_state.stage == "up":
-                st.session_state.stage = "down"
-                st.session_state.counter += 1
             feedback = "Lockout" if angle > 170 else ("Too low" if angle < 80 else "")
 
         elif exercise == "Curl":
@@ -65,12 +72,15 @@ def process_exercise(image, exercise):
             wrist = [lm[mp_pose.PoseLandmark.LEFT_WRIST.value].x, lm[mp_pose.PoseLandmark.LEFT_WRIST.value].y]
             angle = calculate_angle(shoulder, elbow, wrist)
 
-            if angle > 160: st.session_state.stage = "down"
-            if angle < 50 and st.session_state.stage == "down":
-                st.session_state.stage = "up"
-                st.session_state.counter += 1
             feedback = "Arm too straight" if angle > 170 else ("Good curl!" if angle < 40 else "")
 
+        before = reps.counter
+        reps.update(angle)
+        st.session_state.counter += reps.counter - before
+        if reps.last_rep is not None:
+            # back at the top: log the finished rep
+            workout_log.log(reps.last_rep.as_dict(), user)
+
         # Draw landmarks
         mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
 
@@ -93,8 +103,21 @@ if camera_input:
     # Show annotated image
     st.image(cv2.cvtColor(processed, cv2.COLOR_BGR2RGB), channels="RGB")
 
+# History survives Reset Counter; reps show up here within a second of counting
+with st.expander("📈 Workout history"):
+    weekly = workout_log.weekly(user, weeks=4)
+    if weekly:
+        st.write("Weekly summary")
+        st.dataframe([{k: w[k] for k in ("week", "exercise", "reps", "best_depth")} for w in weekly])
+        st.write("Recent reps")
+        st.dataframe([{"time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["ended_at"])),
+                       "exercise": r["exercise"], "angle": round(r["min_angle"], 1), "feedback": r["feedback"]}
+                      for r in workout_log.history(user, limit=20)])
+    else:
+        st.write("No reps logged yet.")
+
 # Reset button
 if st.button("🔄 Reset Counter"):
     st.session_state.counter = 0
-    st.session_state.stage = None
+    st.session_state.reps.reset()
     st.success("Counter reset!")
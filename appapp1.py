@@ -2,12 +2,17 @@
 import streamlit as st
 import pandas as pd
 import sqlalchemy as sa
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 import datetime
+import csv
 import io
 import os
+import sys
+import tempfile
+import time
+import uuid
 
 # ---------- config ----------
 DB_PATH = os.environ.get("INVENTORY_DB", "inventory.db")
@@ -29,6 +34,8 @@ class Item(Base):
     qty_on_hand = Column(Integer, default=0)
     reorder_level = Column(Integer, default=0)
     notes = Column(Text, default="")
+    # sync watermark (stock_sync.py); bumped by every ORM update
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True)
 
 class StocktakeSession(Base):
     __tablename__ = "stocktake_sessions"
@@ -46,35 +53,299 @@ class StocktakeCount(Base):
     counted_qty = Column(Integer, default=0)
     note = Column(Text, default="")
     session = relationship("StocktakeSession", back_populates="counts")
+
+# summary tables, kept in step with `items` by the triggers below
+class CategorySummary(Base):
+    __tablename__ = "category_summary"
+    category = Column(String, primary_key=True)
+    sku_count = Column(Integer, default=0)
+    units = Column(Integer, default=0)
+    stock_value = Column(Float, default=0.0)
+
+class LowStockItem(Base):
+    __tablename__ = "low_stock_items"
+    item_id = Column(Integer, primary_key=True)
+
+# append-only stock ledger; every qty_on_hand change adds one row
+class StockMovement(Base):
+    __tablename__ = "stock_movements"
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
+    occurred_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    delta = Column(Integer, nullable=False)
+    qty_after = Column(Integer, nullable=False)
+    reason = Column(String, default="edit")  # opening, create, edit, import, stocktake, delete
+    ref = Column(String, nullable=True)      # e.g. stocktake session id
+    item = relationship("Item")
+    __table_args__ = (
+        # covering indexes: per-item history, date-range reports, variance trends
+        Index("ix_stock_movements_item_time", "item_id", "occurred_at", "delta", "qty_after"),
+        Index("ix_stock_movements_time_item", "occurred_at", "item_id", "delta", "reason"),
+        Index("ix_stock_movements_reason_time", "reason", "occurred_at", "delta"),
+    )
+
+# periodic per-item snapshots of the ledger
+class StockSnapshotRun(Base):
+    __tablename__ = "stock_snapshot_runs"
+    id = Column(Integer, primary_key=True)
+    taken_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False, index=True)
+    last_movement_id = Column(Integer, nullable=False, default=0)
+
+class StockSnapshot(Base):
+    __tablename__ = "stock_snapshots"
+    run_id = Column(Integer, ForeignKey("stock_snapshot_runs.id"), primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+    qty = Column(Integer, nullable=False)
+    __table_args__ = (Index("ix_stock_snapshots_run_item_qty", "run_id", "item_id", "qty"),)
+# ----------------------------
+
+# ---------- summary triggers ----------
+# Every write path (ORM edits, imports, stocktake adjustments, raw SQL) goes
+# through these, so Dashboard and Reports never have to scan `items`.
+SUMMARY_ADD_NEW = """
+    INSERT OR IGNORE INTO category_summary (category, sku_count, units, stock_value)
+        VALUES (COALESCE(NEW.category, ''), 0, 0, 0.0);
+    UPDATE category_summary
+        SET sku_count = sku_count + 1,
+            units = units + COALESCE(NEW.qty_on_hand, 0),
+            stock_value = stock_value + COALESCE(NEW.qty_on_hand, 0) * COALESCE(NEW.cost, 0.0)
+        WHERE category = COALESCE(NEW.category, '');
+    INSERT OR REPLACE INTO low_stock_items (item_id)
+        SELECT NEW.id WHERE COALESCE(NEW.qty_on_hand, 0) <= COALESCE(NEW.reorder_level, 0);
+"""
+SUMMARY_REMOVE_OLD = """
+    UPDATE category_summary
+        SET sku_count = sku_count - 1,
+            units = units - COALESCE(OLD.qty_on_hand, 0),
+            stock_value = stock_value - COALESCE(OLD.qty_on_hand, 0) * COALESCE(OLD.cost, 0.0)
+        WHERE category = COALESCE(OLD.category, '');
+    DELETE FROM category_summary WHERE category = COALESCE(OLD.category, '') AND sku_count <= 0;
+    DELETE FROM low_stock_items WHERE item_id = OLD.id;
+"""
+SUMMARY_TRIGGERS = {
+    "items_summary_ai": f"AFTER INSERT ON items BEGIN {SUMMARY_ADD_NEW} END",
+    "items_summary_ad": f"AFTER DELETE ON items BEGIN {SUMMARY_REMOVE_OLD} END",
+    "items_summary_au": ("AFTER UPDATE OF id, category, qty_on_hand, cost, reorder_level ON items "
+                         f"BEGIN {SUMMARY_REMOVE_OLD} {SUMMARY_ADD_NEW} END"),
+}
+
+# from-scratch aggregates, used to (re)build and verify the summary tables
+CATEGORY_SUMMARY_SQL = """
+    SELECT COALESCE(category, '') AS category,
+           COUNT(*) AS sku_count,
+           COALESCE(SUM(qty_on_hand), 0) AS units,
+           COALESCE(SUM(COALESCE(qty_on_hand, 0) * COALESCE(cost, 0.0)), 0.0) AS stock_value
+    FROM items GROUP BY COALESCE(category, '')
+"""
+LOW_STOCK_SQL = "SELECT id FROM items WHERE COALESCE(qty_on_hand, 0) <= COALESCE(reorder_level, 0)"
+
+def rebuild_summaries(conn):
+    conn.execute(sa.text("DELETE FROM category_summary"))
+    conn.execute(sa.text("DELETE FROM low_stock_items"))
+    conn.execute(sa.text(f"INSERT INTO category_summary (category, sku_count, units, stock_value) {CATEGORY_SUMMARY_SQL}"))
+    conn.execute(sa.text(f"INSERT INTO low_stock_items (item_id) {LOW_STOCK_SQL}"))
+
+def install_summary_triggers(engine):
+    with engine.begin() as conn:
+        existing = {r[0] for r in conn.execute(sa.text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+        missing = [name for name in SUMMARY_TRIGGERS if name not in existing]
+        for name in missing:
+            conn.execute(sa.text(f"CREATE TRIGGER {name} {SUMMARY_TRIGGERS[name]}"))
+        if missing:
+            # first run against an existing database: backfill once
+            rebuild_summaries(conn)
 # ----------------------------
 
+# ---------- stock ledger ----------
+# Movements are recorded from the ORM flush, so every write path that
+# changes qty_on_hand through a session is covered. Callers label the
+# change with set_movement_reason() before committing.
+SNAPSHOT_EVERY = datetime.timedelta(days=1)
+
+def set_movement_reason(db, reason, ref=None):
+    db.info["movement_reason"] = reason
+    db.info["movement_ref"] = None if ref is None else str(ref)
+
+@sa.event.listens_for(SessionLocal, "before_flush")
+def record_stock_movements(session, flush_context, instances):
+    reason = session.info.get("movement_reason", "edit")
+    ref = session.info.get("movement_ref")
+    now = datetime.datetime.utcnow()
+    for obj in list(session.new):
+        if isinstance(obj, Item) and (obj.qty_on_hand or 0) != 0:
+            session.add(StockMovement(item=obj, occurred_at=now, delta=int(obj.qty_on_hand),
+                                      qty_after=int(obj.qty_on_hand),
+                                      reason="create" if reason == "edit" else reason, ref=ref))
+    for obj in list(session.dirty):
+        if not isinstance(obj, Item):
+            continue
+        hist = sa.inspect(obj).attrs.qty_on_hand.history
+        if not hist.has_changes():
+            continue
+        old = int(hist.deleted[0] or 0) if hist.deleted else 0
+        new = int(obj.qty_on_hand or 0)
+        if new != old:
+            session.add(StockMovement(item_id=obj.id, occurred_at=now, delta=new - old,
+                                      qty_after=new, reason=reason, ref=ref))
+    for obj in list(session.deleted):
+        if isinstance(obj, Item) and (obj.qty_on_hand or 0) != 0:
+            session.add(StockMovement(item_id=obj.id, occurred_at=now, delta=-int(obj.qty_on_hand),
+                                      qty_after=0, reason="delete", ref=ref))
+
+@sa.event.listens_for(SessionLocal, "after_commit")
+@sa.event.listens_for(SessionLocal, "after_soft_rollback")
+def clear_movement_reason(session, *args):
+    session.info.pop("movement_reason", None)
+    session.info.pop("movement_ref", None)
+
+def take_stock_snapshot(conn, when=None):
+    when = when or datetime.datetime.utcnow()
+    last_id = conn.execute(sa.select(sa.func.coalesce(sa.func.max(StockMovement.id), 0))).scalar()
+    run_id = conn.execute(sa.insert(StockSnapshotRun).values(taken_at=when, last_movement_id=last_id)).inserted_primary_key[0]
+    conn.execute(sa.text("INSERT INTO stock_snapshots (run_id, item_id, qty) "
+                         "SELECT :run_id, id, COALESCE(qty_on_hand, 0) FROM items"), {"run_id": run_id})
+    return run_id
+
+def ensure_stock_ledger(engine):
+    with engine.begin() as conn:
+        if conn.execute(sa.select(StockMovement.id).limit(1)).first() is None:
+            # existing database: open the ledger with the current balances
+            conn.execute(sa.text(
+                "INSERT INTO stock_movements (item_id, occurred_at, delta, qty_after, reason) "
+                "SELECT id, :now, qty_on_hand, qty_on_hand, 'opening' FROM items "
+                "WHERE COALESCE(qty_on_hand, 0) != 0").bindparams(sa.bindparam("now", type_=DateTime)),
+                {"now": datetime.datetime.utcnow()})
+        last = conn.execute(sa.select(sa.func.max(StockSnapshotRun.taken_at))).scalar()
+        if last is None or datetime.datetime.utcnow() - last >= SNAPSHOT_EVERY:
+            take_stock_snapshot(conn)
+
+def stock_at_query(db, when):
+    # nearest snapshot at or before `when`, plus the movements after it
+    run = (db.query(StockSnapshotRun).filter(StockSnapshotRun.taken_at <= when)
+           .order_by(StockSnapshotRun.taken_at.desc()).first())
+    run_id, after_id = (run.id, run.last_movement_id) if run else (-1, 0)
+    base = sa.select(StockSnapshot.item_id, StockSnapshot.qty.label("qty")).where(StockSnapshot.run_id == run_id)
+    moves = (sa.select(StockMovement.item_id, StockMovement.delta.label("qty"))
+             .where(StockMovement.id > after_id, StockMovement.occurred_at <= when))
+    u = sa.union_all(base, moves).subquery()
+    net = sa.select(u.c.item_id, sa.func.sum(u.c.qty).label("qty_on_hand")).group_by(u.c.item_id).subquery()
+    return (sa.select(net.c.item_id, Item.sku, Item.name, Item.category, net.c.qty_on_hand)
+            .outerjoin(Item, Item.id == net.c.item_id).order_by(Item.category, Item.name))
+
+def stock_at_df(db, when):
+    return pd.DataFrame(db.execute(stock_at_query(db, when)).mappings().all(),
+                        columns=["item_id", "sku", "name", "category", "qty_on_hand"])
+
+def movements_report_df(db, start, end):
+    q = (sa.select(StockMovement.item_id, Item.sku, Item.name, StockMovement.reason,
+                   sa.func.sum(sa.case((StockMovement.delta > 0, StockMovement.delta), else_=0)).label("units_in"),
+                   sa.func.sum(sa.case((StockMovement.delta < 0, -StockMovement.delta), else_=0)).label("units_out"),
+                   sa.func.count().label("movements"))
+         .outerjoin(Item, Item.id == StockMovement.item_id)
+         .where(StockMovement.occurred_at >= start, StockMovement.occurred_at <= end)
+         .group_by(StockMovement.item_id, StockMovement.reason)
+         .order_by(Item.sku, StockMovement.reason))
+    return pd.DataFrame(db.execute(q).mappings().all(),
+                        columns=["item_id", "sku", "name", "reason", "units_in", "units_out", "movements"])
+
+def variance_trend_df(db, start, end):
+    day = sa.func.date(StockMovement.occurred_at)
+    q = (sa.select(day.label("day"), sa.func.sum(StockMovement.delta).label("net_variance"),
+                   sa.func.sum(sa.func.abs(StockMovement.delta)).label("abs_variance"),
+                   sa.func.count().label("adjusted_items"))
+         .where(StockMovement.reason == "stocktake",
+                StockMovement.occurred_at >= start, StockMovement.occurred_at <= end)
+         .group_by(day).order_by(day))
+    return pd.DataFrame(db.execute(q).mappings().all(),
+                        columns=["day", "net_variance", "abs_variance", "adjusted_items"])
+# ----------------------------
+
+def add_missing_columns(engine):
+    # create_all() does not alter existing tables
+    with engine.begin() as conn:
+        cols = {r[1] for r in conn.execute(sa.text("PRAGMA table_info(items)"))}
+        if "updated_at" not in cols:
+            conn.execute(sa.text("ALTER TABLE items ADD COLUMN updated_at DATETIME"))
+            conn.execute(sa.text("CREATE INDEX IF NOT EXISTS ix_items_updated_at ON items (updated_at)"))
+        # rows from before the column existed: the sync orders and pages on
+        # the bare indexed column, which NULLs would break
+        conn.execute(sa.text("UPDATE items SET updated_at = :epoch WHERE updated_at IS NULL")
+                     .bindparams(sa.bindparam("epoch", type_=DateTime)), {"epoch": datetime.datetime(1970, 1, 1)})
+
 # create tables
 Base.metadata.create_all(ENGINE)
+add_missing_columns(ENGINE)
+install_summary_triggers(ENGINE)
+ensure_stock_ledger(ENGINE)
 
 # ---------- helpers ----------
 def get_session():
     return SessionLocal()
 
+def item_to_dict(i):
+    return {
+        "id": i.id,
+        "sku": i.sku,
+        "name": i.name,
+        "category": i.category,
+        "unit": i.unit,
+        "location": i.location,
+        "cost": i.cost,
+        "qty_on_hand": i.qty_on_hand,
+        "reorder_level": i.reorder_level,
+        "notes": i.notes
+    }
+
 def items_df(db):
     items = db.query(Item).order_by(Item.category, Item.name).all()
-    rows = []
-    for i in items:
-        rows.append({
-            "id": i.id,
-            "sku": i.sku,
-            "name": i.name,
-            "category": i.category,
-            "unit": i.unit,
-            "location": i.location,
-            "cost": i.cost,
-            "qty_on_hand": i.qty_on_hand,
-            "reorder_level": i.reorder_level,
-            "notes": i.notes
-        })
-    return pd.DataFrame(rows)
+    return pd.DataFrame([item_to_dict(i) for i in items])
+
+# Summary readers: O(categories) / O(low-stock items), never a full scan
+def category_summary_df(db):
+    rows = db.query(CategorySummary).order_by(CategorySummary.stock_value.desc()).all()
+    return pd.DataFrame([{
+        "category": r.category,
+        "sku_count": r.sku_count,
+        "units": r.units,
+        "stock_value": r.stock_value
+    } for r in rows], columns=["category", "sku_count", "units", "stock_value"])
+
+def low_stock_df(db):
+    items = (db.query(Item).join(LowStockItem, LowStockItem.item_id == Item.id)
+             .order_by(Item.category, Item.name).all())
+    return pd.DataFrame([item_to_dict(i) for i in items])
+
+def verify_summaries(db, tolerance=1e-6):
+    # recompute from scratch and diff against the maintained tables
+    conn = db.connection()
+    fresh = {r.category: r for r in conn.execute(sa.text(CATEGORY_SUMMARY_SQL))}
+    kept = {r.category: r for r in db.query(CategorySummary).all()}
+    problems = []
+    for category in sorted(set(fresh) | set(kept)):
+        f, k = fresh.get(category), kept.get(category)
+        if f is None or k is None:
+            problems.append(f"category {category!r}: {'extra' if f is None else 'missing'} summary row")
+            continue
+        for field in ("sku_count", "units"):
+            if getattr(f, field) != getattr(k, field):
+                problems.append(f"category {category!r}: {field} {getattr(k, field)} != {getattr(f, field)}")
+        if abs(f.stock_value - k.stock_value) > tolerance * max(1.0, abs(f.stock_value)):
+            problems.append(f"category {category!r}: stock_value {k.stock_value} != {f.stock_value}")
+    fresh_low = {r[0] for r in conn.execute(sa.text(LOW_STOCK_SQL))}
+    kept_low = {r.item_id for r in db.query(LowStockItem).all()}
+    for item_id in sorted(fresh_low - kept_low):
+        problems.append(f"item {item_id}: missing from low_stock_items")
+    for item_id in sorted(kept_low - fresh_low):
+        problems.append(f"item {item_id}: stale in low_stock_items")
+    ledger = {r.item_id: r.qty_on_hand for r in db.execute(stock_at_query(db, datetime.datetime.utcnow()))}
+    for item_id, qty in db.query(Item.id, Item.qty_on_hand):
+        if (qty or 0) != (ledger.get(item_id) or 0):
+            problems.append(f"item {item_id}: ledger balance {ledger.get(item_id) or 0} != qty_on_hand {qty or 0}")
+    return problems
 
 def import_csv_to_db(db, df):
     # expected columns: sku, name, category, unit, location, cost, qty_on_hand, reorder_level, notes
+    set_movement_reason(db, "import")
     for _, row in df.iterrows():
         sku = str(row.get("sku", "")).strip()
         if sku == "":
@@ -105,9 +376,122 @@ def import_csv_to_db(db, df):
             db.add(itm)
     db.commit()
 
-def export_items_csv(db):
-    df = items_df(db)
-    return df
+# ---------- streaming export ----------
+# Rows are pulled from a streaming cursor in fixed-size chunks and written
+# straight to disk, so peak memory does not grow with the table.
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+XLSX_MAX_ROWS = 1048576  # per sheet, including the header
+# One export file per browser session, overwritten by the next export.
+# Files left behind by sessions that went away are removed after a day.
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "inventory_exports")
+EXPORT_MAX_AGE = 24 * 3600
+
+def items_export_query():
+    return sa.select(Item.id, Item.sku, Item.name, Item.category, Item.unit, Item.location,
+                     Item.cost, Item.qty_on_hand, Item.reorder_level, Item.notes).order_by(Item.id)
+
+def counts_export_query(session_id=None):
+    q = (sa.select(StocktakeCount.session_id, StocktakeSession.name.label("session_name"),
+                   StocktakeSession.created_at, StocktakeSession.completed_at,
+                   StocktakeCount.id.label("count_id"), StocktakeCount.item_id,
+                   Item.sku, Item.name, StocktakeCount.counted_qty, StocktakeCount.note)
+         .join(StocktakeSession, StocktakeSession.id == StocktakeCount.session_id)
+         .outerjoin(Item, Item.id == StocktakeCount.item_id)
+         .order_by(StocktakeCount.session_id, StocktakeCount.id))
+    if session_id is not None:
+        q = q.where(StocktakeCount.session_id == session_id)
+    return q
+
+def iter_row_chunks(conn, query, chunk_size=EXPORT_CHUNK_ROWS):
+    result = conn.execution_options(stream_results=True).execute(query)
+    yield list(result.keys())
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+def parquet_schema(query):
+    import pyarrow as pa
+    fields = []
+    for col in query.selected_columns:
+        if isinstance(col.type, Integer):
+            t = pa.int64()
+        elif isinstance(col.type, Float):
+            t = pa.float64()
+        elif isinstance(col.type, DateTime):
+            t = pa.timestamp("us")
+        else:
+            t = pa.string()
+        fields.append(pa.field(col.name, t))
+    return pa.schema(fields)
+
+def write_export(conn, query, path, fmt, chunk_size=EXPORT_CHUNK_ROWS):
+    # returns the number of data rows written
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    chunks = iter_row_chunks(conn, query, chunk_size)
+    header = next(chunks)
+    written = 0
+    if fmt == "csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(header)
+            for rows in chunks:
+                w.writerows(rows)
+                written += len(rows)
+    elif fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = parquet_schema(query)
+        with pq.ParquetWriter(path, schema, compression="zstd") as w:
+            for rows in chunks:
+                cols = list(zip(*rows))
+                w.write_table(pa.table([pa.array(c, type=f.type) for c, f in zip(cols, schema)], schema=schema))
+                written += len(rows)
+    else:
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)  # rows are flushed as they are appended
+        ws, sheet_rows = None, XLSX_MAX_ROWS
+        for rows in chunks:
+            for r in rows:
+                if sheet_rows >= XLSX_MAX_ROWS:
+                    ws = wb.create_sheet(f"export_{len(wb.sheetnames) + 1}")
+                    ws.append(header)
+                    sheet_rows = 1
+                ws.append(list(r))
+                sheet_rows += 1
+            written += len(rows)
+        if ws is None:
+            wb.create_sheet("export_1").append(header)
+        wb.save(path)
+    return written
+
+def prune_exports(max_age=EXPORT_MAX_AGE):
+    cutoff = time.time() - max_age
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass  # another session removed it first
+
+def export_to_session_file(db, query, fmt, session_key):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    prune_exports()
+    for other in EXPORT_FORMATS:  # the previous export, possibly in another format
+        old = os.path.join(EXPORT_DIR, f"{session_key}.{other}")
+        if other != fmt and os.path.exists(old):
+            os.remove(old)
+    path = os.path.join(EXPORT_DIR, f"{session_key}.{fmt}")
+    write_export(db.connection(), query, path, fmt)
+    return path
 
 # Stocktake helpers
 def create_stocktake_session(db, name):
@@ -119,6 +503,117 @@ def add_count(db, session_id, item_id, counted_qty, note=""):
     c = StocktakeCount(session_id=session_id, item_id=item_id, counted_qty=counted_qty, note=note)
     db.add(c); db.commit(); db.refresh(c)
     return c
+
+def session_counts_df(db, session_id):
+    rows = (db.query(StocktakeCount, Item).join(Item, Item.id == StocktakeCount.item_id)
+            .filter(StocktakeCount.session_id == session_id).order_by(StocktakeCount.id).all())
+    return pd.DataFrame([{
+        "item_id": itm.id,
+        "sku": itm.sku,
+        "name": itm.name,
+        "qty_on_hand": itm.qty_on_hand,
+        "counted_qty": c.counted_qty,
+        "variance": c.counted_qty - itm.qty_on_hand,
+        "note": c.note
+    } for c, itm in rows])
+
+# Rapid scan capture: scans are resolved through an in-memory SKU -> id index,
+# tallied per item, and written to stocktake_counts in batches.
+SCAN_FLUSH_EVERY = 50  # pending scans before an automatic flush
+SQL_IN_CHUNK = 500
+
+def build_sku_index(db):
+    return dict(db.query(Item.sku, Item.id).all())
+
+def lookup_skus(db, skus):
+    # sku -> id for just these SKUs, through the sku index
+    skus, found = list(skus), {}
+    for start in range(0, len(skus), SQL_IN_CHUNK):
+        found.update(db.query(Item.sku, Item.id).filter(Item.sku.in_(skus[start:start + SQL_IN_CHUNK])).all())
+    return found
+
+def parse_scans(text):
+    # one scan per token; "SKU*3" or "SKU,3" records a quantity of 3
+    scans = []
+    for token in text.replace("\r", "\n").split():
+        sep = "*" if "*" in token else ("," if "," in token else None)
+        if sep:
+            sku, _, qty = token.rpartition(sep)
+            try:
+                scans.append((sku.strip(), int(qty)))
+                continue
+            except ValueError:
+                pass
+        scans.append((token.strip(), 1))
+    return [(sku, qty) for sku, qty in scans if sku]
+
+def tally_scans(scans, sku_index, pending, unknown):
+    # adds into `pending` (item_id -> qty); returns how many scans resolved
+    resolved = 0
+    for sku, qty in scans:
+        item_id = sku_index.get(sku)
+        if item_id is None:
+            unknown[sku] = unknown.get(sku, 0) + qty
+            continue
+        pending[item_id] = pending.get(item_id, 0) + qty
+        resolved += 1
+    return resolved
+
+def flush_scan_counts(db, session_id, pending, note="scan"):
+    # one transaction per batch; scanned quantities add onto existing counts
+    if not pending:
+        return 0
+    ids = list(pending)
+    existing = {}
+    for start in range(0, len(ids), SQL_IN_CHUNK):
+        for c in (db.query(StocktakeCount)
+                  .filter(StocktakeCount.session_id == session_id,
+                          StocktakeCount.item_id.in_(ids[start:start + SQL_IN_CHUNK]))
+                  .order_by(StocktakeCount.id)):
+            existing[c.item_id] = c
+    for item_id, qty in pending.items():
+        if item_id in existing:
+            existing[item_id].counted_qty = (existing[item_id].counted_qty or 0) + qty
+        else:
+            db.add(StocktakeCount(session_id=session_id, item_id=item_id, counted_qty=qty, note=note))
+    db.commit()
+    flushed = len(pending)
+    pending.clear()
+    return flushed
+# ----------------------------
+
+# ---------- cli ----------
+# python appapp1.py --verify-summaries   (exit 1 on drift)
+# python appapp1.py --rebuild-summaries
+# python appapp1.py --export-items inventory.parquet   (format from extension)
+# python appapp1.py --export-counts counts.csv [--session ID]
+# python appapp1.py --snapshot   (take a stock snapshot now, e.g. from cron)
+if "--snapshot" in sys.argv:
+    with ENGINE.begin() as conn:
+        print(f"Snapshot run {take_stock_snapshot(conn)} taken.")
+    sys.exit(0)
+for flag, make_query in (("--export-items", items_export_query), ("--export-counts", counts_export_query)):
+    if flag in sys.argv:
+        out_path = sys.argv[sys.argv.index(flag) + 1]
+        if flag == "--export-counts" and "--session" in sys.argv:
+            query = make_query(int(sys.argv[sys.argv.index("--session") + 1]))
+        else:
+            query = make_query()
+        with get_session() as cli_db:
+            n = write_export(cli_db.connection(), query, out_path, os.path.splitext(out_path)[1].lstrip(".").lower())
+        print(f"Wrote {n} rows to {out_path}")
+        sys.exit(0)
+if "--verify-summaries" in sys.argv or "--rebuild-summaries" in sys.argv:
+    with get_session() as cli_db:
+        if "--rebuild-summaries" in sys.argv:
+            rebuild_summaries(cli_db.connection())
+            cli_db.commit()
+            print("Summary tables rebuilt.")
+        problems = verify_summaries(cli_db)
+    for p in problems:
+        print(p)
+    print("Summary tables OK." if not problems else f"{len(problems)} mismatches.")
+    sys.exit(1 if problems else 0)
 # ----------------------------
 
 # ---------- UI ----------
@@ -131,11 +626,11 @@ menu = st.sidebar.selectbox("Menu", ["Dashboard", "Inventory", "Stocktake", "Imp
 
 if menu == "Dashboard":
     st.header("Dashboard")
-    df = items_df(db)
-    st.metric("Total SKUs", len(df))
-    total_items = int(df["qty_on_hand"].sum()) if not df.empty else 0
+    cat = category_summary_df(db)
+    st.metric("Total SKUs", int(cat["sku_count"].sum()))
+    total_items = int(cat["units"].sum())
     st.metric("Total units on hand", total_items)
-    low = df[df["qty_on_hand"] <= df["reorder_level"]] if not df.empty else pd.DataFrame() # Ensure 'low' is a DataFrame even if df is empty
+    low = low_stock_df(db)
     st.subheader("Low stock items")
     if low.empty:
         st.info("No items below reorder level.")
@@ -162,6 +657,7 @@ elif menu == "Inventory":
             if submit:
                 existing = db.query(Item).filter(Item.sku == sku).first()
                 if existing:
+                    set_movement_reason(db, "edit")
                     existing.name = name
                     existing.category = category
                     existing.unit = unit
@@ -209,6 +705,7 @@ elif menu == "Inventory":
                         reorder_level = st.number_input("Reorder level", value=int(itm.reorder_level))
                         notes = st.text_area("Notes", value=itm.notes)
                         if st.button("Save changes"):
+                            set_movement_reason(db, "edit")
                             itm.name = name; itm.sku=sku; itm.category=category; itm.unit=unit
                             itm.location=location; itm.cost=float(cost); itm.qty_on_hand=int(qty_on_hand)
                             itm.reorder_level=int(reorder_level); itm.notes=notes
@@ -239,35 +736,76 @@ elif menu == "Stocktake":
             session = db.query(StocktakeSession).get(sid)
             st.write(f"Session: {session.name} — created {session.created_at}")
             st.markdown("**Record counts**")
-            df = items_df(db)
-            if df.empty:
-                st.info("No items in inventory.")
+            capture = st.radio("Capture mode", ["Single item", "Rapid scan"], horizontal=True)
+            if capture == "Rapid scan":
+                # a fragment: each scan reruns only this block, not the whole page
+                # with its session counts table. Explicit saves rerun the page so
+                # the table catches up; automatic flushes show on the next one.
+                @st.fragment
+                def rapid_scan():
+                    scan = st.session_state.setdefault(f"scan_{sid}", {"pending": {}, "unknown": {}, "scans": 0})
+                    if "scan_saved" in st.session_state:
+                        st.success(st.session_state.pop("scan_saved"))
+                    if "sku_index" not in st.session_state:
+                        st.session_state.sku_index = build_sku_index(db)
+
+                    def ingest(scans):
+                        index = st.session_state.sku_index
+                        missing = {sku for sku, _ in scans if sku not in index}
+                        if missing:
+                            # items may have been added since the index was built;
+                            # look up only these, not the whole catalogue again
+                            index.update(lookup_skus(db, missing))
+                        scan["scans"] += tally_scans(scans, index, scan["pending"], scan["unknown"])
+                        if scan["scans"] >= SCAN_FLUSH_EVERY:
+                            flush_scan_counts(db, sid, scan["pending"])
+                            scan["scans"] = 0
+
+                    def on_scan():
+                        raw = st.session_state.scan_input
+                        st.session_state.scan_input = ""
+                        ingest(parse_scans(raw))
+
+                    st.text_input("Scan SKU (keyboard-wedge scanners send Enter after each code)",
+                                  key="scan_input", on_change=on_scan)
+                    scan_log = st.file_uploader("Or upload a scan log (one SKU per line, SKU*qty or SKU,qty)",
+                                                type=["txt", "csv"], key=f"scan_log_{sid}")
+                    if scan_log and st.button("Ingest scan log"):
+                        ingest(parse_scans(scan_log.getvalue().decode("utf-8", errors="replace")))
+                        flush_scan_counts(db, sid, scan["pending"])
+                        scan["scans"] = 0
+                        st.session_state.scan_saved = "Scan log counted."
+                        st.rerun()
+                    st.write(f"Pending (not yet saved): {sum(scan['pending'].values())} units "
+                             f"across {len(scan['pending'])} items")
+                    if scan["unknown"]:
+                        st.warning("Unknown SKUs: " + ", ".join(f"{k} ×{v}" for k, v in scan["unknown"].items()))
+                    if st.button("Save pending scans"):
+                        n = flush_scan_counts(db, sid, scan["pending"])
+                        scan["scans"] = 0
+                        st.session_state.scan_saved = f"Saved counts for {n} items."
+                        st.rerun()
+                rapid_scan()
             else:
-                # choose by SKU or ID
-                row = st.selectbox("Pick item (SKU - Name)", options=[f"{r.sku} — {r.name} (id:{r.id})" for _, r in df.iterrows()])
-                chosen_id = int(row.split("id:")[-1].strip(")"))
-                counted = st.number_input("Counted quantity", min_value=0, value=0, step=1)
-                note = st.text_input("Note (optional)")
-                if st.button("Save count"):
-                    add_count(db, session.id, chosen_id, int(counted), note)
-                    st.success("Count saved.")
+                df = items_df(db)
+                if df.empty:
+                    st.info("No items in inventory.")
+                else:
+                    # choose by SKU or ID
+                    row = st.selectbox("Pick item (SKU - Name)", options=[f"{r.sku} — {r.name} (id:{r.id})" for _, r in df.iterrows()])
+                    chosen_id = int(row.split("id:")[-1].strip(")"))
+                    counted = st.number_input("Counted quantity", min_value=0, value=0, step=1)
+                    note = st.text_input("Note (optional)")
+                    if st.button("Save count"):
+                        add_count(db, session.id, chosen_id, int(counted), note)
+                        st.success("Count saved.")
             st.subheader("Session counts")
             counts = db.query(StocktakeCount).filter(StocktakeCount.session_id == session.id).all()
             if counts:
-                rows = []
-                for c in counts:
-                    itm = db.query(Item).get(c.item_id)
-                    rows.append({
-                        "item_id": itm.id,
-                        "sku": itm.sku,
-                        "name": itm.name,
-                        "qty_on_hand": itm.qty_on_hand,
-                        "counted_qty": c.counted_qty,
-                        "variance": c.counted_qty - itm.qty_on_hand,
-                        "note": c.note
-                    })
-                st.dataframe(pd.DataFrame(rows))
+                st.dataframe(session_counts_df(db, session.id))
                 if st.button("Apply adjustments (set qty_on_hand = counted)"):
+                    # label before mutating: the lookups below autoflush
+                    set_movement_reason(db, "stocktake", session.id)
                     for c in counts:
                         itm = db.query(Item).get(c.item_id)
                         itm.qty_on_hand = c.counted_qty
@@ -297,31 +835,88 @@ elif menu == "Import/Export":
         except Exception as e:
             st.error(f"Error reading file: {e}")
 
-    st.subheader("Export CSV")
-    if st.button("Download inventory CSV"):
-        out_df = export_items_csv(db)
-        buf = io.StringIO()
-        out_df.to_csv(buf, index=False)
-        st.download_button("Download CSV", data=buf.getvalue(), file_name="inventory_export.csv", mime="text/csv")
+    st.subheader("Export")
+    what = st.radio("Data", ["Inventory", "Stocktake count history"], horizontal=True)
+    fmt = st.selectbox("Format", list(EXPORT_FORMATS))
+    if what == "Inventory":
+        query, base_name = items_export_query(), "inventory_export"
+    else:
+        sessions = db.query(StocktakeSession).order_by(StocktakeSession.created_at.desc()).all()
+        pick = st.selectbox("Session", ["All sessions"] + [f"{s.id} — {s.name}" for s in sessions])
+        session_id = None if pick == "All sessions" else int(pick.split(" — ")[0])
+        query, base_name = counts_export_query(session_id), "stocktake_counts_export"
+    if st.button("Prepare export"):
+        st.session_state.pop("export_file", None)
+        session_key = st.session_state.setdefault("export_key", uuid.uuid4().hex)
+        try:
+            path = export_to_session_file(db, query, fmt, session_key)
+            st.session_state.export_file = (path, f"{base_name}.{fmt}", EXPORT_FORMATS[fmt])
+        except ImportError as e:
+            st.error(f"{fmt} export needs an extra package: {e.name}")
+    if "export_file" in st.session_state:
+        path, file_name, mime = st.session_state.export_file
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                st.download_button(f"Download {file_name}", data=f, file_name=file_name, mime=mime)
+        else:  # pruned while the session sat idle
+            st.session_state.pop("export_file")
+            st.info("The prepared export expired; prepare it again.")
 
 elif menu == "Reports":
     st.header("Reports")
-    df = items_df(db)
-    if df.empty:
+    cat = category_summary_df(db)
+    if cat.empty:
         st.write("No data.")
     else:
         st.subheader("Low stock (qty <= reorder_level)")
-        low = df[df["qty_on_hand"] <= df["reorder_level"]]
-        st.dataframe(low)
+        st.dataframe(low_stock_df(db))
         st.subheader("Stock value by category")
-        df["stock_value"] = df["qty_on_hand"] * df["cost"]
-        cat = df.groupby("category")["stock_value"].sum().reset_index().sort_values("stock_value", ascending=False)
-        st.dataframe(cat)
-        st.metric("Total stock value", f"{df['stock_value'].sum():.2f}")
+        st.dataframe(cat[["category", "stock_value"]])
+        st.metric("Total stock value", f"{cat['stock_value'].sum():.2f}")
+
+    st.subheader("Stock history")
+    today = datetime.date.today()
+    period = st.date_input("Period", value=(today - datetime.timedelta(days=30), today))
+    start, end = period if len(period) == 2 else (period[0], period[0])
+    start_dt = datetime.datetime.combine(start, datetime.time.min)
+    end_dt = datetime.datetime.combine(end, datetime.time.max)
+    st.markdown(f"**Stock on hand at end of {end.isoformat()}**")
+    st.dataframe(stock_at_df(db, end_dt))
+    st.markdown("**Movements in period**")
+    st.dataframe(movements_report_df(db, start_dt, end_dt))
+    trend = variance_trend_df(db, start_dt, end_dt)
+    st.markdown("**Stocktake variance trend**")
+    if trend.empty:
+        st.write("No stocktake adjustments in this period.")
+    else:
+        st.line_chart(trend.set_index("day")[["net_variance", "abs_variance"]])
 
 elif menu == "Settings":
     st.header("Settings")
     st.write("DB path:", DB_PATH)
+    if st.button("Verify summary tables"):
+        problems = verify_summaries(db)
+        if problems:
+            st.error(f"{len(problems)} mismatches found.")
+            st.write(problems)
+        else:
+            st.success("Summary tables match the items table.")
+    if st.button("Rebuild summary tables"):
+        rebuild_summaries(db.connection()); db.commit()
+        st.success("Rebuilt summary tables from items.")
+
+    st.subheader("Sync with Firestore")
+    cred_path = os.environ.get("FIREBASE_CREDENTIALS", "serviceAccountKey.json")
+    if not os.path.exists(cred_path):
+        st.info(f"Set FIREBASE_CREDENTIALS or place {cred_path} next to the app to enable sync.")
+    elif st.button("Sync now"):
+        import stock_sync
+        try:
+            stats = stock_sync.sync(stock_sync.SqliteStockStore(ENGINE),
+                                    stock_sync.FirestoreStockStore(stock_sync.firestore_client(cred_path)))
+            st.success(f"Synced: {stats}")
+        except Exception as e:
+            st.error(f"Sync failed: {e}")
     if st.button("Download sample CSV"):
         sample = pd.DataFrame([{
             "sku":"SKU001","name":"White chair cover","category":"Fabric","unit":"pcs","location":"Warehouse A","cost":2.5,"qty_on_hand":120,"reorder_level":20,"notes":"Polyester"
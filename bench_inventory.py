@@ -0,0 +1,205 @@
+# bench_inventory.py
+# Headless benchmark for appapp1.py: generates a synthetic catalogue and
+# stocktake session in a temp INVENTORY_DB, times the data paths the UI uses,
+# and writes the results as JSON so runs can be compared between versions.
+#
+#   python bench_inventory.py                          # 10k and 100k items
+#   python bench_inventory.py --sizes 10000 100000 1000000 --out bench_results.json
+#   python bench_inventory.py --compare old_results.json
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CATEGORIES = ["Fabric", "Decor", "Lighting", "Furniture", "Tableware", "Tents", "Audio", "Florals",
+              "Linen", "Staging", "Signage", "Catering", "Cables", "Power", "Cleaning", "Stationery"]
+UNITS = ["pcs", "m", "roll", "set", "box", "pair"]
+LOCATIONS = [f"Warehouse {c}" for c in "ABCDEF"]
+
+# ---------- data generator ----------
+def synthetic_items(n, seed=0, start=0):
+    rnd = random.Random(seed + start)
+    for i in range(start, start + n):
+        reorder = rnd.choice([0, 5, 10, 20, 50])
+        yield {
+            "sku": f"SKU{i:08d}",
+            "name": f"{rnd.choice(CATEGORIES)} item {i}",
+            "category": rnd.choices(CATEGORIES, weights=range(len(CATEGORIES), 0, -1))[0],
+            "unit": rnd.choice(UNITS),
+            "location": rnd.choice(LOCATIONS),
+            "cost": round(rnd.lognormvariate(2.0, 1.0), 2),
+            "qty_on_hand": max(0, int(rnd.gauss(reorder * 3, reorder + 10))),
+            "reorder_level": reorder,
+            "notes": "",
+        }
+
+def load_catalogue(app, n, seed=0, chunk=20000):
+    # bulk insert through Core; the summary triggers still fire per row
+    with app.ENGINE.begin() as conn:
+        for start in range(0, n, chunk):
+            conn.execute(app.sa.insert(app.Item), list(synthetic_items(min(chunk, n - start), seed, start)))
+        # Core inserts bypass the ORM ledger hook, so open the ledger here
+        conn.execute(app.sa.text(
+            "INSERT INTO stock_movements (item_id, occurred_at, delta, qty_after, reason) "
+            "SELECT id, :now, qty_on_hand, qty_on_hand, 'opening' FROM items "
+            "WHERE COALESCE(qty_on_hand, 0) != 0").bindparams(app.sa.bindparam("now", type_=app.DateTime)),
+            {"now": datetime.datetime.utcnow()})
+        app.take_stock_snapshot(conn)
+
+def load_stocktake(app, n, fraction, seed=0):
+    rnd = random.Random(seed)
+    db = app.get_session()
+    session = app.create_stocktake_session(db, "Benchmark stocktake")
+    ids = rnd.sample(range(1, n + 1), max(1, int(n * fraction)))
+    with app.ENGINE.begin() as conn:
+        qty = dict(conn.execute(app.sa.select(app.Item.id, app.Item.qty_on_hand)).all()) if ids else {}
+        rows = [{"session_id": session.id, "item_id": i, "counted_qty": max(0, qty[i] + rnd.randint(-3, 3)),
+                 "note": ""} for i in ids]
+        for start in range(0, len(rows), 20000):
+            conn.execute(app.sa.insert(app.StocktakeCount), rows[start:start + 20000])
+    db.close()
+    return session.id, len(rows)
+
+def import_frame(app, n, rows, seed=1):
+    # half updates to existing SKUs, half new SKUs
+    existing = list(synthetic_items(rows // 2, seed, start=max(0, n - rows // 2)))
+    new = list(synthetic_items(rows - rows // 2, seed, start=n + 1))
+    return app.pd.DataFrame(existing + new)
+# ----------------------------
+
+# ---------- timing ----------
+def timed(fn, repeat):
+    times, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return {
+        "repeat": repeat,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "max_s": max(times),
+    }, result
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def run_one(size, repeat, import_rows, count_fraction, db_path):
+    os.environ["INVENTORY_DB"] = db_path
+    sys.argv = [sys.argv[0]]  # keep appapp1's CLI flags out of the import
+    sys.path.insert(0, HERE)
+    import appapp1 as app  # bare-mode import: Streamlit calls are no-ops on the empty DB
+
+    ops = {}
+    t0 = time.perf_counter()
+    load_catalogue(app, size)
+    session_id, counted = load_stocktake(app, size, count_fraction)
+    ops["generate"] = {"repeat": 1, "min_s": time.perf_counter() - t0, "items": size, "counts": counted}
+
+    db = app.get_session()
+    ops["items_df"], df = timed(lambda: app.items_df(db), repeat)
+    ops["items_df"]["rows"] = len(df)
+    del df
+    ops["session_counts"], df = timed(lambda: app.session_counts_df(db, session_id), repeat)
+    ops["session_counts"]["rows"] = len(df)
+    ops["reports"], _ = timed(lambda: (app.category_summary_df(db), app.low_stock_df(db)), repeat)
+    ops["dashboard"], _ = timed(lambda: app.category_summary_df(db), repeat)
+    ops["stock_at"], _ = timed(lambda: app.stock_at_df(db, datetime.datetime.utcnow()), repeat)
+    out_csv = db_path + ".csv"
+    ops["export_csv"], n = timed(lambda: app.write_export(db.connection(), app.items_export_query(), out_csv, "csv"), repeat)
+    ops["export_csv"]["rows"] = n
+    ops["export_csv"]["bytes"] = os.path.getsize(out_csv)
+    os.remove(out_csv)
+    frame = import_frame(app, size, min(import_rows, size))
+    # each repeat re-imports the same rows, so later runs are pure updates
+    ops["import_csv_to_db"], _ = timed(lambda: app.import_csv_to_db(db, frame), repeat)
+    ops["import_csv_to_db"]["rows"] = len(frame)
+    ops["verify_summaries"], problems = timed(lambda: app.verify_summaries(db), 1)
+    ops["verify_summaries"]["problems"] = len(problems)
+    db.close()
+    return {"size": size, "db_bytes": os.path.getsize(db_path), "peak_rss_mb": peak_rss_mb(), "ops": ops}
+# ----------------------------
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = {r["size"]: r for r in json.load(f)["results"]}
+    for r in current["results"]:
+        old = previous.get(r["size"])
+        if not old:
+            continue
+        for op, stats in r["ops"].items():
+            if op in old["ops"] and old["ops"][op]["min_s"] > 0:
+                ratio = stats["min_s"] / old["ops"][op]["min_s"]
+                flag = "  <-- slower" if ratio > 1.2 else ""
+                print(f"{r['size']:>9} {op:<18} {old['ops'][op]['min_s']:9.4f}s -> {stats['min_s']:9.4f}s  x{ratio:.2f}{flag}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the inventory app's data paths without the UI.")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--import-rows", type=int, default=5000, help="rows per import_csv_to_db run")
+    ap.add_argument("--count-fraction", type=float, default=0.1, help="share of items counted in the stocktake")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--compare", help="previous results file to diff against")
+    ap.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.one is not None:
+        # child process: one size, fresh DB, result JSON on stdout
+        with tempfile.TemporaryDirectory() as tmp:
+            result = run_one(args.one, args.repeat, args.import_rows, args.count_fraction,
+                             os.path.join(tmp, "bench.db"))
+        print(json.dumps(result))
+        return
+
+    results = []
+    for size in args.sizes:
+        # one process per size so each gets a clean engine and its own peak RSS
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--one", str(size),
+                               "--repeat", str(args.repeat), "--import-rows", str(args.import_rows),
+                               "--count-fraction", str(args.count_fraction)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            sys.exit(f"benchmark failed for size {size}")
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(result)
+        for op, stats in result["ops"].items():
+            print(f"{size:>9} {op:<18} {stats['min_s']:9.4f}s")
+        print(f"{size:>9} peak RSS {result['peak_rss_mb']:.0f} MB, DB {result['db_bytes'] / 1e6:.1f} MB")
+
+    report = {
+        "created_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == "__main__":
+    main()
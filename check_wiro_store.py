@@ -0,0 +1,367 @@
+# check_wiro_store.py
+# Seeds a large dataset and checks wiro_store against it. Uses the
+# in-process fake by default, or the Firestore emulator when
+# FIRESTORE_EMULATOR_HOST is set (needs google-cloud-firestore).
+#
+#   python check_wiro_store.py --items 20000
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 python check_wiro_store.py
+import argparse
+import datetime
+import importlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import fake_firestore
+import wiro_store
+
+failures = []
+
+def check(ok, what):
+    print(("ok   " if ok else "FAIL ") + what)
+    if not ok:
+        failures.append(what)
+
+def make_client():
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        from google.cloud import firestore
+        # a fresh project id per run keeps runs independent
+        return firestore.Client(project=f"demo-wiro-{uuid.uuid4().hex[:8]}")
+    return fake_firestore.Client()
+
+def reads(db):
+    return getattr(db, "reads", None)
+
+# ---------- checks ----------
+def check_counts(db, n_items, n_events):
+    t0 = time.perf_counter()
+    ids = [wiro_store.add_item(db, f"Item {i}", "General", i % 50, 10.0).id for i in range(n_items)]
+    for i in range(n_events):
+        wiro_store.record_event(db, f"Event {i}", ids[i % n_items], f"Item {i % n_items}", 1, "2026-01-01")
+    print(f"     seeded {n_items} items, {n_events} events in {time.perf_counter() - t0:.1f}s")
+
+    before = reads(db)
+    t0 = time.perf_counter()
+    naive = len(list(db.collection("inventory").stream()))
+    naive_s, naive_reads = time.perf_counter() - t0, (reads(db) - before) if before is not None else None
+
+    before = reads(db)
+    t0 = time.perf_counter()
+    counted = wiro_store.count_documents(db, "inventory")
+    agg_s, agg_reads = time.perf_counter() - t0, (reads(db) - before) if before is not None else None
+    check(counted == naive == n_items, f"aggregation count {counted} == streamed {naive} == {n_items}")
+    print(f"     stream: {naive_s:.3f}s {naive_reads} reads; aggregation: {agg_s:.3f}s {agg_reads} reads")
+
+    for name, expected in (("inventory", n_items), ("events", n_events), ("transactions", n_events)):
+        check(wiro_store.read_counter(db, name) == expected, f"sharded counter {name} == {expected}")
+    wiro_store.reset_counter(db, "events", 0)
+    check(wiro_store.recount(db, "events") == n_events and wiro_store.read_counter(db, "events") == n_events,
+          "recount re-seeds a drifted counter")
+
+def check_movements(db, workers=8, per_worker=50):
+    a = wiro_store.add_item(db, "Folding chair", "Furniture", 100, 5.0)
+    b = wiro_store.add_item(db, "Folding chair", "Outdoor", 100, 5.0)  # same name, different item
+    index = {k: v for k, v in wiro_store.load_item_index(db).items() if k in (a.id, b.id)}
+    before = wiro_store.read_counter(db, "transactions")
+
+    def staff():
+        for _ in range(per_worker):
+            wiro_store.apply_movement(db, a.id, "Folding chair", "Stock Out", 1)
+    threads = [threading.Thread(target=staff) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    check(a.get().to_dict()["qty"] == 100 - workers * per_worker, "concurrent Stock Out loses no updates")
+    check(b.get().to_dict()["qty"] == 100, "duplicate item names do not cross-update")
+
+    note = "item_id,amount\n" + "".join(f"{b.id},2\n" for _ in range(600))
+    movements, errors = wiro_store.parse_delivery_note(note, index)
+    batches = wiro_store.apply_movements(db, movements, index)
+    check(not errors and batches == 3, f"600-line delivery note applied in {batches} batches of <= 500 writes")
+    check(b.get().to_dict()["qty"] == 100 + 1200, "delivery note quantities applied")
+    check(wiro_store.read_counter(db, "transactions") - before == workers * per_worker + 600,
+          "one transaction record per movement")
+
+def check_mirror(db):
+    before = reads(db)
+    mirror = wiro_store.InventoryMirror(db).start()
+    check(mirror.ready.wait(timeout=60), "mirror finished its initial load")
+    initial = (reads(db) - before) if before is not None else None
+    n = len(mirror)
+    check(n == wiro_store.count_documents(db, "inventory"), f"mirror holds all {n} items")
+
+    before = reads(db)
+    ref = wiro_store.add_item(db, "Marquee 10x20", "Tents", 2, 900.0)
+    wiro_store.apply_movement(db, ref.id, "Marquee 10x20", "Stock In", 3)
+    doomed = wiro_store.add_item(db, "Broken lamp", "Lighting", 1, 0.0)
+    doomed.delete()
+    # the emulator delivers snapshots asynchronously
+    deadline = time.time() + 10
+    while time.time() < deadline and ((mirror.row(ref.id) or {}).get("qty") != 5 or mirror.row(doomed.id)):
+        time.sleep(0.05)
+    check((mirror.row(ref.id) or {}).get("qty") == 5, "mirror applies adds and Increments")
+    check(mirror.row(doomed.id) is None and len(mirror) == n + 1, "mirror applies deletes")
+    table = mirror.table()
+    check(all(len(col) == len(table["id"]) for col in table.values()), "mirror columns stay aligned")
+    if before is not None:
+        print(f"     initial load {initial} reads; 4 changes then cost {reads(db) - before} listener reads")
+    mirror.stop()
+
+def check_events(db, n_events=250):
+    item = wiro_store.add_item(db, "Chafing dish", "Catering", 1000, 45.0)
+    other = wiro_store.add_item(db, "Table cloth", "Linen", 1000, 3.0)
+    for i in range(n_events):
+        ref = item if i % 5 else other
+        day = f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}"
+        wiro_store.record_event(db, f"Wedding {i % 40}", ref.id, "x", 2, day)
+    n_other = len(range(0, n_events, 5))
+    check(item.get().to_dict()["qty"] == 1000 - 2 * (n_events - n_other)
+          and other.get().to_dict()["qty"] == 1000 - 2 * n_other, "recording an event decrements the linked item")
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        docs, cursor = wiro_store.events_page(db, cursor, page_size=40, item_id=item.id)
+        seen += docs
+        pages += 1
+        if cursor is None:
+            break
+    keys = [(d.get("date"), d.get("timestamp")) for d in seen]
+    check(len(seen) == n_events - n_other and len({d.id for d in seen}) == len(seen),
+          f"start_after pagination visits each event once ({len(seen)} in {pages} pages)")
+    check(keys == sorted(keys, reverse=True), "pages come newest first")
+    march, _ = wiro_store.events_page(db, page_size=1000, item_id=item.id, date_from="2025-03-01", date_to="2025-03-31")
+    check(march and all(d.get("date").startswith("2025-03") for d in march), "date range filter")
+
+    before = reads(db)
+    usage = wiro_store.monthly_usage(db, "2025-01", "2025-12")
+    used = (reads(db) - before) if before is not None else None
+    check(len(usage) == 12 and sum(u["total"] for u in usage) == 2 * n_events,
+          f"monthly usage from {len(usage)} documents ({used} reads for {n_events} events)")
+    check(sum(u["items"].get(other.id, 0) for u in usage) == 2 * n_other, "per-item monthly totals")
+    per_event = wiro_store.event_usage(db, "2025-01-01", "2025-12-31")
+    check(sum(u["records"] for u in per_event) == n_events, "per-event usage documents")
+
+def check_sync(db, n_local=3000, n_remote=2000):
+    # SQLite side is appapp1.py on a temp database (needs its dependencies)
+    tmp = tempfile.mkdtemp()
+    os.environ["INVENTORY_DB"] = os.path.join(tmp, "branch.db")
+    argv, sys.argv = sys.argv, [sys.argv[0]]
+    app = importlib.import_module("appapp1")
+    sys.argv = argv
+    import bench_inventory
+    import stock_sync
+    bench_inventory.load_catalogue(app, n_local)
+    # a fresh collection so earlier checks do not count
+    remote = stock_sync.FirestoreStockStore(db, collection="inventory_sync")
+    coll = db.collection("inventory_sync")
+    for i in range(n_remote):
+        coll.add({"name": f"Remote {i}", "category": "Tents", "qty": 10, "cost": 2.0,
+                  "updated_at": datetime.datetime.now(datetime.timezone.utc)})
+    local = stock_sync.SqliteStockStore(app.ENGINE)
+
+    stats = stock_sync.sync(local, remote)
+    n_fs = wiro_store.count_documents(db, "inventory_sync")
+    with app.ENGINE.connect() as conn:
+        n_sql = conn.execute(app.sa.text("SELECT COUNT(*) FROM items")).scalar()
+    check(n_fs == n_sql == n_local + n_remote, f"first sync merges both catalogues ({stats})")
+
+    # the first sync's pushes and pulls come back once as echoes
+    stock_sync.sync(local, remote)
+    with app.ENGINE.connect() as conn:
+        # the shape of a later keyset page in SqliteStockStore.changed_since
+        plan = " ".join(str(r[-1]) for r in conn.execute(app.sa.text(
+            "EXPLAIN QUERY PLAN SELECT * FROM items WHERE updated_at >= :wm "
+            "AND (updated_at > :last OR (updated_at = :last AND id > :id)) ORDER BY updated_at, id LIMIT 500"),
+            {"wm": "1970-01-01", "last": "2000-01-01", "id": 1}))
+    check("ix_items_updated_at" in plan and "TEMP B-TREE" not in plan, f"local changes page over the index ({plan})")
+
+    # both sides move the same item while apart
+    sku = "SKU00000007"
+    s = app.get_session()
+    itm = s.query(app.Item).filter(app.Item.sku == sku).one()
+    start_qty = itm.qty_on_hand
+    app.set_movement_reason(s, "edit")
+    itm.qty_on_hand -= 3
+    s.commit()
+    fs_doc = next(coll.where("sku", "==", sku).stream())
+    time.sleep(0.01)
+    coll.document(fs_doc.id).update({"qty": wiro_store.Increment(5), "name": "Renamed in Firestore",
+                                     "updated_at": wiro_store.SERVER_TIMESTAMP})
+    before = reads(db)
+    stats = stock_sync.sync(local, remote)
+    delta_reads = (reads(db) - before) if before is not None else None
+    s.expire_all()
+    itm = s.query(app.Item).filter(app.Item.sku == sku).one()
+    fs = coll.document(fs_doc.id).get().to_dict()
+    check(itm.qty_on_hand == fs["qty"] == start_qty + 2, f"offline -3 and remote +5 both survive ({stats})")
+    check(itm.name == fs["name"] == "Renamed in Firestore", "newer name wins")
+    if delta_reads is not None:
+        check(delta_reads < 10, f"incremental sync cost {delta_reads} Firestore reads for one change")
+
+    stats = stock_sync.sync(local, remote)
+    check(stats["pushed"] == 0 and stats["pulled"] == 0, f"idle sync writes nothing ({stats})")
+
+    # a SQLite edit that commits after the last sync read, stamped just
+    # before the newest updated_at that sync saw (a slow transaction)
+    app.set_movement_reason(s, "edit")
+    itm.qty_on_hand += 1
+    s.commit()
+    stock_sync.sync(local, remote)
+    with app.ENGINE.connect() as conn:
+        newest = conn.execute(app.sa.select(app.sa.func.max(app.Item.updated_at))).scalar()
+    itm.qty_on_hand += 5
+    s.commit()
+    with app.ENGINE.begin() as conn:
+        conn.execute(app.sa.update(app.Item).where(app.Item.sku == sku)
+                     .values(updated_at=newest - datetime.timedelta(seconds=2)))
+    stats = stock_sync.sync(local, remote)
+    s.expire_all()
+    itm = s.query(app.Item).filter(app.Item.sku == sku).one()
+    check(stats["local_changed"] == 1 and itm.qty_on_hand == coll.document(fs_doc.id).get().to_dict()["qty"]
+          == start_qty + 8, f"late local write inside the grace window is picked up ({stats})")
+    # a sync never moves a document's updated_at back below a saved watermark
+    stamp = coll.document(fs_doc.id).get().to_dict()["updated_at"]
+    check(stamp.tzinfo is not None and stamp > datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=60),
+          "pushed documents carry the server's commit time")
+
+    # a push that dies halfway: the 2nd batch commits but its ack is lost,
+    # the 3rd never runs. The rerun must not count any increment twice.
+    app.set_movement_reason(s, "edit")
+    moved = s.query(app.Item).order_by(app.Item.id).limit(1200).all()
+    for it in moved:
+        it.qty_on_hand += 1
+    s.commit()
+    commit, calls = remote._commit, []
+    def flaky_commit(batch, created, skus, on_commit):
+        calls.append(len(skus))
+        if len(calls) == 2:
+            commit(batch, created, skus, None)
+            raise ConnectionError("ack lost")
+        commit(batch, created, skus, on_commit)
+    remote._commit = flaky_commit
+    try:
+        stock_sync.sync(local, remote)
+    except ConnectionError:
+        pass
+    remote._commit = commit
+    stats = stock_sync.sync(local, remote)
+    s.expire_all()
+    sql = {it.sku: it.qty_on_hand for it in s.query(app.Item).filter(app.Item.sku.in_([it.sku for it in moved]))}
+    fs = {}
+    for start in range(0, len(sql), 30):
+        for doc in coll.where("sku", "in", list(sql)[start:start + 30]).stream():
+            fs[doc.get("sku")] = doc.get("qty")
+    check(len(calls) == 2 and fs == sql and stats["pushed"] == 1200 - 2 * 499,
+          f"half-pushed sync resumes without double counting ({stats})")
+    problems = app.verify_summaries(s)
+    check(not problems, f"SQLite summaries and ledger consistent after sync {problems[:3]}")
+    s.close()
+
+def check_journal(latency=0.03, n_ops=400):
+    # always on the fake: it is the one that can be made slow and unreliable
+    import wiro_journal
+    db = fake_firestore.Client(latency=latency, seed=7)
+    items = [wiro_store.add_item(db, f"Tent peg {i}", "Tents", 1000, 1.0).id for i in range(5)]
+    index = wiro_store.load_item_index(db)
+    t0 = time.perf_counter()
+    wiro_store.apply_movement(db, items[0], "Tent peg 0", "Stock In", 1)
+    sync_ms = (time.perf_counter() - t0) * 1000
+    expected = {k: 1001 if k == items[0] else 1000 for k in items}
+    before = {c: wiro_store.read_counter(db, c) for c in wiro_store.COUNTED_COLLECTIONS}
+    db.failure_rate, db.lost_ack_rate = 0.2, 0.2
+
+    path = os.path.join(tempfile.mkdtemp(), "journal.db")
+    journal = wiro_journal.WriteJournal(db, path, linger=0.05)
+    acks, added, events = [], [], 0
+    for i in range(n_ops):
+        item = items[i % len(items)]
+        t0 = time.perf_counter()
+        if i % 50 == 0:
+            added.append(journal.add_item(f"Guy rope {i}", "Tents", 10, 2.0))
+        elif i % 7 == 0:
+            journal.record_event(f"Fair {i % 3}", item, index[item]["name"], 2, f"2025-0{i % 3 + 1}-15")
+            expected[item] -= 2
+            events += 1
+        else:
+            action = "Stock In" if i % 2 else "Stock Out"
+            journal.apply_movement(item, index[item]["name"], action, 3)
+            expected[item] += 3 if action == "Stock In" else -3
+        acks.append((time.perf_counter() - t0) * 1000)
+    check(journal.flush(timeout=120), "journal drains against a slow, failing Firestore")
+    stats = journal.status()
+    ack_p99 = sorted(acks)[int(len(acks) * 0.99)]
+    print(f"     ack p99 {ack_p99:.1f} ms vs {sync_ms:.0f} ms per synchronous write; {stats}")
+    check(ack_p99 < sync_ms, "acks return before a Firestore round trip would")
+    check(stats["batches"] < n_ops / 10, f"{n_ops} operations coalesced into {stats['batches']} batches")
+    check(stats["retries"] > 0 and stats["already_applied"] > 0, "failed and lost-ack commits were retried")
+    db.failure_rate = db.lost_ack_rate = 0.0
+    qty = {k: db.collection("inventory").document(k).get().to_dict()["qty"] for k in items}
+    check(qty == expected, "every movement applied exactly once")
+    check(all(db.collection("inventory").document(k).get().exists for k in added), "journalled items created")
+    moves = n_ops - len(added)
+    counted = {c: wiro_store.read_counter(db, c) - before[c] for c in wiro_store.COUNTED_COLLECTIONS}
+    check(counted == {"inventory": len(added), "events": events, "transactions": moves},
+          f"counters match the operations ({counted})")
+    check(len(list(db.collection("transactions").where("item_id", "in", items).stream())) == moves + 1,
+          "one transaction record per movement")
+    usage = wiro_store.event_usage(db, "2025-01-01", "2025-12-31")
+    check(sum(u["records"] for u in usage) == events and sum(u["total"] for u in usage) == 2 * events,
+          "coalesced usage totals")
+    deadline = time.time() + 30
+    while time.time() < deadline and journal.status()["markers"]:
+        time.sleep(0.05)
+    check(not list(db.collection(wiro_journal.MARKERS).stream()), "batch markers are deleted once their batch is done")
+
+    # a batch whose ack is lost, then a restart before the retry
+    db.lose_next_acks = 1
+    journal.apply_movement(items[1], "Tent peg 1", "Stock In", 5)
+    while not journal.status()["retries"] > stats["retries"]:
+        time.sleep(0.01)
+    journal.close()
+    journal = wiro_journal.WriteJournal(db, path, linger=0.05)
+    check(journal.flush(timeout=30) and journal.already_applied == 1
+          and db.collection("inventory").document(items[1]).get().to_dict()["qty"] == expected[items[1]] + 5,
+          "in-flight batch resent after a restart is not applied twice")
+
+    # an operation Firestore rejects does not hold up the others
+    journal.apply_movement("no-such-item", "Ghost", "Stock In", 1)
+    journal.apply_movement(items[2], "Tent peg 2", "Stock In", 1)
+    journal.flush(timeout=30)
+    failed = journal.failed()
+    check(len(failed) == 1 and failed[0]["item_id"] == "no-such-item"
+          and db.collection("inventory").document(items[2]).get().to_dict()["qty"] == expected[items[2]] + 1,
+          "a rejected operation is set aside, the rest of its batch lands")
+    journal.discard_failed()
+    journal.flush(timeout=30)
+    deadline = time.time() + 30
+    while time.time() < deadline and journal.status()["markers"]:
+        time.sleep(0.05)
+    check(not list(db.collection(wiro_journal.MARKERS).stream()), "no markers left after retries and restarts")
+    journal.close()
+# ----------------------------
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=20000)
+    ap.add_argument("--events", type=int, default=5000)
+    ap.add_argument("--no-sync", action="store_true", help="skip the SQLite <-> Firestore sync check")
+    ap.add_argument("--no-journal", action="store_true", help="skip the write-behind journal check")
+    args = ap.parse_args()
+    db = make_client()
+    check_counts(db, args.items, args.events)
+    check_movements(db)
+    check_mirror(db)
+    check_events(db)
+    if not args.no_sync:
+        check_sync(db)
+    if not args.no_journal:
+        check_journal()
+    print(f"{len(failures)} failed" if failures else "all checks passed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
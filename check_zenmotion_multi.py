@@ -0,0 +1,183 @@
+# check_zenmotion_multi.py
+# Checks zenmotion_multi's tracking on synthetic boxes and landmarks: track
+# creation, matching across frames (IoU and the centroid fallback), pruning,
+# and per-person rep counting through MultiPersonCounter with a scripted
+# detector and pose pool. The last check runs the real MediaPipe pool
+# in-process on blank crops (skip it with --no-pose).
+#
+#   python check_zenmotion_multi.py
+#   python check_zenmotion_multi.py --no-pose
+import argparse
+import sys
+
+import numpy as np
+
+import zenmotion_core
+import zenmotion_multi
+
+failures = []
+
+def check(ok, what):
+    print(("ok   " if ok else "FAIL ") + what)
+    if not ok:
+        failures.append(what)
+
+def box(x, y, w=100, h=200):
+    return (x, y, x + w, y + h, 1.0)
+
+def landmarks(knee_angle, x1=0.0, y1=0.0, x2=1.0, y2=1.0):
+    # (33, 4) landmarks spanning (x1, y1)-(x2, y2), left knee bent to knee_angle
+    lm = np.zeros((33, 4))
+    lm[:, 0] = np.linspace(x1, x2, 33)
+    lm[:, 1] = np.linspace(y1, y2, 33)
+    lm[:, 3] = 1.0
+    knee = np.array([(x1 + x2) / 2, y1 + 0.6 * (y2 - y1)])
+    a = np.radians(knee_angle)
+    hip, knee_i, ankle = (zenmotion_core.LANDMARKS[j] for j in zenmotion_core.EXERCISES["squat"]["joints"])
+    lm[knee_i, :2] = knee
+    lm[hip, :2] = knee + 0.2 * (y2 - y1) * np.array([np.sin(a), np.cos(a)])
+    lm[ankle, :2] = knee + np.array([0.0, 0.3 * (y2 - y1)])
+    return lm
+
+# ---------- checks ----------
+def check_tracking():
+    tracker = zenmotion_multi.Tracker("squat", max_people=3)
+    check(tracker.update([box(50, 100), box(400, 100)]) == [] and list(tracker.tracks) == [1, 2],
+          "two detections start tracks 1 and 2")
+
+    # small moves, listed in the other order: IoU keeps the identities
+    tracker.update([box(410, 105), box(55, 98)])
+    check(list(tracker.tracks) == [1, 2] and tracker.tracks[1].box[0] == 55 and tracker.tracks[2].box[0] == 410,
+          "moved boxes match their tracks by IoU, whatever the detection order")
+
+    # a fast mover: no IoU left, but the centroid is within half the box diagonal
+    moved = box(140, 110)
+    check(zenmotion_multi.iou([tracker.tracks[1].box], [moved[:4]])[0, 0] < zenmotion_multi.IOU_MATCH,
+          "fast move leaves less overlap than IOU_MATCH")
+    tracker.update([moved, box(410, 105)])
+    check(list(tracker.tracks) == [1, 2] and tracker.tracks[1].box[0] == 140,
+          "fast mover keeps its track through the centroid fallback")
+
+    # someone far from every track is a new person
+    tracker.update([box(140, 110), box(410, 105), box(250, 250, 50, 100)])
+    check(list(tracker.tracks) == [1, 2, 3], "a detection away from every track starts track 3")
+
+    # at max_people the rest wait; the biggest newcomer goes first
+    tracker.tracks.pop(3)
+    tracker.update([box(140, 110), box(410, 105), box(520, 0, 40, 80), box(250, 250, 80, 160)])
+    check(list(tracker.tracks) == [1, 2, 4] and tracker.tracks[4].box[0] == 250 and tracker.next_id == 5,
+          "at max_people only the largest new detection gets a track")
+
+    # pruning: a track lost by pose for more than MAX_MISSES frames goes
+    t = tracker.tracks[2]
+    for _ in range(zenmotion_multi.MAX_MISSES):
+        t.update_pose(None, (480, 640))
+    check(tracker.prune() == [] and 2 in tracker.tracks, "a track survives MAX_MISSES misses")
+    tracker.update([box(140, 110), box(410, 105), box(250, 250, 80, 160)])
+    check(t.misses == 0, "a detection match resets the misses")
+    for _ in range(zenmotion_multi.MAX_MISSES + 1):
+        t.update_pose(None, (480, 640))
+    check(tracker.update([box(140, 110), box(250, 250, 80, 160)]) == [2] and list(tracker.tracks) == [1, 4],
+          "a track missed more than MAX_MISSES times is pruned and reported")
+    tracker.update([box(140, 110), box(250, 250, 80, 160), box(400, 100)])
+    check(list(tracker.tracks) == [1, 4, 5], "a pruned id is never reused")
+
+def check_pose_following():
+    t = zenmotion_multi.Track(1, box(100, 100), "squat")
+    t.update_pose(landmarks(175, 0.25, 0.25, 0.5, 0.75), (480, 640))
+    check(np.allclose(t.box, [160, 120, 320, 360]), "the box follows the landmarks between detections")
+    hidden = landmarks(175, 0.0, 0.0, 1.0, 1.0)
+    hidden[3:, 3] = 0.0
+    t.update_pose(hidden, (480, 640))
+    check(np.allclose(t.box, [160, 120, 320, 360]), "fewer than 4 visible landmarks leave the box alone")
+
+    a, b = zenmotion_multi.Track(1, box(0, 0), "squat"), zenmotion_multi.Track(2, box(300, 0), "squat")
+    for i in range(60):
+        a.update_pose(landmarks(175 if i % 10 < 5 else 60), (480, 640))
+        b.update_pose(landmarks(175 if i % 20 < 10 else 60), (480, 640))
+    check(a.reps.counter == 6 and b.reps.counter == 3, f"reps are counted per person ({a.reps.counter}, {b.reps.counter})")
+
+
+class ScriptedPool:
+    # stands in for PosePool: landmarks from a per-person script, crop coordinates
+    def __init__(self, script):
+        self.script = script
+        self.forgotten = []
+        self.frame = 0
+
+    def run(self, crops):
+        pad = zenmotion_multi.CROP_PAD / (1 + 2 * zenmotion_multi.CROP_PAD)
+        out = {track_id: self.script(track_id, self.frame) for track_id in crops}
+        self.frame += 1
+        return {i: None if angle is None else landmarks(angle, pad, pad, 1 - pad, 1 - pad) for i, angle in out.items()}
+
+    def forget(self, track_id):
+        self.forgotten.append(track_id)
+
+    def close(self):
+        pass
+
+def check_counter():
+    frames, leaves = 100, 60
+    detections = []
+
+    def detector(frame):
+        detections.append(len(detections))
+        people = [box(60, 100, 120, 240)]
+        if len(detections) * zenmotion_multi.DETECT_EVERY <= leaves:
+            people.append(box(400, 100, 120, 240))
+        return people
+
+    def script(track_id, i):
+        if track_id == 1:
+            return 175 if i % 10 < 5 else 60
+        return None if i >= leaves else (175 if i % 20 < 10 else 60)
+
+    counter = zenmotion_multi.MultiPersonCounter("squat", workers=0, detector=detector)
+    counter.pool = ScriptedPool(script)
+    frame = np.zeros((480, 640, 3), np.uint8)
+    seen = set()
+    for _ in range(frames):
+        tracks = counter.process(frame)
+        seen.update(t.id for t in tracks)
+        if counter.frame_no == leaves:
+            at_leave = {t.id: t.reps.counter for t in tracks}
+    counter.close()
+    check(len(detections) == frames // zenmotion_multi.DETECT_EVERY,
+          f"detector runs every {zenmotion_multi.DETECT_EVERY} frames ({len(detections)} passes)")
+    check(seen == {1, 2}, f"two people, two identities over {frames} frames ({sorted(seen)})")
+    check(list(counter.tracker.tracks) == [1] and counter.pool.forgotten == [2],
+          "the person who left is pruned and their pose state released")
+    track = counter.tracker.tracks[1]
+    check(track.reps.counter == frames // 10 and at_leave.get(2) == leaves // 20,
+          f"reps counted per person ({track.reps.counter}, {at_leave.get(2)})")
+    check(abs(track.box[0] - 60) <= 2 and abs(track.box[2] - 180) <= 2,
+          "crop landmarks map back to the person's frame position")
+
+def check_pose_pool():
+    pool = zenmotion_multi.PosePool(workers=0)
+    blank = np.zeros((240, 120, 3), np.uint8)
+    out = pool.run({1: blank, 2: blank})
+    check(out == {1: None, 2: None} and set(zenmotion_multi._poses) == {1, 2},
+          "blank crops give no landmarks, one Pose per track")
+    pool.forget(1)
+    out = pool.run({2: blank})
+    check(list(out) == [2] and set(zenmotion_multi._poses) == {2} and list(pool.assigned) == [2],
+          "a forgotten track's Pose is closed on the next run")
+    pool.close()
+# ----------------------------
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--no-pose", action="store_true", help="skip the MediaPipe pose pool check")
+    args = ap.parse_args()
+    check_tracking()
+    check_pose_following()
+    check_counter()
+    if not args.no_pose:
+        check_pose_pool()
+    print(f"{len(failures)} failed" if failures else "all checks passed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
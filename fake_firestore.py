@@ -0,0 +1,500 @@
+# fake_firestore.py
+# In-process stand-in for the subset of the Firestore client API that the
+# Wiro stock app uses, so store logic can be checked without credentials
+# or the emulator. Run the app on it with WIRO_FIRESTORE=fake.
+#
+# Supported: collections and subcollections, document get/set(merge)/update/
+# delete, add, where/order_by/limit/start_after queries, count() aggregation,
+# batched writes (atomic, 500-write limit), Increment and SERVER_TIMESTAMP
+# transforms and on_snapshot listeners. `reads` / `writes` count billable
+# operations the way Firestore does.
+#
+# Client(latency=..., failure_rate=..., lost_ack_rate=...) makes round trips
+# slow and unreliable, to exercise retry paths: a failed request raises
+# ServiceUnavailable before anything is applied; a lost ack raises it after
+# the commit has applied, as when the response never reaches the client.
+# `fail_next` / `lose_next_acks` force the next n of either.
+#
+# Listeners are called synchronously after each commit. After the initial
+# snapshot, `docs` holds only the changed documents rather than the full
+# result set, which keeps large seeded runs linear.
+import copy
+import datetime
+import enum
+import functools
+import random
+import threading
+import time
+import uuid
+
+MAX_BATCH_WRITES = 500
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+def is_increment(value):
+    # accept google.cloud.firestore.Increment as well as ours
+    return type(value).__name__ == "Increment" and hasattr(value, "value")
+
+
+class Sentinel:
+    def __init__(self, description):
+        self.description = description
+
+    def __repr__(self):
+        return f"Sentinel: {self.description}"
+
+
+SERVER_TIMESTAMP = Sentinel("Value used to set a document field to the server timestamp.")
+
+
+def is_server_timestamp(value):
+    # google.cloud.firestore.SERVER_TIMESTAMP is a Sentinel too
+    return type(value).__name__ == "Sentinel" and "server timestamp" in getattr(value, "description", "")
+
+
+def apply_field(data, path, value):
+    # dotted field paths update nested maps, like Firestore's update()
+    keys = path.split(".")
+    for k in keys[:-1]:
+        data = data.setdefault(k, {})
+    last = keys[-1]
+    if is_increment(value):
+        current = data.get(last, 0)
+        data[last] = (current if isinstance(current, (int, float)) else 0) + value.value
+    elif is_server_timestamp(value):
+        # the commit time, from the "server" clock rather than the writer's
+        data[last] = datetime.datetime.now(datetime.timezone.utc)
+    else:
+        data[last] = copy.deepcopy(value)
+
+
+def get_field(data, path):
+    for k in path.split("."):
+        if not isinstance(data, dict) or k not in data:
+            raise KeyError(path)
+        data = data[k]
+    return data
+
+
+def merge_into(data, updates):
+    for k, v in updates.items():
+        if isinstance(v, dict):
+            if not isinstance(data.get(k), dict):
+                data[k] = {}
+            merge_into(data[k], v)
+        else:
+            apply_field(data, k, v)
+
+
+def sort_value(v):
+    # Firestore orders values by type first, then by value
+    if v is None:
+        return (0, 0)
+    if isinstance(v, bool):
+        return (1, v)
+    if isinstance(v, (int, float)):
+        return (2, v)
+    if isinstance(v, datetime.datetime):
+        return (3, v.timestamp() if v.tzinfo else v.replace(tzinfo=datetime.timezone.utc).timestamp())
+    if isinstance(v, str):
+        return (4, v)
+    return (5, str(v))
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return copy.deepcopy(get_field(self._data or {}, field))
+
+
+class ChangeType(enum.Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+
+class DocumentChange:
+    def __init__(self, type, document, old_index=-1, new_index=-1):
+        self.type = type
+        self.document = document
+        self.old_index = old_index
+        self.new_index = new_index
+
+
+class Watch:
+    def __init__(self, client, query, callback):
+        self._client = client
+        self.query = query
+        self.callback = callback
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        with self._client._lock:
+            if self in self._client._watches:
+                self._client._watches.remove(self)
+
+
+class AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class AggregationQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        n = len(self._query.matching())
+        # billed as one read per batch of up to 1000 index entries
+        self._query._client.reads += max(1, (n + 999) // 1000)
+        return [[AggregationResult(self._alias, n)]]
+
+
+class Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, client, path, filters=(), orders=(), limit=None, cursor=None):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+
+    def _copy(self, **kw):
+        args = dict(filters=self._filters, orders=self._orders, limit=self._limit, cursor=self._cursor)
+        args.update(kw)
+        return Query(self._client, self._path, **args)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def count(self, alias="count"):
+        return AggregationQuery(self, alias)
+
+    def matching(self):
+        with self._client._lock:
+            docs = list(self._client._collections.get(self._path, {}).items())
+        out = []
+        for doc_id, data in docs:
+            if all(self._match(data, f) for f in self._filters) and all(self._has(data, o[0]) for o in self._orders):
+                out.append((doc_id, data))
+        out.sort(key=functools.cmp_to_key(self._compare))
+        if self._cursor is not None:
+            key = self._cursor_key()
+            out = [d for d in out if self._compare(d, key) > 0]
+        return out
+
+    def stream(self, transaction=None):
+        docs = self.matching()
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        self._client._rpc()
+        self._client.reads += max(1, len(docs))
+        coll = CollectionReference(self._client, self._path)
+        return iter([DocumentSnapshot(coll.document(doc_id), copy.deepcopy(data)) for doc_id, data in docs])
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        watch = Watch(self._client, self, callback)
+        with self._client._lock:
+            docs = self.stream()
+            self._client._watches.append(watch)
+        docs = list(docs)
+        callback(docs, [DocumentChange(ChangeType.ADDED, d, -1, i) for i, d in enumerate(docs)],
+                 datetime.datetime.now(datetime.timezone.utc))
+        return watch
+
+    def _accepts(self, data):
+        return all(self._match(data, f) for f in self._filters)
+
+    @staticmethod
+    def _has(data, field):
+        try:
+            get_field(data, field)
+            return True
+        except KeyError:
+            return False
+
+    @staticmethod
+    def _match(data, f):
+        field, op, value = f
+        try:
+            v = get_field(data, field)
+        except KeyError:
+            return False
+        if op == "==":
+            return v == value
+        if op == "!=":
+            return v != value
+        if op == "in":
+            return v in value
+        if op == "not-in":
+            return v not in value
+        if op == "array_contains":
+            return isinstance(v, list) and value in v
+        if op == "array_contains_any":
+            return isinstance(v, list) and any(x in v for x in value)
+        a, b = sort_value(v), sort_value(value)
+        if a[0] != b[0]:
+            return False
+        return {"<": a < b, "<=": a <= b, ">": a > b, ">=": a >= b}[op]
+
+    def _compare(self, x, y):
+        (xid, xd), (yid, yd) = x, y
+        for field, direction in self._orders:
+            a = sort_value(get_field(xd, field)) if self._has(xd, field) else (-1, 0)
+            b = sort_value(get_field(yd, field)) if self._has(yd, field) else (-1, 0)
+            if a != b:
+                c = -1 if a < b else 1
+                return -c if direction == Query.DESCENDING else c
+        # document id breaks ties, as __name__ does in Firestore
+        return (xid > yid) - (xid < yid)
+
+    def _cursor_key(self):
+        c = self._cursor
+        if isinstance(c, DocumentSnapshot):
+            return (c.id, c._data or {})
+        # a dict of order-by field values: skip every doc that ties with it
+        return ("\uffff", c)
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.parent_path, _, self.id = path.rpartition("/")
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, transaction=None):
+        self._client._rpc()
+        self._client.reads += 1
+        with self._client._lock:
+            data = self._client._collections.get(self.parent_path, {}).get(self.id)
+            return DocumentSnapshot(self, copy.deepcopy(data))
+
+    def set(self, document_data, merge=False):
+        b = WriteBatch(self._client)
+        b.set(self, document_data, merge=merge)
+        b.commit()
+
+    def create(self, document_data):
+        b = WriteBatch(self._client)
+        b.create(self, document_data)
+        b.commit()
+
+    def update(self, field_updates):
+        b = WriteBatch(self._client)
+        b.update(self, field_updates)
+        b.commit()
+
+    def delete(self):
+        b = WriteBatch(self._client)
+        b.delete(self)
+        b.commit()
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.rpartition("/")[2]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return datetime.datetime.now(datetime.timezone.utc), ref
+
+
+class AlreadyExists(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def _add(self, op):
+        if len(self._ops) >= MAX_BATCH_WRITES:
+            raise ValueError(f"A write batch cannot contain more than {MAX_BATCH_WRITES} writes")
+        self._ops.append(op)
+
+    def set(self, reference, document_data, merge=False):
+        self._add(("set_merge" if merge else "set", reference, document_data))
+        return self
+
+    def create(self, reference, document_data):
+        self._add(("create", reference, document_data))
+        return self
+
+    def update(self, reference, field_updates):
+        self._add(("update", reference, field_updates))
+        return self
+
+    def delete(self, reference):
+        self._add(("delete", reference, None))
+        return self
+
+    def __len__(self):
+        return len(self._ops)
+
+    def commit(self):
+        self._client._commit(self._ops)
+        self._ops = []
+        return []
+
+
+class Client:
+    def __init__(self, project="fake-project", latency=0.0, failure_rate=0.0, lost_ack_rate=0.0, seed=None):
+        self.project = project
+        self.latency = latency              # seconds per round trip
+        self.failure_rate = failure_rate    # requests that fail before reaching the "server"
+        self.lost_ack_rate = lost_ack_rate  # commits that apply but report an error
+        self.fail_next = 0
+        self.lose_next_acks = 0
+        self._rng = random.Random(seed)
+        self._collections = {}  # collection path -> {doc id: data}
+        self._lock = threading.RLock()
+        self._watches = []
+        self.reads = 0
+        self.writes = 0
+        self.rpcs = 0
+        self.failures = 0
+
+    def collection(self, path):
+        return CollectionReference(self, path)
+
+    def document(self, path):
+        return DocumentReference(self, path)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def _injected(self, forced, rate):
+        with self._lock:
+            if getattr(self, forced) > 0:
+                setattr(self, forced, getattr(self, forced) - 1)
+                fail = True
+            else:
+                fail = rate > 0 and self._rng.random() < rate
+            self.failures += fail
+        return fail
+
+    def _rpc(self):
+        with self._lock:
+            self.rpcs += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self._injected("fail_next", self.failure_rate):
+            raise ServiceUnavailable("injected failure: request not applied")
+
+    def _ack(self):
+        if self._injected("lose_next_acks", self.lost_ack_rate):
+            raise ServiceUnavailable("injected failure: commit applied, ack lost")
+
+    def _commit(self, ops):
+        self._rpc()
+        with self._lock:
+            before = {}
+            for _, ref, _ in ops:
+                key = (ref.parent_path, ref.id)
+                if key not in before:
+                    before[key] = copy.deepcopy(self._collections.get(ref.parent_path, {}).get(ref.id))
+            # validate first so the batch applies all-or-nothing
+            staged = {}
+            for kind, ref, _ in ops:
+                key = (ref.parent_path, ref.id)
+                exists = staged[key] if key in staged else ref.id in self._collections.get(ref.parent_path, {})
+                if kind == "create" and exists:
+                    raise AlreadyExists(ref.path)
+                if kind == "update" and not exists:
+                    raise NotFound(ref.path)
+                staged[key] = kind != "delete"
+            for kind, ref, data in ops:
+                coll = self._collections.setdefault(ref.parent_path, {})
+                if kind == "delete":
+                    coll.pop(ref.id, None)
+                    continue
+                if kind in ("set", "create"):
+                    doc = {}
+                    merge_into(doc, data)
+                    coll[ref.id] = doc
+                elif kind == "set_merge":
+                    merge_into(coll.setdefault(ref.id, {}), data)
+                else:
+                    doc = coll[ref.id]
+                    for k, v in data.items():
+                        apply_field(doc, k, v)
+            self.writes += len(ops)
+            watches = list(self._watches)
+            after = {key: copy.deepcopy(self._collections.get(key[0], {}).get(key[1])) for key in before}
+        self._notify(watches, before, after)
+        self._ack()
+
+    def _notify(self, watches, before, after):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for watch in watches:
+            q = watch.query
+            changes = []
+            for key, old in before.items():
+                if key[0] != q._path:
+                    continue
+                new = after[key]
+                was, now_in = old is not None and q._accepts(old), new is not None and q._accepts(new)
+                if not was and not now_in:
+                    continue
+                ref = DocumentReference(self, f"{key[0]}/{key[1]}")
+                if now_in and not was:
+                    kind = ChangeType.ADDED
+                elif was and not now_in:
+                    kind = ChangeType.REMOVED
+                elif old == new:
+                    continue
+                else:
+                    kind = ChangeType.MODIFIED
+                changes.append(DocumentChange(kind, DocumentSnapshot(ref, new if now_in else old)))
+            if changes and watch.is_active:
+                self.reads += len(changes)
+                watch.callback([c.document for c in changes if c.type != ChangeType.REMOVED], changes, now)
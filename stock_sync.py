@@ -0,0 +1,388 @@
+# stock_sync.py
+# Incremental two-way sync between the SQLite stock app (appapp1.py) and
+# the Firestore one ("wiro app.py"). Both sides are reached through the
+# same small store interface:
+#
+#   changed_since(watermark)  records updated at or after the watermark
+#                             (everything when it is None)
+#   get(skus)                 sku -> record for the given skus
+#   apply(writes)             create/update records in batches
+#
+# A record is {"sku", "name", "category", "cost", "qty", "updated_at", "key"}.
+# Items are matched by SKU. Firestore items without one get "WIRO-<doc id>".
+#
+# Conflict rules: quantities merge three-way against the quantity agreed at
+# the last sync (base + local delta + remote delta), so stock movements made
+# offline on a branch and in Firestore both survive. The other fields are
+# last-writer-wins on updated_at. Quantity writes are applied as increments,
+# so concurrent movements during a sync are not overwritten.
+# Increments are not idempotent, so a sync that fails halfway must not push
+# them twice: the SQLite side is written in the same transaction as the sync
+# state, and every Firestore write carries a generation tag that the next
+# run checks (see "sync state" below).
+# Records that still match what the last sync wrote (our own echoes) are
+# dropped before the other side is read. Deletions are not synced.
+#
+# Firestore's updated_at is stamped by the server (SERVER_TIMESTAMP) at
+# commit, by every writer including this sync, and queries see every commit
+# up to their read time. A write we did not see therefore commits after the
+# newest updated_at we saw, and the remote watermark is that newest value.
+# SQLite's updated_at comes from the writer's clock before it commits, so a
+# slow transaction can land behind rows we already read; the local watermark
+# is saved SYNC_GRACE early and the re-read overlap is dropped by the echo
+# check. Both sides stamp updated_at with the time of the write, never with
+# a merged older time, so a watermark already saved is never undercut.
+# Our own pushes and pulls are read back once by the next run, as echoes.
+#
+#   python stock_sync.py --db inventory.db --credentials serviceAccountKey.json
+import argparse
+import datetime
+import uuid
+
+import sqlalchemy as sa
+
+import wiro_store
+from wiro_store import Increment, SERVER_TIMESTAMP
+
+SYNC_FIELDS = ("name", "category", "cost")
+PAGE_SIZE = 500
+FIRESTORE_IN_LIMIT = 30
+EPOCH = datetime.datetime(1970, 1, 1)
+SYNC_GRACE = datetime.timedelta(seconds=30)
+
+def utc_naive(dt):
+    # SQLite stores naive UTC; Firestore returns aware UTC
+    if dt is None:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return datetime.datetime(dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, dt.microsecond)
+
+def firestore_client(cred_path):
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_admin.initialize_app(credentials.Certificate(cred_path))
+    return firestore.client()
+
+# ---------- SQLite side ----------
+class SqliteStockStore:
+    def __init__(self, engine):
+        self.engine = engine
+        meta = sa.MetaData()
+        self.items = sa.Table("items", meta, autoload_with=engine)
+        insp = sa.inspect(engine)
+        self.ledger = sa.Table("stock_movements", meta, autoload_with=engine) if insp.has_table("stock_movements") else None
+
+    def record(self, row):
+        return {"sku": row.sku, "name": row.name or "", "category": row.category or "",
+                "cost": float(row.cost or 0.0), "qty": int(row.qty_on_hand or 0),
+                "updated_at": utc_naive(row.updated_at), "key": row.id}
+
+    def changed_since(self, watermark):
+        # keyset pages over the updated_at index; appapp1's add_missing_columns()
+        # backfills NULLs, so the bare column can be ordered and compared
+        t = self.items
+        last = None
+        while True:
+            q = sa.select(t).order_by(t.c.updated_at, t.c.id).limit(PAGE_SIZE)
+            if watermark is not None:
+                q = q.where(t.c.updated_at >= watermark)
+            if last is not None:
+                q = q.where(sa.or_(t.c.updated_at > last[0], sa.and_(t.c.updated_at == last[0], t.c.id > last[1])))
+            with self.engine.connect() as conn:
+                rows = conn.execute(q).all()
+            for row in rows:
+                yield self.record(row)
+            if len(rows) < PAGE_SIZE:
+                return
+            last = (rows[-1].updated_at, rows[-1].id)
+
+    def get(self, skus):
+        skus, out = list(skus), {}
+        with self.engine.connect() as conn:
+            for start in range(0, len(skus), PAGE_SIZE):
+                for row in conn.execute(sa.select(self.items).where(self.items.c.sku.in_(skus[start:start + PAGE_SIZE]))):
+                    out[row.sku] = self.record(row)
+        return out
+
+    def apply(self, writes, then=None):
+        # then(conn) runs inside the same transaction (the sync state)
+        t = self.items
+        now = datetime.datetime.utcnow()
+        with self.engine.begin() as conn:  # one transaction for the whole pull
+            for w in writes:
+                values = {f: w["fields"][f] for f in SYNC_FIELDS if f in w["fields"]}
+                values["updated_at"] = now
+                if w["create"]:
+                    # the reflected table has no Python-side defaults
+                    item_id = conn.execute(t.insert().values(sku=w["sku"], qty_on_hand=w["qty_delta"], unit="",
+                                                             location="", reorder_level=0, notes="",
+                                                             **values)).inserted_primary_key[0]
+                else:
+                    if w["qty_delta"]:
+                        values["qty_on_hand"] = sa.func.coalesce(t.c.qty_on_hand, 0) + w["qty_delta"]
+                    conn.execute(t.update().where(t.c.sku == w["sku"]).values(**values))
+                    item_id = w["key"]
+                if self.ledger is not None and w["qty_delta"]:
+                    qty_after = conn.execute(sa.select(t.c.qty_on_hand).where(t.c.id == item_id)).scalar()
+                    conn.execute(self.ledger.insert().values(item_id=item_id, occurred_at=now, delta=w["qty_delta"],
+                                                             qty_after=qty_after, reason="sync", ref="firestore"))
+            if then is not None:
+                then(conn)
+# ----------------------------
+
+# ---------- Firestore side ----------
+class FirestoreStockStore:
+    def __init__(self, db, collection="inventory"):
+        self.db = db
+        self.collection = collection
+
+    def record(self, doc):
+        d = doc.to_dict() or {}
+        return {"sku": d.get("sku") or f"WIRO-{doc.id}", "name": d.get("name") or "",
+                "category": d.get("category") or "", "cost": float(d.get("cost") or 0.0),
+                "qty": int(d.get("qty") or 0), "updated_at": utc_naive(d.get("updated_at")),
+                "key": doc.id, "needs_sku": not d.get("sku"), "tags": d.get("sync_gen") or {}}
+
+    def changed_since(self, watermark):
+        coll = self.db.collection(self.collection)
+        if watermark is None:
+            # first sync: documents written before updated_at existed have no watermark
+            for doc in coll.stream():
+                yield self.record(doc)
+            return
+        q = coll.where("updated_at", ">=", watermark.replace(tzinfo=datetime.timezone.utc)).order_by("updated_at")
+        cursor = None
+        while True:
+            page = list((q.start_after(cursor) if cursor is not None else q).limit(PAGE_SIZE).stream())
+            for doc in page:
+                yield self.record(doc)
+            if len(page) < PAGE_SIZE:
+                return
+            cursor = page[-1]
+
+    def get(self, skus):
+        skus, out = list(skus), {}
+        coll = self.db.collection(self.collection)
+        derived = [s for s in skus if s.startswith("WIRO-")]
+        for s in derived:
+            doc = coll.document(s[len("WIRO-"):]).get()
+            if doc.exists:
+                out[s] = self.record(doc)
+        plain = [s for s in skus if s not in out]
+        for start in range(0, len(plain), FIRESTORE_IN_LIMIT):
+            for doc in coll.where("sku", "in", plain[start:start + FIRESTORE_IN_LIMIT]).stream():
+                out[doc.to_dict()["sku"]] = self.record(doc)
+        return out
+
+    def apply(self, writes, on_commit=None):
+        # on_commit(skus) is called after each batch is committed
+        coll = self.db.collection(self.collection)
+        batch, created, skus = self.db.batch(), 0, []
+        for w in writes:
+            data = {f: w["fields"][f] for f in SYNC_FIELDS if f in w["fields"]}
+            data["sku"] = w["sku"]
+            data["updated_at"] = SERVER_TIMESTAMP
+            branch, gen = w.get("tag") or (None, None)
+            if w["create"]:
+                data["qty"] = w["qty_delta"]
+                data["timestamp"] = datetime.datetime.now()
+                if gen:
+                    data["sync_gen"] = {branch: gen}
+                batch.set(coll.document(), data)
+                created += 1
+            else:
+                if w["qty_delta"]:
+                    data["qty"] = Increment(w["qty_delta"])
+                if gen:
+                    data[f"sync_gen.{branch}"] = gen
+                batch.update(coll.document(w["key"]), data)
+            skus.append(w["sku"])
+            if len(batch) >= wiro_store.MAX_BATCH_WRITES - 1:
+                self._commit(batch, created, skus, on_commit)
+                batch, created, skus = self.db.batch(), 0, []
+        if len(batch):
+            self._commit(batch, created, skus, on_commit)
+
+    def _commit(self, batch, created, skus, on_commit):
+        if created:
+            wiro_store.bump_counter(batch, self.db, self.collection, created)
+        batch.commit()
+        if on_commit is not None:
+            on_commit(skus)
+# ----------------------------
+
+# ---------- sync state ----------
+# Kept in the SQLite database: the branch that syncs owns its bookkeeping.
+# base_qty is the quantity both sides agreed on. Pulls are committed with the
+# state, so SQLite always holds base_qty after a sync. remote_base is what
+# Firestore held before our last push of the SKU. A push tags the document
+# with sync_gen.<branch> = this run's generation, saved as pending_gen before
+# the push and cleared once the batch commits. If the batch committed but
+# the run died before hearing so, the next run finds the tag and knows the
+# increment landed; without it the delta is planned again from remote_base.
+state_meta = sa.MetaData()
+sync_state = sa.Table(
+    "sync_state", state_meta,
+    sa.Column("peer", sa.String, primary_key=True),
+    sa.Column("sku", sa.String, primary_key=True),
+    sa.Column("base_qty", sa.Integer, nullable=False),
+    sa.Column("sig", sa.String),  # signature of the record as last synced
+    sa.Column("remote_base", sa.Integer),
+    sa.Column("pending_gen", sa.String),
+)
+sync_watermarks = sa.Table(
+    "sync_watermarks", state_meta,
+    sa.Column("peer", sa.String, primary_key=True),
+    sa.Column("local_wm", sa.DateTime),
+    sa.Column("remote_wm", sa.DateTime),
+    sa.Column("synced_at", sa.DateTime),
+    sa.Column("branch", sa.String),  # id of this database in the sync_gen tags
+)
+
+def ensure_state_tables(engine):
+    state_meta.create_all(engine)
+    # create_all() does not alter existing tables
+    with engine.begin() as conn:
+        for table in (sync_state, sync_watermarks):
+            cols = {r[1] for r in conn.execute(sa.text(f"PRAGMA table_info({table.name})"))}
+            for col in table.columns:
+                if col.name not in cols:
+                    conn.execute(sa.text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} "
+                                         f"{col.type.compile(engine.dialect)}"))
+
+def signature(fields, qty):
+    return "\x1f".join([repr(fields[f]) for f in SYNC_FIELDS] + [str(qty)])
+
+def load_state(engine, peer, skus):
+    # returns (local_wm, remote_wm, branch), sku -> {"base", "remote_base", "sig"}
+    skus, state = list(skus), {}
+    t = sync_state
+    with engine.connect() as conn:
+        wm = conn.execute(sa.select(sync_watermarks).where(sync_watermarks.c.peer == peer)).first()
+        for start in range(0, len(skus), PAGE_SIZE):
+            chunk = skus[start:start + PAGE_SIZE]
+            for row in conn.execute(sa.select(t).where(t.c.peer == peer, t.c.sku.in_(chunk))):
+                state[row.sku] = {"base": row.base_qty, "sig": row.sig,
+                                  "remote_base": row.base_qty if row.remote_base is None else row.remote_base}
+    return (wm.local_wm, wm.remote_wm, wm.branch) if wm else (None, None, None), state
+
+def load_pending(engine, peer):
+    # sku -> generation of pushes not known to have committed
+    with engine.connect() as conn:
+        return dict(conn.execute(sa.select(sync_state.c.sku, sync_state.c.pending_gen)
+                                 .where(sync_state.c.peer == peer, sync_state.c.pending_gen.is_not(None))).all())
+
+def save_state(conn, peer, state, local_wm, remote_wm, branch):
+    if state:
+        conn.execute(sa.text("INSERT OR REPLACE INTO sync_state (peer, sku, base_qty, sig, remote_base, pending_gen) "
+                             "VALUES (:peer, :sku, :base, :sig, :remote_base, :pending_gen)"),
+                     [dict(s, peer=peer, sku=sku) for sku, s in state.items()])
+    conn.execute(sa.delete(sync_watermarks).where(sync_watermarks.c.peer == peer))
+    conn.execute(sa.insert(sync_watermarks).values(peer=peer, local_wm=local_wm, remote_wm=remote_wm,
+                                                   synced_at=datetime.datetime.utcnow(), branch=branch))
+
+def mark_pushed(engine, peer, skus):
+    with engine.begin() as conn:
+        conn.execute(sync_state.update()
+                     .where(sync_state.c.peer == peer, sync_state.c.sku.in_(skus))
+                     .values(remote_base=sync_state.c.base_qty, pending_gen=None))
+# ----------------------------
+
+def merge(local, remote, state):
+    # returns (fields, qty) agreed by both sides
+    if local and remote:
+        newer = local if (local["updated_at"] or EPOCH) >= (remote["updated_at"] or EPOCH) else remote
+        if state is None:
+            # never synced together: no common ancestor, the newer side wins
+            qty = newer["qty"]
+        else:
+            base = state["base"]
+            qty = base + (local["qty"] - base) + (remote["qty"] - state["remote_base"])
+        return {f: newer[f] for f in SYNC_FIELDS}, qty
+    only = local or remote
+    return {f: only[f] for f in SYNC_FIELDS}, only["qty"]
+
+def plan_write(current, fields, qty, force=False):
+    if current is None:
+        return {"create": True, "fields": fields, "qty_delta": qty}
+    changed = {f: v for f, v in fields.items() if current[f] != v}
+    delta = qty - current["qty"]
+    if not changed and not delta and not force:
+        return None
+    return {"create": False, "key": current["key"], "fields": changed, "qty_delta": delta}
+
+def next_watermark(seen, watermark, grace=datetime.timedelta(0)):
+    newest = max([r["updated_at"] for r in seen.values() if r["updated_at"]], default=None)
+    if newest is None:
+        return watermark
+    return max(newest - grace, watermark or EPOCH)
+
+def sync(local, remote, peer="firestore"):
+    engine = local.engine
+    ensure_state_tables(engine)
+    (local_wm, remote_wm, branch), _ = load_state(engine, peer, [])
+    branch = branch or uuid.uuid4().hex
+    gen = uuid.uuid4().hex
+    local_seen = {r["sku"]: r for r in local.changed_since(local_wm)}
+    remote_seen = {r["sku"]: r for r in remote.changed_since(remote_wm)}
+    # pushes of an earlier run that may or may not have committed
+    pending = load_pending(engine, peer)
+    remote_pending = {sku: r for sku, r in remote.get(set(pending) - set(remote_seen)).items()}
+    _, state = load_state(engine, peer, set(local_seen) | set(remote_seen) | set(pending))
+    for sku, tag in pending.items():
+        r = remote_seen.get(sku) or remote_pending.get(sku)
+        if sku in state and r is not None and r["tags"].get(branch) == tag:
+            state[sku]["remote_base"] = state[sku]["base"]  # it landed
+
+    def unsynced(records):
+        return {sku: r for sku, r in records.items()
+                if r.get("needs_sku") or sku in pending or state.get(sku, {}).get("sig") != signature(r, r["qty"])}
+    local_changed, remote_changed = unsynced(local_seen), unsynced(remote_seen)
+    remote_changed.update(remote_pending)
+    skus = set(local_changed) | set(remote_changed) | set(pending)
+    # the other side of each changed record, fetched by sku
+    local_cur = dict(local_changed)
+    local_cur.update(local.get(skus - set(local_changed)))
+    remote_cur = dict(remote_changed)
+    remote_cur.update(remote.get(skus - set(remote_changed)))
+
+    local_writes, remote_writes, new_state = [], [], {}
+    for sku in sorted(skus):
+        l, r = local_cur.get(sku), remote_cur.get(sku)
+        if l is None and r is None:
+            continue
+        fields, qty = merge(l, r, state.get(sku))
+        lw = plan_write(l, fields, qty)
+        rw = plan_write(r, fields, qty, force=bool(r and r.get("needs_sku")))
+        for w, out in ((lw, local_writes), (rw, remote_writes)):
+            if w:
+                w["sku"] = sku
+                out.append(w)
+        new_state[sku] = {"base": qty, "sig": signature(fields, qty), "remote_base": qty, "pending_gen": None}
+        if rw:
+            rw["tag"] = (branch, gen)
+            new_state[sku].update(remote_base=r["qty"] if r else 0, pending_gen=gen)
+
+    # pull and state in one transaction, then push; each committed batch is
+    # marked so the next run does not look for its tags
+    next_local = next_watermark(local_seen, local_wm, SYNC_GRACE)
+    next_remote = next_watermark(remote_seen, remote_wm)
+    local.apply(local_writes, then=lambda conn: save_state(conn, peer, new_state, next_local, next_remote, branch))
+    remote.apply(remote_writes, on_commit=lambda pushed: mark_pushed(engine, peer, pushed))
+    return {"local_changed": len(local_changed), "remote_changed": len(remote_changed),
+            "pushed": len(remote_writes), "pulled": len(local_writes)}
+
+def main():
+    ap = argparse.ArgumentParser(description="Sync the SQLite stock database with Firestore.")
+    ap.add_argument("--db", default="inventory.db")
+    ap.add_argument("--credentials", default="serviceAccountKey.json")
+    args = ap.parse_args()
+    engine = sa.create_engine(f"sqlite:///{args.db}")
+    print(sync(SqliteStockStore(engine), FirestoreStockStore(firestore_client(args.credentials))))
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,77 @@
 %%writefile app.py
+import os
 import streamlit as st
 import firebase_admin
 from firebase_admin import credentials, firestore
 from datetime import datetime
+import wiro_store
+import wiro_journal
 
 # --- Firebase Setup ---
-cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Cached so reruns reuse one client (initialize_app fails on a second call).
+# WIRO_FIRESTORE=fake runs on the in-process fake, e.g. for demos.
+@st.cache_resource
+def get_db():
+    if os.environ.get("WIRO_FIRESTORE") == "fake":
+        import fake_firestore
+        return fake_firestore.Client()
+    cred = credentials.Certificate("serviceAccountKey.json")
+    firebase_admin.initialize_app(cred)
+    return firestore.client()
+
+db = get_db()
+
+# Process-wide live copy of `inventory`, shared by every session: one full
+# load, then on_snapshot deltas, so page renders cost no Firestore reads.
+@st.cache_resource
+def inventory_mirror():
+    mirror = wiro_store.InventoryMirror(db).start()
+    mirror.ready.wait(timeout=30)
+    return mirror
+
+mirror = inventory_mirror()
+
+def mirror_status():
+    s = mirror.status()
+    if not s["active"]:
+        st.warning("Live updates stopped — showing the last known state.")
+        if st.button("Reconnect"):
+            mirror.restart()
+            mirror.ready.wait(timeout=30)
+            st.rerun()
+    elif s["seconds_since_update"] is not None:
+        st.caption(f"Live · {s['rows']} items · last change {s['seconds_since_update']:.0f}s ago")
+
+# Write-behind: Save Item, Apply Change, Apply delivery note and Record Event
+# journal their writes locally and return at once; wiro_journal sends them to
+# Firestore in the background. WIRO_WRITE_BEHIND=0 writes synchronously.
+@st.cache_resource
+def write_journal():
+    if os.environ.get("WIRO_WRITE_BEHIND", "1") == "0":
+        return None
+    return wiro_journal.WriteJournal(db)
+
+journal = write_journal()
+
+def journal_status():
+    if journal is None:
+        return
+    s = journal.status()
+    if s["pending"]:
+        note = f" · retrying ({s['last_error']})" if s["last_error"] else ""
+        st.sidebar.caption(f"⏳ {s['pending']} change(s) waiting to sync{note}")
+    else:
+        st.sidebar.caption("✅ All changes synced")
+    if s["failed"]:
+        st.sidebar.error(f"{s['failed']} change(s) rejected by Firestore")
+        with st.sidebar.expander("Rejected changes"):
+            st.dataframe(journal.failed(), use_container_width=True)
+            if st.button("Retry"):
+                journal.retry_failed()
+                st.rerun()
+            if st.button("Discard"):
+                journal.discard_failed()
+                st.rerun()
 
 # --- App Title ---
 st.set_page_config(page_title="Wiro Ventures Stock System", page_icon="📦", layout="wide")
@@ -20,99 +84,164 @@ page = st.sidebar.radio("Navigate", ["Add Item", "View Inventory", "Stock In/Out
 if page == "Add Item":
     st.header("➕ Add New Stock Item")
     name = st.text_input("Item Name")
+    sku = st.text_input("SKU (optional, matches the SQLite stock app)")
     category = st.text_input("Category", "General")
     qty = st.number_input("Initial Quantity", 0, 1000, 1)
     cost = st.number_input("Unit Cost (Ksh)", 0.0, 100000.0, 0.0)
 
     if st.button("Save Item"):
         if name:
-            db.collection("inventory").add({
-                "name": name,
-                "category": category,
-                "qty": qty,
-                "cost": cost,
-                "timestamp": datetime.now()
-            })
-            st.success(f"{name} added successfully!")
+            if journal:
+                journal.add_item(name, category, qty, cost, sku=sku.strip() or None)
+                st.success(f"{name} saved — it appears in the inventory once synced.")
+            else:
+                wiro_store.add_item(db, name, category, qty, cost, sku=sku.strip() or None)
+                st.success(f"{name} added successfully!")
         else:
             st.warning("Please enter an item name.")
 
 # --- View Inventory ---
 elif page == "View Inventory":
     st.header("📋 Current Inventory")
-    items = db.collection("inventory").stream()
-    data = []
-    for i in items:
-        item = i.to_dict()
-        data.append(item)
-    if data:
-        st.dataframe(data, use_container_width=True)
+    mirror_status()
+    if len(mirror):
+        st.dataframe(mirror.table(), use_container_width=True)
     else:
         st.info("No items found in inventory.")
 
 # --- Stock In / Out ---
 elif page == "Stock In/Out":
     st.header("🔄 Update Stock Quantity")
-    docs = db.collection("inventory").stream()
-    choices = {doc.id: doc.to_dict()["name"] for doc in docs}
-    if choices:
-        selected = st.selectbox("Select Item", list(choices.values()))
+    mirror_status()
+    index = mirror.index()
+    if index:
+        doc_id = st.selectbox("Select Item", list(index), format_func=lambda k: wiro_store.item_label(k, index))
         action = st.radio("Action", ["Stock In", "Stock Out"])
         amount = st.number_input("Quantity", 1, 1000, 1)
 
-        # Find selected doc ID
-        doc_id = [k for k, v in choices.items() if v == selected][0]
-        doc_ref = db.collection("inventory").document(doc_id)
-        doc = doc_ref.get().to_dict()
-
         if st.button("Apply Change"):
-            new_qty = doc["qty"] + amount if action == "Stock In" else doc["qty"] - amount
-            doc_ref.update({"qty": new_qty})
-            db.collection("transactions").add({
-                "item": selected,
-                "action": action,
-                "amount": amount,
-                "timestamp": datetime.now()
-            })
-            st.success(f"{action} successful! New quantity: {new_qty}")
+            delta = amount if action == "Stock In" else -amount
+            if journal:
+                # shown with the changes still waiting to sync
+                journal.apply_movement(doc_id, index[doc_id]["name"], action, amount)
+                qty = (index[doc_id].get("qty") or 0) + journal.pending_deltas().get(doc_id, 0)
+            else:
+                # Increment + transaction record in one atomic batch
+                wiro_store.apply_movement(db, doc_id, index[doc_id]["name"], action, amount)
+                qty = (index[doc_id].get("qty") or 0) + delta
+            st.success(f"{action} successful! New quantity: {qty}")
+
+        st.subheader("📑 Delivery note (bulk)")
+        st.caption("CSV columns: item_id or name, amount, optional action (Stock In / Stock Out). "
+                   "A negative amount is a Stock Out.")
+        note = st.file_uploader("Upload delivery note", type=["csv"])
+        if note:
+            movements, errors = wiro_store.parse_delivery_note(note.getvalue().decode("utf-8"), index)
+            for e in errors:
+                st.warning(e)
+            st.write(f"{len(movements)} movements ready.")
+            if movements and st.button("Apply delivery note"):
+                if journal:
+                    journal.apply_movements(movements, index, source=note.name)
+                    st.success(f"Saved {len(movements)} movements; they sync in the background.")
+                else:
+                    batches = wiro_store.apply_movements(db, movements, index, source=note.name)
+                    st.success(f"Applied {len(movements)} movements in {batches} batch(es).")
     else:
         st.warning("No items in inventory to update.")
 
 # --- Event Tracker ---
 elif page == "Event Tracker":
     st.header("🎉 Event Supplies Tracker")
+    index = mirror.index()
     event_name = st.text_input("Event Name")
-    item = st.text_input("Supplied Item")
+    item_id = st.selectbox("Supplied Item", list(index), format_func=lambda k: wiro_store.item_label(k, index))
     qty_used = st.number_input("Quantity Used", 1, 1000, 1)
     date = st.date_input("Event Date", datetime.now())
 
     if st.button("Record Event"):
-        db.collection("events").add({
-            "event_name": event_name,
-            "item": item,
-            "qty_used": qty_used,
-            "date": str(date),
-            "timestamp": datetime.now()
-        })
-        st.success(f"Event '{event_name}' recorded.")
-
-    # View recent events
-    st.subheader("Recent Events")
-    events = db.collection("events").order_by("timestamp", direction=firestore.Query.DESCENDING).limit(5).stream()
+        if event_name and item_id:
+            # also takes the quantity out of stock, in the same batch
+            if journal:
+                journal.record_event(event_name, item_id, index[item_id]["name"], qty_used, date)
+            else:
+                wiro_store.record_event(db, event_name, item_id, index[item_id]["name"], qty_used, date)
+            st.success(f"Event '{event_name}' recorded.")
+        else:
+            st.warning("Please enter an event name and pick an item.")
+
+    # Event history, one page at a time
+    st.subheader("Event History")
+    col1, col2, col3 = st.columns(3)
+    item_filter = col1.selectbox("Item", [None] + list(index),
+                                 format_func=lambda k: "All items" if k is None else wiro_store.item_label(k, index))
+    date_from = col2.date_input("From", None)
+    date_to = col3.date_input("To", None)
+    filters = {"item_id": item_filter, "date_from": date_from, "date_to": date_to}
+    if st.session_state.get("event_filters") != filters:
+        # cursors are only valid for the query that produced them
+        st.session_state.event_filters = filters
+        st.session_state.event_cursors = [None]
+    cursors = st.session_state.event_cursors
+    events, next_cursor = wiro_store.events_page(db, cursors[-1], **filters)
     for e in events:
         ev = e.to_dict()
         st.write(f"📅 {ev['event_name']} — {ev['item']} ({ev['qty_used']} units) on {ev['date']}")
+    if not events:
+        st.info("No events found.")
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    if prev_col.button("◀ Newer", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    page_col.caption(f"Page {len(cursors)}")
+    if next_col.button("Older ▶", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
 
 # --- Reports Page ---
 elif page == "Reports":
     st.header("📊 Reports Overview")
 
-    total_items = len(list(db.collection("inventory").stream()))
-    total_events = len(list(db.collection("events").stream()))
-    total_transactions = len(list(db.collection("transactions").stream()))
+    # aggregation counts, not a full download of each collection
+    total_items = wiro_store.count_documents(db, "inventory")
+    total_events = wiro_store.count_documents(db, "events")
+    total_transactions = wiro_store.count_documents(db, "transactions")
 
     st.metric("Total Items", total_items)
     st.metric("Events Tracked", total_events)
     st.metric("Stock Transactions", total_transactions)
 
+    with st.expander("Counters"):
+        st.write("Sharded counters are the fallback when aggregation queries are unavailable.")
+        st.table([{"collection": c, "counter": wiro_store.read_counter(db, c)}
+                  for c in wiro_store.COUNTED_COLLECTIONS])
+        if st.button("Recount from Firestore"):
+            for c in wiro_store.COUNTED_COLLECTIONS:
+                wiro_store.recount(db, c)
+            st.success("Counters re-seeded.")
+
+    # pre-aggregated usage: one document per month / per event
+    st.subheader("Consumption")
+    today = datetime.now().date()
+    months = st.slider("Months", 1, 24, 6)
+    first = today.year * 12 + today.month - months  # months since year 0, 0-based
+    month_from = f"{first // 12:04d}-{first % 12 + 1:02d}"
+    usage = wiro_store.monthly_usage(db, month_from, today.strftime("%Y-%m"))
+    if usage:
+        st.bar_chart({u["month"]: u.get("total", 0) for u in usage})
+        index = mirror.index()
+        st.dataframe([{"month": u["month"], "item": index.get(k, {}).get("name", k), "qty_used": v}
+                      for u in usage for k, v in sorted(u.get("items", {}).items())],
+                     use_container_width=True)
+    else:
+        st.write("No usage recorded in this period.")
+    with st.expander("By event"):
+        st.dataframe([{"date": u["date"], "event": u["event_name"], "qty_used": u.get("total", 0),
+                       "records": u.get("records", 0)}
+                      for u in wiro_store.event_usage(db, f"{month_from}-01", today.isoformat())],
+                     use_container_width=True)
+
     st.info("Coming soon: CSV export and charts.")
+
+# last, so it counts what this run just journalled
+journal_status()
@@ -0,0 +1,364 @@
+# wiro_journal.py
+# Write-behind mode for "wiro app.py". A button appends its operation to a
+# local SQLite journal and returns once that is on disk; a flusher thread
+# sends the journal to Firestore in the background.
+#
+# Every operation gets an idempotency key when it is journalled, and the
+# documents it creates are named up front: transaction and event records
+# after the key, a new item by an id picked then. The flusher takes pending
+# operations in order and coalesces them into one batch of at most
+# MAX_BATCH_WRITES writes: all movements of an item become one Increment,
+# usage totals one merge per document, counter bumps one per collection.
+#
+# Increments are not idempotent, so each batch also creates
+# journal_batches/<batch id>. The batch id is saved with its operations
+# before the first attempt, and a retry resends exactly that batch. If an
+# earlier attempt did land (the ack was lost), creating the marker fails
+# with AlreadyExists, Firestore rejects the whole batch, and the operations
+# are marked done instead of being applied twice. Once a batch's operations
+# are done the marker has nothing left to guard: later batches delete up to
+# MARKER_DELETES of them each, and an idle flusher deletes the rest.
+#
+# Failed commits are retried with exponential backoff up to MAX_BACKOFF.
+# An error retrying cannot fix (NotFound: the item was deleted meanwhile)
+# splits the batch into single operations; the one that still fails stays
+# in the journal as "failed" for the app to show. Pending operations,
+# including a batch that was in flight, survive a restart and are sent by
+# the next WriteJournal on the same file.
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import fake_firestore
+import wiro_store
+from wiro_store import Increment, SERVER_TIMESTAMP, MAX_BATCH_WRITES
+
+ALREADY_APPLIED = (fake_firestore.AlreadyExists,)
+PERMANENT = (fake_firestore.NotFound,)
+try:
+    from google.api_core import exceptions as api_exceptions
+    ALREADY_APPLIED += (api_exceptions.AlreadyExists,)
+    PERMANENT += (api_exceptions.NotFound, api_exceptions.InvalidArgument)
+except ImportError:  # fake_firestore without the SDK installed
+    pass
+
+JOURNAL_PATH = os.environ.get("WIRO_JOURNAL",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "wiro_journal.db"))
+MARKERS = "journal_batches"
+MARKER_DELETES = 20     # old markers deleted by each batch
+LINGER_SECONDS = 0.25   # after a new operation, wait this long for others to coalesce with
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 60.0
+# most writes an operation adds to a batch, before coalescing
+OP_WRITES = {"add_item": 1, "movement": 2, "event": 5}
+# its own marker, old markers, one bump per counter
+RESERVED_WRITES = 1 + MARKER_DELETES + len(wiro_store.COUNTED_COLLECTIONS)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ops (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,    -- idempotency key, names the documents the op creates
+    kind TEXT NOT NULL,          -- add_item, movement, event
+    payload TEXT NOT NULL,       -- json
+    created_at REAL NOT NULL,    -- unix time the user acted
+    batch TEXT,                  -- set before the first attempt; retries resend the same batch
+    attempts INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending or failed; done ops are deleted
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_ops_status ON ops (status, id);
+CREATE TABLE IF NOT EXISTS markers (
+    batch TEXT PRIMARY KEY,      -- journal_batches doc of a batch whose ops are done
+    deleted_by TEXT              -- the batch that deletes it, once claimed
+);
+"""
+
+def connect(path=JOURNAL_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # FULL: an acknowledged operation survives a power cut, not just a crash
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.executescript(SCHEMA)
+    return conn
+
+# ---------- staging ----------
+def add_usage(usage, ref, fields, item_id, qty):
+    u = usage.setdefault(ref, dict(fields, total=0, records=0, items={}))
+    u["total"] += qty
+    u["records"] += 1
+    u["items"][item_id] = u["items"].get(item_id, 0) + qty
+
+def stage(batch, db, ops):
+    # ops: (key, kind, payload, created_at) in journal order. Writes the same
+    # documents as wiro_store's synchronous paths, coalesced.
+    items, deltas, usage = {}, {}, {}
+    counts = dict.fromkeys(wiro_store.COUNTED_COLLECTIONS, 0)
+    for key, kind, p, created in ops:
+        at = datetime.fromtimestamp(created)
+        if kind == "add_item":
+            items[p["item_id"]] = wiro_store.item_record(p["name"], p["category"], p["qty"], p["cost"],
+                                                         p.get("sku"), at)
+            counts["inventory"] += 1
+            continue
+        if kind == "event":
+            ev_key = wiro_store.event_key(p["event_name"], p["date"])
+            batch.set(db.collection("events").document(key), wiro_store.event_record(
+                p["event_name"], ev_key, p["item_id"], p["item_name"], p["qty_used"], p["date"], at))
+            add_usage(usage, ("event_usage", ev_key), {"event_name": p["event_name"], "date": p["date"]},
+                      p["item_id"], p["qty_used"])
+            add_usage(usage, ("monthly_usage", p["date"][:7]), {"month": p["date"][:7]},
+                      p["item_id"], p["qty_used"])
+            counts["events"] += 1
+            action, amount, extra = "Stock Out", p["qty_used"], {"event_key": ev_key}
+        else:
+            action, amount, extra = p["action"], p["amount"], p.get("extra") or {}
+        batch.set(db.collection("transactions").document(key),
+                  wiro_store.movement_record(p["item_id"], p["item_name"], action, amount, at, **extra))
+        counts["transactions"] += 1
+        delta = amount if action == "Stock In" else -amount
+        if p["item_id"] in items:
+            items[p["item_id"]]["qty"] += delta  # created in this batch: start from the new total
+        else:
+            deltas[p["item_id"]] = deltas.get(p["item_id"], 0) + delta
+    for item_id, data in items.items():
+        batch.set(db.collection("inventory").document(item_id), data)
+    for item_id, delta in deltas.items():
+        if delta:
+            batch.update(db.collection("inventory").document(item_id),
+                         {"qty": Increment(delta), "updated_at": SERVER_TIMESTAMP})
+    for (collection, doc_id), u in usage.items():
+        batch.set(db.collection(collection).document(doc_id), dict(
+            u, total=Increment(u["total"]), records=Increment(u["records"]),
+            items={k: Increment(v) for k, v in u["items"].items()}), merge=True)
+    for name, n in counts.items():
+        if n:
+            wiro_store.bump_counter(batch, db, name, n)
+# ----------------------------
+
+
+class WriteJournal:
+    def __init__(self, db, path=JOURNAL_PATH, linger=LINGER_SECONDS):
+        self.db = db
+        self.path = path
+        self.linger = linger
+        self.conn = connect(path)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.journalled = 0
+        self.flushed = 0
+        self.batches = 0
+        self.retries = 0
+        self.already_applied = 0   # batches whose lost ack was detected on retry
+        self.last_error = None
+        self.last_flush = None
+        if self.pending():
+            self._wake.set()  # left over from the last run
+        self.thread = threading.Thread(target=self._run, name="wiro-journal", daemon=True)
+        self.thread.start()
+
+    # ---------- journalling ----------
+    def _append(self, ops):
+        # ops: (kind, payload); returns their keys once they are on disk
+        keys = [uuid.uuid4().hex for _ in ops]
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT INTO ops (key, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+                                  [(k, kind, json.dumps(p), now) for k, (kind, p) in zip(keys, ops)])
+        self.journalled += len(ops)
+        self._wake.set()
+        return keys
+
+    def add_item(self, name, category, qty, cost, sku=None):
+        # the new item's id, usable before it reaches Firestore
+        item_id = self.db.collection("inventory").document().id
+        self._append([("add_item", {"item_id": item_id, "name": name, "category": category, "qty": qty,
+                                    "cost": cost, "sku": sku})])
+        return item_id
+
+    def apply_movement(self, item_id, item_name, action, amount):
+        return self._append([("movement", {"item_id": item_id, "item_name": item_name, "action": action,
+                                           "amount": amount})])[0]
+
+    def apply_movements(self, movements, index, **extra):
+        # movements: (item_id, action, amount); journalled in one transaction
+        return self._append([("movement", {"item_id": item_id, "item_name": index[item_id].get("name", ""),
+                                           "action": action, "amount": amount, "extra": extra})
+                             for item_id, action, amount in movements])
+
+    def record_event(self, event_name, item_id, item_name, qty_used, date):
+        return self._append([("event", {"event_name": event_name, "item_id": item_id, "item_name": item_name,
+                                        "qty_used": qty_used, "date": str(date)})])[0]
+    # ----------------------------
+
+    # ---------- flushing ----------
+    def _run(self):
+        backoff = 0.0
+        while not self._stop.is_set():
+            self._wake.wait()
+            if self._stop.wait(self.linger):
+                break
+            self._wake.clear()
+            try:
+                while not self._stop.is_set() and self._flush_batch():
+                    backoff = 0.0
+            except Exception:
+                backoff = min(MAX_BACKOFF, max(MIN_BACKOFF, backoff * 2))
+                self._stop.wait(backoff * random.uniform(0.5, 1.0))
+                self._wake.set()
+
+    def _claim(self):
+        # the batch in flight first, exactly as sent before; otherwise the
+        # next pending operations, as many as fit in one batch
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT batch FROM ops WHERE status = 'pending' AND batch IS NOT NULL "
+                                    "ORDER BY id LIMIT 1").fetchone()
+            if row:
+                batch_id = row[0]
+                rows = self.conn.execute("SELECT id, key, kind, payload, created_at FROM ops "
+                                         "WHERE batch = ? AND status = 'pending' ORDER BY id", (batch_id,)).fetchall()
+            else:
+                batch_id, rows, writes = uuid.uuid4().hex, [], RESERVED_WRITES
+                for r in self.conn.execute("SELECT id, key, kind, payload, created_at FROM ops "
+                                           "WHERE status = 'pending' ORDER BY id LIMIT ?", (MAX_BATCH_WRITES,)).fetchall():
+                    writes += OP_WRITES[r[2]]
+                    if writes > MAX_BATCH_WRITES:
+                        break
+                    rows.append(r)
+                self.conn.executemany("UPDATE ops SET batch = ? WHERE id = ?", [(batch_id, r[0]) for r in rows])
+                if rows:
+                    self.conn.execute("UPDATE markers SET deleted_by = ? WHERE batch IN (SELECT batch FROM markers "
+                                      "WHERE deleted_by IS NULL LIMIT ?)", (batch_id, MARKER_DELETES))
+            markers = [m for m, in self.conn.execute("SELECT batch FROM markers WHERE deleted_by = ?", (batch_id,))]
+        ops = [(key, kind, json.loads(p), at) for _, key, kind, p, at in rows]
+        return batch_id, [r[0] for r in rows], ops, markers
+
+    def _flush_batch(self):
+        # sends one batch; False when nothing is pending
+        batch_id, ids, ops, markers = self._claim()
+        if not ops:
+            self._delete_markers()
+            return False
+        batch = self.db.batch()
+        batch.create(self.db.collection(MARKERS).document(batch_id), {"ops": len(ops), "committed_at": SERVER_TIMESTAMP})
+        for m in markers:
+            batch.delete(self.db.collection(MARKERS).document(m))
+        stage(batch, self.db, ops)
+        try:
+            batch.commit()
+        except ALREADY_APPLIED:
+            self.already_applied += 1
+        except PERMANENT as e:
+            self._reject(batch_id, ids, e)
+            return True
+        except Exception as e:
+            self.retries += 1
+            self.last_error = f"{type(e).__name__}: {e}"[:500]
+            with self._lock, self.conn:
+                self.conn.executemany("UPDATE ops SET attempts = attempts + 1, error = ? WHERE id = ?",
+                                      [(self.last_error, i) for i in ids])
+            raise
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM ops WHERE id = ?", [(i,) for i in ids])
+            self.conn.execute("DELETE FROM markers WHERE deleted_by = ?", (batch_id,))
+            self.conn.execute("INSERT INTO markers (batch) VALUES (?)", (batch_id,))
+        self.flushed += len(ops)
+        self.batches += 1
+        self.last_error = None
+        self.last_flush = time.time()
+        return True
+
+    def _reject(self, batch_id, ids, error):
+        # Firestore applied nothing. Resent alone, each operation either goes
+        # through or turns out to be the one that fails.
+        self.last_error = f"{type(error).__name__}: {error}"[:500]
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE markers SET deleted_by = NULL WHERE deleted_by = ?", (batch_id,))
+            if len(ids) > 1:
+                self.conn.executemany("UPDATE ops SET batch = ? WHERE id = ?", [(uuid.uuid4().hex, i) for i in ids])
+            else:
+                self.conn.execute("UPDATE ops SET status = 'failed', attempts = attempts + 1, error = ? WHERE id = ?",
+                                  (self.last_error, ids[0]))
+
+    def _delete_markers(self):
+        # idle: delete the markers left by the last batches (deletes are idempotent)
+        with self._lock:
+            markers = [m for m, in self.conn.execute("SELECT batch FROM markers LIMIT ?", (MAX_BATCH_WRITES,))]
+        if not markers:
+            return
+        batch = self.db.batch()
+        for m in markers:
+            batch.delete(self.db.collection(MARKERS).document(m))
+        batch.commit()
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM markers WHERE batch = ?", [(m,) for m in markers])
+
+    def flush(self, timeout=None):
+        # waits until nothing is pending (failed operations aside); False on timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._wake.set()
+        while self.pending():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.02)
+        return True
+
+    def close(self):
+        # stops the flusher; whatever is pending is sent by the next WriteJournal
+        self._stop.set()
+        self._wake.set()
+        self.thread.join()
+        self.conn.close()
+    # ----------------------------
+
+    # ---------- status ----------
+    def pending(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM ops WHERE status = 'pending'").fetchone()[0]
+
+    def pending_deltas(self):
+        # item id -> quantity change not yet in Firestore
+        with self._lock:
+            rows = self.conn.execute("SELECT kind, payload FROM ops WHERE status = 'pending' "
+                                     "AND kind != 'add_item'").fetchall()
+        out = {}
+        for kind, payload in rows:
+            p = json.loads(payload)
+            delta = -p["qty_used"] if kind == "event" else p["amount"] if p["action"] == "Stock In" else -p["amount"]
+            out[p["item_id"]] = out.get(p["item_id"], 0) + delta
+        return out
+
+    def status(self):
+        with self._lock:
+            counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM ops GROUP BY status").fetchall())
+            oldest = self.conn.execute("SELECT MIN(created_at) FROM ops WHERE status = 'pending'").fetchone()[0]
+            markers = self.conn.execute("SELECT COUNT(*) FROM markers").fetchone()[0]
+        return {"pending": counts.get("pending", 0), "failed": counts.get("failed", 0), "markers": markers,
+                "oldest_pending_s": None if oldest is None else time.time() - oldest,
+                "journalled": self.journalled, "flushed": self.flushed, "batches": self.batches,
+                "retries": self.retries, "already_applied": self.already_applied, "last_error": self.last_error}
+
+    def failed(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT id, kind, payload, created_at, error FROM ops "
+                                     "WHERE status = 'failed' ORDER BY id").fetchall()
+        return [{"id": i, "kind": kind, "at": datetime.fromtimestamp(at).strftime("%Y-%m-%d %H:%M:%S"),
+                 "error": error, **json.loads(p)} for i, kind, p, at, error in rows]
+
+    def retry_failed(self):
+        with self._lock, self.conn:
+            n = self.conn.execute("UPDATE ops SET status = 'pending', batch = NULL "
+                                  "WHERE status = 'failed'").rowcount
+        self._wake.set()
+        return n
+
+    def discard_failed(self):
+        with self._lock, self.conn:
+            return self.conn.execute("DELETE FROM ops WHERE status = 'failed'").rowcount
+    # ----------------------------
@@ -0,0 +1,357 @@
+# wiro_store.py
+# Firestore data paths for "wiro app.py". They take the client as an
+# argument, so they run the same against Firestore, the emulator
+# (FIRESTORE_EMULATOR_HOST) or fake_firestore.Client.
+import csv
+import io
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+try:
+    from google.cloud.firestore import Increment, SERVER_TIMESTAMP
+except ImportError:  # fake_firestore without the SDK installed
+    from fake_firestore import Increment, SERVER_TIMESTAMP
+try:
+    from google.api_core.exceptions import Unimplemented
+except ImportError:
+    Unimplemented = NotImplementedError
+
+# ---------- counters ----------
+# Sharded counters are kept next to every write as a fallback for backends
+# without aggregation queries. Each shard takes at most ~1 write/s in
+# production, so COUNTER_SHARDS bounds the sustained write rate per counter.
+COUNTER_SHARDS = 10
+COUNTED_COLLECTIONS = ("inventory", "events", "transactions")
+
+def counter_shards(db, name):
+    return db.collection("counters").document(name).collection("shards")
+
+def bump_counter(batch, db, name, n=1):
+    shard = counter_shards(db, name).document(str(random.randrange(COUNTER_SHARDS)))
+    batch.set(shard, {"count": Increment(n)}, merge=True)
+
+def read_counter(db, name):
+    # O(shards), independent of collection size
+    return sum((s.to_dict() or {}).get("count", 0) for s in counter_shards(db, name).stream())
+
+def reset_counter(db, name, value):
+    batch = db.batch()
+    for i in range(COUNTER_SHARDS):
+        batch.set(counter_shards(db, name).document(str(i)), {"count": value if i == 0 else 0})
+    batch.commit()
+
+# old SDKs have no count(); backends without aggregation answer UNIMPLEMENTED
+AGGREGATION_UNSUPPORTED = (AttributeError, NotImplementedError, Unimplemented)
+
+def count_documents(db, name):
+    # server-side aggregation first; the sharded counter if it is unavailable.
+    # Other errors (permissions, network) are raised, not hidden behind a
+    # possibly stale counter.
+    try:
+        return db.collection(name).count(alias="n").get()[0][0].value
+    except AGGREGATION_UNSUPPORTED:
+        return read_counter(db, name)
+
+def recount(db, name):
+    # re-seed the sharded counter from an aggregation count
+    n = db.collection(name).count(alias="n").get()[0][0].value
+    reset_counter(db, name, n)
+    return n
+# ----------------------------
+
+# ---------- writes ----------
+# Each document write and its counter bump are committed in one batch.
+def add_document(db, collection, data):
+    ref = db.collection(collection).document()
+    batch = db.batch()
+    batch.set(ref, data)
+    bump_counter(batch, db, collection)
+    batch.commit()
+    return ref
+
+# Document layouts, shared with the write-behind journal (wiro_journal.py).
+# `at` is when the user acted; now unless given.
+def item_record(name, category, qty, cost, sku=None, at=None):
+    # `updated_at` is the sync watermark read by stock_sync.py; the server
+    # stamps it, so a kiosk with a slow clock cannot write it in the past
+    data = {
+        "name": name,
+        "category": category,
+        "qty": qty,
+        "cost": cost,
+        "timestamp": at or datetime.now(),
+        "updated_at": SERVER_TIMESTAMP
+    }
+    if sku:
+        data["sku"] = sku
+    return data
+
+def movement_record(item_id, item_name, action, amount, at=None, **extra):
+    return dict({
+        "item": item_name,
+        "item_id": item_id,
+        "action": action,
+        "amount": amount,
+        "timestamp": at or datetime.now()
+    }, **extra)
+
+def event_record(event_name, key, item_id, item_name, qty_used, date, at=None):
+    return {
+        "event_name": event_name,
+        "event_key": key,
+        "item": item_name,
+        "item_id": item_id,
+        "qty_used": qty_used,
+        "date": date,
+        "timestamp": at or datetime.now()
+    }
+
+def add_item(db, name, category, qty, cost, sku=None):
+    return add_document(db, "inventory", item_record(name, category, qty, cost, sku))
+
+def event_key(event_name, date):
+    # one usage document per event: date plus a slug of the name
+    slug = re.sub(r"[^a-z0-9]+", "-", event_name.lower()).strip("-") or "event"
+    return f"{date}_{slug}"[:200]
+
+def record_event(db, event_name, item_id, item_name, qty_used, date):
+    # The event, the inventory decrement, its transaction record and the
+    # per-event / per-month usage totals commit together.
+    date = str(date)
+    key = event_key(event_name, date)
+    ref = db.collection("events").document()
+    batch = db.batch()
+    batch.set(ref, event_record(event_name, key, item_id, item_name, qty_used, date))
+    stage_movement(batch, db, item_id, item_name, "Stock Out", qty_used, event_key=key)
+    batch.set(db.collection("event_usage").document(key), {
+        "event_name": event_name,
+        "date": date,
+        "total": Increment(qty_used),
+        "records": Increment(1),
+        "items": {item_id: Increment(qty_used)}
+    }, merge=True)
+    batch.set(db.collection("monthly_usage").document(date[:7]), {
+        "month": date[:7],
+        "total": Increment(qty_used),
+        "records": Increment(1),
+        "items": {item_id: Increment(qty_used)}
+    }, merge=True)
+    bump_counter(batch, db, "events")
+    bump_counter(batch, db, "transactions")
+    batch.commit()
+    return ref
+# ----------------------------
+
+# ---------- stock movements ----------
+# A quantity change is an Increment on the item plus its `transactions`
+# record, committed together, so concurrent staff never lose an update.
+MAX_BATCH_WRITES = 500
+MOVEMENT_WRITES = 2  # item Increment + transaction record
+
+def load_item_index(db):
+    # id -> item fields; ids are unique even where names are not
+    return {d.id: d.to_dict() for d in db.collection("inventory").stream()}
+
+def item_label(item_id, index):
+    it = index.get(item_id, {})
+    return f"{it.get('name', '?')} ({it.get('category', '')}) · {item_id}"
+
+def stage_movement(batch, db, item_id, item_name, action, amount, **extra):
+    delta = amount if action == "Stock In" else -amount
+    batch.update(db.collection("inventory").document(item_id),
+                 {"qty": Increment(delta), "updated_at": SERVER_TIMESTAMP})
+    batch.set(db.collection("transactions").document(),
+              movement_record(item_id, item_name, action, amount, **extra))
+
+def apply_movement(db, item_id, item_name, action, amount):
+    batch = db.batch()
+    stage_movement(batch, db, item_id, item_name, action, amount)
+    bump_counter(batch, db, "transactions")
+    batch.commit()
+
+def apply_movements(db, movements, index, **extra):
+    # movements: (item_id, action, amount); one commit per 500 writes
+    per_batch = (MAX_BATCH_WRITES - 1) // MOVEMENT_WRITES  # one write left for the counter
+    batches = 0
+    for start in range(0, len(movements), per_batch):
+        chunk = movements[start:start + per_batch]
+        batch = db.batch()
+        for item_id, action, amount in chunk:
+            stage_movement(batch, db, item_id, index[item_id].get("name", ""), action, amount, **extra)
+        bump_counter(batch, db, "transactions", len(chunk))
+        batch.commit()
+        batches += 1
+    return batches
+
+def parse_delivery_note(text, index):
+    # CSV with item_id or name, amount, and optional action (default Stock In);
+    # a negative amount means Stock Out. Returns (movements, errors).
+    by_name = {}
+    for item_id, it in index.items():
+        by_name.setdefault(it.get("name"), []).append(item_id)
+    movements, errors = [], []
+    for line_no, row in enumerate(csv.DictReader(io.StringIO(text)), start=2):
+        row = {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+        item_id = row.get("item_id")
+        if not item_id:
+            ids = by_name.get(row.get("name"), [])
+            if len(ids) != 1:
+                errors.append(f"line {line_no}: {'ambiguous' if ids else 'unknown'} item name {row.get('name')!r}")
+                continue
+            item_id = ids[0]
+        if item_id not in index:
+            errors.append(f"line {line_no}: unknown item_id {item_id!r}")
+            continue
+        try:
+            amount = int(float(row.get("amount") or row.get("qty") or ""))
+        except ValueError:
+            errors.append(f"line {line_no}: bad amount")
+            continue
+        action = row.get("action") or ("Stock Out" if amount < 0 else "Stock In")
+        if action not in ("Stock In", "Stock Out") or amount == 0:
+            errors.append(f"line {line_no}: bad action or zero amount")
+            continue
+        movements.append((item_id, action, abs(amount)))
+    return movements, errors
+# ----------------------------
+
+# ---------- live mirror ----------
+# One process-wide copy of a collection: a full load through the first
+# on_snapshot callback, then only the changed documents. Rows are stored
+# column-wise (id list + one list per field) so pages can render them
+# without another Firestore read.
+class InventoryMirror:
+    def __init__(self, db, collection="inventory"):
+        self.db = db
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._watch = None
+        self.ids = []
+        self.pos = {}       # doc id -> row number
+        self.columns = {}   # field -> values, aligned with ids
+        self.ready = threading.Event()
+        self.last_snapshot = None   # monotonic time of the last callback
+        self.read_time = None
+        self.changes_applied = 0
+
+    def start(self):
+        self._watch = self.db.collection(self.collection).on_snapshot(self._on_snapshot)
+        return self
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def restart(self):
+        self.stop()
+        with self._lock:
+            self.ids, self.pos, self.columns = [], {}, {}
+        self.ready.clear()
+        return self.start()
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            for change in changes:
+                if change.type.name == "REMOVED":
+                    self._remove(change.document.id)
+                else:
+                    self._upsert(change.document.id, change.document.to_dict() or {})
+            self.changes_applied += len(changes)
+            self.read_time = read_time
+            self.last_snapshot = time.monotonic()
+        self.ready.set()
+
+    def _upsert(self, doc_id, data):
+        i = self.pos.get(doc_id)
+        if i is None:
+            i = len(self.ids)
+            self.ids.append(doc_id)
+            self.pos[doc_id] = i
+            for col in self.columns.values():
+                col.append(None)
+        for k in data:
+            if k not in self.columns:
+                self.columns[k] = [None] * len(self.ids)
+        for k, col in self.columns.items():
+            col[i] = data.get(k)
+
+    def _remove(self, doc_id):
+        i = self.pos.pop(doc_id, None)
+        if i is None:
+            return
+        last = len(self.ids) - 1
+        if i != last:
+            # move the last row into the hole
+            moved = self.ids[last]
+            self.ids[i] = moved
+            self.pos[moved] = i
+            for col in self.columns.values():
+                col[i] = col[last]
+        self.ids.pop()
+        for col in self.columns.values():
+            col.pop()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def table(self):
+        with self._lock:
+            return {"id": list(self.ids), **{k: list(v) for k, v in self.columns.items()}}
+
+    def row(self, doc_id):
+        with self._lock:
+            i = self.pos.get(doc_id)
+            return None if i is None else {k: v[i] for k, v in self.columns.items()}
+
+    def index(self):
+        # id -> row dict, the same shape as load_item_index()
+        with self._lock:
+            return {doc_id: {k: v[i] for k, v in self.columns.items()} for doc_id, i in self.pos.items()}
+
+    def status(self):
+        active = self._watch is not None and getattr(self._watch, "is_active", True)
+        age = None if self.last_snapshot is None else time.monotonic() - self.last_snapshot
+        return {"active": active, "ready": self.ready.is_set(), "rows": len(self.ids),
+                "seconds_since_update": age, "changes_applied": self.changes_applied}
+# ----------------------------
+
+# ---------- event history ----------
+# Pages are read with start_after cursors; the item and date filters are
+# backed by the composite indexes in firestore.indexes.json.
+EVENTS_PAGE_SIZE = 20
+
+def events_query(db, item_id=None, date_from=None, date_to=None):
+    q = db.collection("events")
+    if item_id:
+        q = q.where("item_id", "==", item_id)
+    if date_from:
+        q = q.where("date", ">=", str(date_from))
+    if date_to:
+        q = q.where("date", "<=", str(date_to))
+    return q.order_by("date", direction="DESCENDING").order_by("timestamp", direction="DESCENDING")
+
+def events_page(db, cursor=None, page_size=EVENTS_PAGE_SIZE, **filters):
+    # returns (documents, cursor for the next page or None)
+    q = events_query(db, **filters)
+    if cursor is not None:
+        q = q.start_after(cursor)
+    docs = list(q.limit(page_size + 1).stream())
+    more = len(docs) > page_size
+    docs = docs[:page_size]
+    return docs, (docs[-1] if more else None)
+
+def monthly_usage(db, month_from, month_to):
+    # O(months) documents, whatever the number of events
+    q = (db.collection("monthly_usage").where("month", ">=", month_from)
+         .where("month", "<=", month_to).order_by("month"))
+    return [d.to_dict() for d in q.stream()]
+
+def event_usage(db, date_from, date_to):
+    q = (db.collection("event_usage").where("date", ">=", str(date_from))
+         .where("date", "<=", str(date_to)).order_by("date", direction="DESCENDING"))
+    return [dict(d.to_dict(), key=d.id) for d in q.stream()]
+# ----------------------------
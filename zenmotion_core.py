@@ -0,0 +1,131 @@
+# zenmotion_core.py
+# Exercise logic shared by the ZenMotion apps and the inference service:
+# joint angles, per-exercise thresholds and rep counting. Thresholds and
+# feedback text follow ZenMotion1-4.
+import os
+import time
+
+import numpy as np
+
+# MediaPipe Pose landmark indices (mp.solutions.pose.PoseLandmark)
+LANDMARKS = {
+    "NOSE": 0,
+    "LEFT_SHOULDER": 11, "RIGHT_SHOULDER": 12,
+    "LEFT_ELBOW": 13, "RIGHT_ELBOW": 14,
+    "LEFT_WRIST": 15, "RIGHT_WRIST": 16,
+    "LEFT_HIP": 23, "RIGHT_HIP": 24,
+    "LEFT_KNEE": 25, "RIGHT_KNEE": 26,
+    "LEFT_ANKLE": 27, "RIGHT_ANKLE": 28,
+}
+NUM_LANDMARKS = 33
+
+# generated files (form templates, detector model, ...) live outside the
+# source tree, in the user's cache
+CACHE_DIR = os.environ.get("ZENMOTION_CACHE",
+                           os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "zenmotion"))
+# data worth keeping (the workout log)
+DATA_DIR = os.environ.get("ZENMOTION_DATA",
+                          os.path.join(os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"), "zenmotion"))
+
+# top/bottom: stage names at full extension and at the bottom of the rep.
+# A rep counts when the angle drops below flex_below after being above
+# extend_above. Feedback fires above `high` or below `low`.
+EXERCISES = {
+    "squat": {
+        "joints": ("LEFT_HIP", "LEFT_KNEE", "LEFT_ANKLE"),
+        "top": "up", "bottom": "down", "extend_above": 160, "flex_below": 70,
+        "high": (170, "Stand straight"), "low": (50, "Go lower"),
+    },
+    "pushup": {
+        "joints": ("LEFT_SHOULDER", "LEFT_ELBOW", "LEFT_WRIST"),
+        "top": "up", "bottom": "down", "extend_above": 160, "flex_below": 90,
+        "high": (170, "Locking out too much"), "low": (80, "Too low"),
+    },
+    "curl": {
+        "joints": ("LEFT_SHOULDER", "LEFT_ELBOW", "LEFT_WRIST"),
+        "top": "down", "bottom": "up", "extend_above": 160, "flex_below": 50,
+        "high": (170, "Arm too straight"), "low": (40, "Curl complete"),
+    },
+}
+
+def calculate_angle(a, b, c):
+    a, b, c = np.array(a), np.array(b), np.array(c)
+    radians = np.arctan2(c[1]-b[1], c[0]-b[0]) - np.arctan2(a[1]-b[1], a[0]-b[0])
+    angle = np.abs(radians*180.0/np.pi)
+    return 360 - angle if angle > 180.0 else angle
+
+def landmarks_to_array(landmarks):
+    # (33, 4) float32 of x, y, z, visibility
+    return np.array([[l.x, l.y, l.z, l.visibility] for l in landmarks], dtype=np.float32)
+
+def joint_angle(lm, exercise):
+    a, b, c = (LANDMARKS[j] for j in EXERCISES[exercise]["joints"])
+    return float(calculate_angle(lm[a, :2], lm[b, :2], lm[c, :2]))
+
+def feedback_for(angle, exercise):
+    rules = EXERCISES[exercise]
+    if angle > rules["high"][0]:
+        return rules["high"][1]
+    if angle < rules["low"][0]:
+        return rules["low"][1]
+    return ""
+
+
+class Rep:
+    def __init__(self, exercise, index, started_at, ended_at, trajectory, feedback):
+        self.exercise = exercise
+        self.index = index
+        self.started_at = started_at
+        self.ended_at = ended_at
+        self.trajectory = np.asarray(trajectory, dtype=np.float32)
+        self.min_angle = float(self.trajectory.min())
+        self.max_angle = float(self.trajectory.max())
+        self.feedback = feedback  # distinct cues seen during the rep, in order
+
+    def as_dict(self):
+        return {"exercise": self.exercise, "index": self.index, "started_at": self.started_at,
+                "ended_at": self.ended_at, "min_angle": self.min_angle, "max_angle": self.max_angle,
+                "feedback": list(self.feedback)}
+
+
+class RepCounter:
+    # Same counting as the apps: the counter moves when the angle reaches the
+    # bottom. A Rep (the angle trajectory from leaving the top position back
+    # to it) is emitted when the athlete returns to the top.
+    def __init__(self, exercise="squat"):
+        self.reset(exercise)
+
+    def reset(self, exercise=None):
+        self.exercise = exercise or self.exercise
+        self.counter = 0
+        self.stage = None
+        self.feedback = ""
+        self.angle = None
+        self.transition = None  # "top" / "bottom" on the frame a stage change happens
+        self.last_rep = None    # the Rep completed on this frame, if any
+        self._trajectory, self._cues, self._started, self._counted = [], [], None, False
+
+    def update(self, angle, t=None):
+        rules = EXERCISES[self.exercise]
+        t = time.time() if t is None else t
+        self.angle, self.transition, self.last_rep = angle, None, None
+        self.feedback = feedback_for(angle, self.exercise)
+        if angle > rules["extend_above"]:
+            if self._counted:
+                self._trajectory.append(angle)
+                self.last_rep = Rep(self.exercise, self.counter, self._started, t, self._trajectory, self._cues)
+            if self.stage != rules["top"]:
+                self.transition = "top"
+            self.stage = rules["top"]
+            # the rep starts at the last frame spent at the top
+            self._trajectory, self._cues, self._started, self._counted = [angle], [], t, False
+        else:
+            self._trajectory.append(angle)
+        if angle < rules["flex_below"] and self.stage == rules["top"]:
+            self.stage = rules["bottom"]
+            self.counter += 1
+            self.transition = "bottom"
+            self._counted = True
+        if self.feedback and self.feedback not in self._cues and self._started is not None:
+            self._cues.append(self.feedback)
+        return self.feedback
@@ -0,0 +1,169 @@
+# zenmotion_detect.py
+# Auto-detects the exercise (squat / pushup / curl, or idle) from the pose
+# landmarks, so a wrong choice in the exercise picker cannot break counting.
+# Each frame adds four numbers to a ring buffer: knee, elbow and shoulder
+# angles and how upright the torso is. The window over the buffer gives a
+# small feature vector (means, ranges, mean speeds), and a nearest-centroid
+# model classifies it with diagonal scaling. The whole update is a few dozen
+# microseconds.
+#
+# The model is a small .npz (classes, centroids, scale) in
+# zenmotion_core.CACHE_DIR. A synthetic starter model is built on first use.
+#   python zenmotion_detect.py build --from sessions.npz
+# rebuilds it from recorded landmark sequences: one '<exercise>' object array
+# of (frames, 33, 4) arrays per exercise.
+import argparse
+import os
+import time
+
+import numpy as np
+
+import zenmotion_core
+
+WINDOW = 30          # frames of history per decision
+MIN_FRAMES = 8       # frames needed before the first decision
+HOLD = 8             # consecutive agreeing frames before switching exercise
+MIN_CONFIDENCE = 0.2
+IDLE = "idle"
+MODEL_PATH = os.environ.get("ZENMOTION_DETECT_MODEL", os.path.join(zenmotion_core.CACHE_DIR, "exercise_model.npz"))
+
+L = zenmotion_core.LANDMARKS
+_KNEE = [L["LEFT_HIP"], L["LEFT_KNEE"], L["LEFT_ANKLE"]]
+_ELBOW = [L["LEFT_SHOULDER"], L["LEFT_ELBOW"], L["LEFT_WRIST"]]
+_SHOULDER = [L["LEFT_HIP"], L["LEFT_SHOULDER"], L["LEFT_ELBOW"]]
+
+# ---------- features ----------
+def frame_angles(lm):
+    # (33, >=2) landmarks -> knee, elbow, shoulder angle (degrees), torso uprightness (0..1)
+    p = lm[:, :2]
+    a = p[[_KNEE[0], _ELBOW[0], _SHOULDER[0]]]
+    b = p[[_KNEE[1], _ELBOW[1], _SHOULDER[1]]]
+    c = p[[_KNEE[2], _ELBOW[2], _SHOULDER[2]]]
+    ang = np.abs(np.degrees(np.arctan2(c[:, 1] - b[:, 1], c[:, 0] - b[:, 0])
+                            - np.arctan2(a[:, 1] - b[:, 1], a[:, 0] - b[:, 0])))
+    ang = np.where(ang > 180, 360 - ang, ang)
+    torso = p[L["LEFT_SHOULDER"]] - p[L["LEFT_HIP"]]
+    upright = abs(torso[1]) / (np.hypot(torso[0], torso[1]) + 1e-6)
+    return np.array([ang[0], ang[1], ang[2], upright], dtype=np.float32)
+
+def window_features(angles):
+    # (n, 4) per-frame values -> feature vector
+    joints = angles[:, :3] / 180.0
+    speed = np.abs(np.diff(joints, axis=0)).mean(axis=0) if len(joints) > 1 else np.zeros(3)
+    return np.concatenate([joints.mean(axis=0), joints.max(axis=0) - joints.min(axis=0),
+                           speed * 10, angles[:, 3:].mean(axis=0)]).astype(np.float32)
+# ----------------------------
+
+# ---------- model ----------
+def fit(windows, labels, path=MODEL_PATH):
+    # windows: per-frame angle arrays (n, 4); labels: exercise names
+    X = np.stack([window_features(w) for w in windows])
+    labels = np.asarray(labels)
+    classes = sorted(set(labels))
+    centroids = np.stack([X[labels == c].mean(axis=0) for c in classes])
+    scale = X.std(axis=0) + 1e-3
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.savez(path, classes=np.array(classes), centroids=centroids, scale=scale)
+
+def synthetic_angles(kind, rng, n=WINDOW):
+    # per-frame angles of a stick figure doing `kind`, with random tempo and noise
+    period = rng.uniform(15, 60)
+    phase = rng.uniform(0, 2 * np.pi)
+    wave = (1 - np.cos(2 * np.pi * np.arange(n) / period + phase)) / 2   # 0 at the top, 1 at the bottom
+    knee = np.full(n, rng.uniform(165, 178))
+    elbow = np.full(n, rng.uniform(150, 178))
+    shoulder = np.full(n, rng.uniform(10, 40))
+    upright = np.full(n, rng.uniform(0.9, 1.0))
+    if kind == "squat":
+        knee = knee - wave * rng.uniform(90, 120)
+        shoulder = np.full(n, rng.uniform(20, 100))   # arms anywhere
+        upright = upright - wave * rng.uniform(0.05, 0.3)
+    elif kind == "pushup":
+        elbow = elbow - wave * rng.uniform(70, 100)
+        shoulder = rng.uniform(50, 90) - wave * rng.uniform(0, 30)
+        upright = np.full(n, rng.uniform(0.0, 0.35))
+    elif kind == "curl":
+        elbow = elbow - wave * rng.uniform(110, 140)
+    angles = np.stack([knee, elbow, shoulder, upright], axis=1)
+    angles[:, :3] += rng.normal(0, 2.0, (n, 3))
+    angles[:, 3] = np.clip(angles[:, 3] + rng.normal(0, 0.02, n), 0, 1)
+    return angles.astype(np.float32)
+
+def build_synthetic(path=MODEL_PATH, per_class=300, seed=0):
+    rng = np.random.default_rng(seed)
+    kinds = ("squat", "pushup", "curl", IDLE)
+    labels = [k for k in kinds for _ in range(per_class)]
+    windows = [synthetic_angles(k, rng, int(rng.integers(MIN_FRAMES, WINDOW + 1))) for k in labels]
+    fit(windows, labels, path)
+# ----------------------------
+
+
+class ExerciseDetector:
+    def __init__(self, path=MODEL_PATH, window=WINDOW, hold=HOLD):
+        if not os.path.exists(path):
+            build_synthetic(path)
+        model = np.load(path)
+        self.classes = [str(c) for c in model["classes"]]
+        self.centroids = model["centroids"] / model["scale"]
+        self.scale = model["scale"]
+        self.window = window
+        self.hold = hold
+        self.reset()
+
+    def reset(self):
+        self.buffer = np.zeros((self.window, 4), dtype=np.float32)
+        self.filled = 0
+        self.exercise = None     # the decided exercise
+        self.prediction = None   # this frame's best guess
+        self.confidence = 0.0
+        self._candidate, self._streak = None, 0
+        self.last_ms = 0.0
+
+    def predict(self, angles):
+        d = (((window_features(angles) / self.scale) - self.centroids) ** 2).sum(axis=1)
+        best, second = np.argsort(d)[:2]
+        return self.classes[best], float(1 - np.sqrt(d[best] / (d[second] + 1e-9)))
+
+    def update(self, lm):
+        # add one frame of landmarks; returns the decided exercise (None until sure)
+        t0 = time.perf_counter()
+        self.buffer[self.filled % self.window] = frame_angles(lm)
+        self.filled += 1
+        if self.filled >= MIN_FRAMES:
+            n = min(self.filled, self.window)
+            # oldest-first order only matters for the speed feature
+            angles = np.roll(self.buffer, -(self.filled % self.window), axis=0)[-n:] if self.filled > self.window \
+                else self.buffer[:n]
+            self.prediction, self.confidence = self.predict(angles)
+            if self.prediction == self._candidate and self.confidence >= MIN_CONFIDENCE:
+                self._streak += 1
+            else:
+                self._candidate, self._streak = self.prediction, int(self.confidence >= MIN_CONFIDENCE)
+            if self._streak >= self.hold and self._candidate != IDLE:
+                self.exercise = self._candidate
+        self.last_ms = (time.perf_counter() - t0) * 1000
+        return self.exercise
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="(re)build the detector model")
+    b.add_argument("--from", dest="source", help=".npz with one '<exercise>' object array of (frames, 33, 4) sequences")
+    b.add_argument("--out", default=MODEL_PATH)
+    args = ap.parse_args()
+    if args.source:
+        data = np.load(args.source, allow_pickle=True)
+        windows, labels = [], []
+        for label in data.files:
+            for seq in data[label]:
+                angles = np.stack([frame_angles(f) for f in seq])
+                for start in range(0, max(1, len(angles) - WINDOW + 1), WINDOW // 2):
+                    windows.append(angles[start:start + WINDOW])
+                    labels.append(label)
+        fit(windows, labels, args.out)
+    else:
+        build_synthetic(args.out)
+    print(f"model written to {args.out}")
+
+if __name__ == "__main__":
+    main()
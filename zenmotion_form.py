@@ -0,0 +1,188 @@
+# zenmotion_form.py
+# Form scoring: each completed rep's angle trajectory is compared with a
+# library of reference reps by dynamic time warping (DTW). LB_Keogh lower
+# bounds, computed for all templates at once, decide which templates need a
+# full DTW. Those are scored in vectorized chunks until no remaining bound
+# can beat the k-th best distance.
+#
+# One library per exercise in LIBRARY_DIR (under zenmotion_core.CACHE_DIR):
+#   <exercise>.npy   float32 (3, N, FORM_LENGTH): series, upper and lower envelope
+#   <exercise>.json  {"labels": [...], "length": ..., "band": ...}
+# They are memory-mapped at startup. A synthetic starter library is built on
+# first use; `python zenmotion_form.py build --from reps.npz` replaces it with
+# recorded reference reps.
+import argparse
+import json
+import os
+
+import numpy as np
+
+import zenmotion_core
+
+FORM_LENGTH = 64        # every trajectory is resampled to this many points
+FORM_BAND = 6           # Sakoe-Chiba band, in resampled points
+FORM_K = 5              # neighbours voting on the label
+DTW_CHUNK = 32          # templates per vectorized DTW pass
+MAX_RMS = 25.0          # degrees; a rep further than this from every template is not labelled
+LIBRARY_DIR = os.environ.get("ZENMOTION_FORM_DIR", os.path.join(zenmotion_core.CACHE_DIR, "form_templates"))
+
+MESSAGES = {
+    "good": "Good rep",
+    "dropped": "Control the way down",
+    "bounced": "Don't bounce at the bottom",
+    "stalled": "Keep a steady tempo",
+}
+
+# ---------- distances ----------
+def resample(trajectory, n=FORM_LENGTH):
+    trajectory = np.asarray(trajectory, dtype=np.float32)
+    return np.interp(np.linspace(0, 1, n), np.linspace(0, 1, len(trajectory)), trajectory).astype(np.float32)
+
+def envelope(series, band=FORM_BAND):
+    # running max / min over +-band points, for each row of (N, L)
+    padded = np.pad(series, ((0, 0), (band, band)), mode="edge")
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * band + 1, axis=1)
+    return windows.max(axis=2), windows.min(axis=2)
+
+def lb_keogh(q, upper, lower):
+    # (L,) against (N, L) envelopes -> (N,) lower bounds on the squared DTW distance
+    above = np.maximum(q - upper, 0)
+    below = np.maximum(lower - q, 0)
+    return (above * above + below * below).sum(axis=1)
+
+def dtw_many(q, series, band=FORM_BAND):
+    # banded DTW (squared error) of one query against (K, L) templates at once
+    k, n = series.shape
+    prev = np.full((k, n + 1), np.inf, dtype=np.float32)
+    prev[:, 0] = 0
+    for i in range(1, n + 1):
+        cur = np.full((k, n + 1), np.inf, dtype=np.float32)
+        lo, hi = max(1, i - band), min(n, i + band)
+        cost = (series[:, lo - 1:hi] - q[i - 1]) ** 2
+        diag_up = np.minimum(prev[:, lo - 1:hi], prev[:, lo:hi + 1])
+        for j in range(lo, hi + 1):
+            cur[:, j] = cost[:, j - lo] + np.minimum(diag_up[:, j - lo], cur[:, j - 1])
+        prev = cur
+    return prev[:, n]
+# ----------------------------
+
+# ---------- library ----------
+def save_library(exercise, trajectories, labels, directory=LIBRARY_DIR):
+    series = np.stack([resample(t) for t in trajectories])
+    upper, lower = envelope(series)
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, f"{exercise}.npy"), np.stack([series, upper, lower]).astype(np.float32))
+    with open(os.path.join(directory, f"{exercise}.json"), "w") as f:
+        json.dump({"exercise": exercise, "labels": list(labels), "length": FORM_LENGTH, "band": FORM_BAND}, f)
+
+def synthetic_rep(exercise, kind, rng):
+    # angle trajectory from the top of the rep, through the bottom, back to the top
+    rules = zenmotion_core.EXERCISES[exercise]
+    top = rng.uniform(rules["extend_above"] + 2, 178)
+    bottom = rng.uniform(rules["flex_below"] - 25, rules["flex_below"] - 3)
+    mid = (top + bottom) / 2
+    if kind == "good":
+        d, h = rng.uniform(0.42, 0.55), rng.uniform(0.05, 0.12)
+        keys = [(0, top), (d, bottom), (d + h, bottom), (1, top)]
+    elif kind == "dropped":
+        d, h = rng.uniform(0.12, 0.22), rng.uniform(0.0, 0.05)
+        keys = [(0, top), (d, bottom), (d + h, bottom), (1, top)]
+    elif kind == "bounced":
+        d, b = rng.uniform(0.35, 0.5), rng.uniform(15, 25)
+        keys = [(0, top), (d, bottom), (d + 0.06, bottom + b), (d + 0.12, bottom + 3), (1, top)]
+    else:  # stalled on the way up
+        d, s = rng.uniform(0.3, 0.4), rng.uniform(0.15, 0.25)
+        a = d + rng.uniform(0.1, 0.15)
+        keys = [(0, top), (d, bottom), (a, mid), (a + s, mid + 3), (1, top)]
+    n = int(rng.integers(30, 90))
+    t, angle = zip(*keys)
+    curve = np.interp(np.linspace(0, 1, n), t, angle)
+    curve = np.convolve(np.pad(curve, 2, mode="edge"), np.ones(5) / 5, mode="valid")
+    return np.clip(curve + rng.normal(0, 1.5, n), 0, 180)
+
+def build_synthetic(exercise, per_kind=60, directory=LIBRARY_DIR, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = [k for k in MESSAGES for _ in range(per_kind)]
+    save_library(exercise, [synthetic_rep(exercise, k, rng) for k in labels], labels, directory)
+
+
+class Library:
+    def __init__(self, exercise, directory=LIBRARY_DIR):
+        path = os.path.join(directory, f"{exercise}.npy")
+        if not os.path.exists(path):
+            build_synthetic(exercise, directory=directory)
+        data = np.load(path, mmap_mode="r")
+        self.series, self.upper, self.lower = data[0], data[1], data[2]
+        with open(os.path.join(directory, f"{exercise}.json")) as f:
+            meta = json.load(f)
+        self.labels = np.array(meta["labels"])
+        self.band = meta.get("band", FORM_BAND)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def nearest(self, q, k=FORM_K):
+        # k nearest templates by DTW -> (indices, distances, DTWs computed)
+        lb = lb_keogh(q, self.upper, self.lower)
+        order = np.argsort(lb)
+        best_i, best_d = np.empty(0, dtype=int), np.empty(0, dtype=np.float32)
+        computed = 0
+        for start in range(0, len(order), DTW_CHUNK):
+            idx = order[start:start + DTW_CHUNK]
+            if len(best_d) >= k:
+                idx = idx[lb[idx] < best_d[k - 1]]
+                if not len(idx):
+                    break  # bounds only grow from here
+            d = dtw_many(q, np.asarray(self.series[idx]), self.band)
+            computed += len(idx)
+            best_i, best_d = np.concatenate([best_i, idx]), np.concatenate([best_d, d])
+            keep = np.argsort(best_d)[:k]
+            best_i, best_d = best_i[keep], best_d[keep]
+        return best_i, best_d, computed
+# ----------------------------
+
+class FormScorer:
+    def __init__(self, directory=LIBRARY_DIR, exercises=None):
+        self.libraries = {e: Library(e, directory) for e in (exercises or zenmotion_core.EXERCISES)}
+
+    def score(self, rep, k=FORM_K):
+        # rep: zenmotion_core.Rep -> {"score", "label", "message", "rms", ...}
+        lib = self.libraries.get(rep.exercise)
+        if lib is None or len(rep.trajectory) < 4:
+            return None
+        q = resample(rep.trajectory)
+        idx, dist, computed = lib.nearest(q, k)
+        rms = np.sqrt(dist / FORM_LENGTH)  # degrees per point
+        weights = 1.0 / (rms + 1.0)
+        labels = lib.labels[idx]
+        votes = {}
+        for label, w in zip(labels, weights):
+            votes[label] = votes.get(label, 0.0) + w
+        label = str(max(votes, key=votes.get))
+        if rms[0] > MAX_RMS:
+            label = "unknown"
+        return {"score": int(round(100 * votes.get("good", 0.0) / sum(votes.values()))),
+                "label": label, "message": MESSAGES.get(label, ""), "rms": round(float(rms[0]), 1),
+                "templates": len(lib), "dtw_computed": computed}
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="(re)build the template libraries")
+    b.add_argument("--from", dest="source",
+                   help=".npz with per exercise '<exercise>' (object array of trajectories) and '<exercise>_labels'")
+    b.add_argument("--per-kind", type=int, default=60, help="synthetic templates per label")
+    b.add_argument("--dir", default=LIBRARY_DIR)
+    args = ap.parse_args()
+    for exercise in zenmotion_core.EXERCISES:
+        if args.source:
+            data = np.load(args.source, allow_pickle=True)
+            if exercise not in data:
+                continue
+            save_library(exercise, list(data[exercise]), list(data[f"{exercise}_labels"]), args.dir)
+        else:
+            build_synthetic(exercise, args.per_kind, args.dir)
+        print(f"{exercise}: {len(Library(exercise, args.dir))} templates in {args.dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# zenmotion_loadgen.py
+# Replays a local video against zenmotion_service.py from N concurrent
+# WebSocket clients and reports round-trip latency and throughput.
+#
+#   python zenmotion_service.py --workers 4 &
+#   python zenmotion_loadgen.py --video squats.mp4 --clients 8 --fps 15 --seconds 30
+#   python zenmotion_loadgen.py --synthetic --clients 4      # no video at hand
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+import cv2
+import numpy as np
+
+def load_frames(path, max_frames=300, width=640, quality=80):
+    # decode and JPEG-encode once, up front, so the generator measures the service
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        h, w = frame.shape[:2]
+        if w != width:
+            frame = cv2.resize(frame, (width, int(h * width / w)))
+        frames.append(cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    cap.release()
+    if not frames:
+        raise SystemExit(f"could not read any frames from {path}")
+    return frames
+
+def synthetic_frames(n=30, size=(480, 640)):
+    rng = np.random.default_rng(0)
+    return [cv2.imencode(".jpg", rng.integers(0, 255, size + (3,), dtype=np.uint8))[1].tobytes()
+            for _ in range(n)]
+
+async def run_client(session, url, n, frames, exercise, fps, deadline, results):
+    interval = 1.0 / fps if fps else 0
+    async with session.ws_connect(f"{url}/ws?client=loadgen-{n}&exercise={exercise}", max_msg_size=0) as ws:
+        i = n * 7  # clients start at different points in the clip
+        next_send = time.perf_counter()
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            await ws.send_bytes(frames[i % len(frames)])
+            reply = await ws.receive_json()
+            rtt = (time.perf_counter() - t0) * 1000
+            if reply.get("dropped"):
+                results["dropped"] += 1
+            elif reply.get("error"):
+                results["errors"] += 1
+            else:
+                results["rtt_ms"].append(rtt)
+                results["reps"][n] = reply.get("counter", 0)
+                results["poses"] += reply.get("landmarks") is not None
+            i += 1
+            if interval:
+                next_send += interval
+                await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+async def run(args, frames):
+    results = {"rtt_ms": [], "dropped": 0, "errors": 0, "poses": 0, "reps": {}}
+    async with aiohttp.ClientSession() as session:
+        t0 = time.perf_counter()
+        deadline = t0 + args.seconds
+        await asyncio.gather(*(run_client(session, args.url, n, frames, args.exercise, args.fps, deadline, results)
+                               for n in range(args.clients)))
+        elapsed = time.perf_counter() - t0
+        async with session.get(f"{args.url}/stats") as resp:
+            server = await resp.json()
+    rtt = np.array(results["rtt_ms"]) if results["rtt_ms"] else np.zeros(1)
+    return {
+        "clients": args.clients, "target_fps_per_client": args.fps, "seconds": round(elapsed, 1),
+        "frames": len(results["rtt_ms"]), "throughput_fps": round(len(results["rtt_ms"]) / elapsed, 1),
+        "dropped": results["dropped"], "errors": results["errors"], "frames_with_pose": results["poses"],
+        "rtt_ms": {k: round(float(np.percentile(rtt, q)), 2) for k, q in (("p50", 50), ("p95", 95), ("p99", 99))},
+        "reps_per_client": results["reps"], "server": server,
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--video", help="local video file to replay")
+    src.add_argument("--synthetic", action="store_true", help="random frames (no pose found; tests plumbing)")
+    ap.add_argument("--url", default="http://127.0.0.1:8765")
+    ap.add_argument("--clients", type=int, default=4)
+    ap.add_argument("--fps", type=float, default=15, help="per client; 0 = as fast as replies come back")
+    ap.add_argument("--seconds", type=float, default=20)
+    ap.add_argument("--exercise", default="squat")
+    ap.add_argument("--out", help="also write the JSON report here")
+    args = ap.parse_args()
+    frames = load_frames(args.video) if args.video else synthetic_frames()
+    report = asyncio.run(run(args, frames))
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# zenmotion_log.py
+# Persistent workout log: one row per completed rep in a local SQLite file,
+# DATA_DIR/workouts.db unless ZENMOTION_LOG_DB says otherwise.
+#
+# WorkoutLog.log(rep) only puts the rep on a queue, so it costs the frame
+# loop microseconds. A writer thread group-commits: it takes what has queued
+# up, waiting at most FLUSH_SECONDS after the first rep or until BATCH reps,
+# and writes it in one transaction. The same transaction adds the batch to
+# weekly_summary (one row per user, ISO week and exercise), so weekly
+# summaries are read without touching the reps table. History reads go
+# through the (user, ended_at) and (user, exercise, ended_at) indexes and
+# page by ended_at, so they stay fast with millions of reps.
+#
+#   python zenmotion_log.py history --user anna
+#   python zenmotion_log.py weekly --user anna
+#   python zenmotion_log.py bench --reps 1000000      # fill a scratch log and time the reads
+import argparse
+import collections
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import zenmotion_core
+
+LOG_PATH = os.environ.get("ZENMOTION_LOG_DB", os.path.join(zenmotion_core.DATA_DIR, "workouts.db"))
+BATCH = 500           # reps per transaction at most
+FLUSH_SECONDS = 1.0   # longest a logged rep waits for its commit
+MAX_QUEUE = 10000     # reps waiting before log() starts dropping them
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reps (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    exercise TEXT NOT NULL,
+    started_at REAL,
+    ended_at REAL NOT NULL,   -- unix time
+    min_angle REAL,
+    max_angle REAL,
+    feedback TEXT,            -- cues seen during the rep, '; '-separated
+    form_score INTEGER,
+    form_label TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_reps_user_time ON reps (user, ended_at);
+CREATE INDEX IF NOT EXISTS ix_reps_user_exercise_time ON reps (user, exercise, ended_at);
+CREATE TABLE IF NOT EXISTS weekly_summary (
+    user TEXT NOT NULL,
+    week TEXT NOT NULL,       -- ISO week, e.g. 2026-W42
+    exercise TEXT NOT NULL,
+    reps INTEGER NOT NULL,
+    seconds REAL NOT NULL,    -- time spent in reps
+    form_total INTEGER NOT NULL,
+    form_reps INTEGER NOT NULL,
+    best_depth REAL,          -- smallest angle reached
+    first_at REAL,
+    last_at REAL,
+    PRIMARY KEY (user, week, exercise)
+) WITHOUT ROWID;
+"""
+
+def connect(path=LOG_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    # WAL: readers never wait for the writer thread, and commits are cheap
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def iso_week(t):
+    return time.strftime("%G-W%V", time.localtime(t))
+
+def rep_row(user, rep):
+    # rep: zenmotion_core.Rep.as_dict(), optionally with "form" (zenmotion_form score)
+    form = rep.get("form") or {}
+    feedback = rep.get("feedback") or []
+    return (user, rep["exercise"], rep.get("started_at"), rep["ended_at"], rep.get("min_angle"),
+            rep.get("max_angle"), "; ".join(feedback) if isinstance(feedback, list) else feedback,
+            form.get("score"), form.get("label"))
+
+def write_batch(conn, rows):
+    # rows from rep_row(); reps and their weekly totals in one transaction
+    weekly = {}
+    for user, exercise, started, ended, low, _, _, score, _ in rows:
+        key = (user, iso_week(ended), exercise)
+        w = weekly.setdefault(key, [0, 0.0, 0, 0, None, ended, ended])
+        w[0] += 1
+        w[1] += (ended - started) if started is not None else 0.0
+        if score is not None:
+            w[2] += score
+            w[3] += 1
+        if low is not None:
+            w[4] = low if w[4] is None else min(w[4], low)
+        w[5], w[6] = min(w[5], ended), max(w[6], ended)
+    with conn:
+        conn.executemany("INSERT INTO reps (user, exercise, started_at, ended_at, min_angle, max_angle, feedback, "
+                         "form_score, form_label) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("""
+            INSERT INTO weekly_summary (user, week, exercise, reps, seconds, form_total, form_reps, best_depth,
+                                        first_at, last_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user, week, exercise) DO UPDATE SET
+                reps = reps + excluded.reps,
+                seconds = seconds + excluded.seconds,
+                form_total = form_total + excluded.form_total,
+                form_reps = form_reps + excluded.form_reps,
+                best_depth = MIN(COALESCE(best_depth, excluded.best_depth), COALESCE(excluded.best_depth, best_depth)),
+                first_at = MIN(first_at, excluded.first_at),
+                last_at = MAX(last_at, excluded.last_at)""",
+                         [key + tuple(w) for key, w in weekly.items()])
+
+
+class WorkoutLog:
+    def __init__(self, path=LOG_PATH, batch=BATCH, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.batch = batch
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue(MAX_QUEUE)
+        self.logged = 0
+        self.dropped = 0
+        self.written = 0
+        self.commits = 0
+        self.error = None
+        connect(path).close()  # schema errors surface here, not in the thread
+        self.thread = threading.Thread(target=self._run, name="workout-log", daemon=True)
+        self.thread.start()
+
+    # ---------- writing ----------
+    def log(self, rep, user="default"):
+        # rep: Rep.as_dict() (+ "form"); never blocks the caller
+        try:
+            self.queue.put_nowait(rep_row(user, rep))
+            self.logged += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        try:
+            self._write_loop()
+        except Exception as e:
+            # the thread is gone; flush() stops waiting for it
+            self.error = f"writer stopped: {type(e).__name__}: {e}"
+
+    def _write_loop(self):
+        conn = connect(self.path)
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            rows, deadline = [item], time.monotonic() + self.flush_seconds
+            while len(rows) < self.batch:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.task_done()
+                    stop = True
+                    break
+                rows.append(item)
+            try:
+                write_batch(conn, rows)
+                self.written += len(rows)
+                self.commits += 1
+            except Exception as e:
+                # keep the thread alive; the next batch may succeed (disk full, locked, a bad rep)
+                self.error = f"{type(e).__name__}: {e}"
+                self.dropped += len(rows)
+            for _ in rows:
+                self.queue.task_done()
+        conn.close()
+
+    def flush(self, timeout=None):
+        # waits until every rep logged so far is committed; False on timeout
+        # or when the writer thread has died (stats()["error"] says why)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if not self.thread.is_alive():
+                return False
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def stats(self):
+        return {"logged": self.logged, "written": self.written, "commits": self.commits,
+                "dropped": self.dropped, "queued": self.queue.qsize(), "error": self.error}
+    # ----------------------------
+
+    # ---------- reading ----------
+    def history(self, user, exercise=None, since=None, before=None, limit=100):
+        # newest first; pass the last row's ended_at as `before` for the next page
+        q = "SELECT exercise, started_at, ended_at, min_angle, max_angle, feedback, form_score, form_label " \
+            "FROM reps WHERE user = ?"
+        args = [user]
+        if exercise:
+            q += " AND exercise = ?"
+            args.append(exercise)
+        if since is not None:
+            q += " AND ended_at >= ?"
+            args.append(since)
+        if before is not None:
+            q += " AND ended_at < ?"
+            args.append(before)
+        q += " ORDER BY ended_at DESC LIMIT ?"
+        args.append(limit)
+        with connect(self.path) as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(r) for r in conn.execute(q, args)]
+
+    def weekly(self, user, weeks=8):
+        # the last `weeks` ISO weeks with any reps, per exercise
+        with connect(self.path) as conn:
+            conn.row_factory = sqlite3.Row
+            recent = [r[0] for r in conn.execute(
+                "SELECT DISTINCT week FROM weekly_summary WHERE user = ? ORDER BY week DESC LIMIT ?", (user, weeks))]
+            if not recent:
+                return []
+            rows = conn.execute(
+                f"SELECT * FROM weekly_summary WHERE user = ? AND week IN ({','.join('?' * len(recent))}) "
+                "ORDER BY week DESC, exercise", [user] + recent).fetchall()
+        out = []
+        for r in rows:
+            r = dict(r)
+            r["avg_form"] = round(r.pop("form_total") / r["form_reps"], 1) if r["form_reps"] else None
+            out.append(r)
+        return out
+    # ----------------------------
+
+def bench(path, n, users=50):
+    # synthetic reps over a year, then the read paths the apps use
+    if os.path.exists(path):
+        os.remove(path)
+    log = WorkoutLog(path)
+    rng = np.random.default_rng(0)
+    exercises = list(zenmotion_core.EXERCISES)
+    end = time.time()
+    t0 = time.perf_counter()
+    times = np.sort(rng.uniform(end - 365 * 86400, end, n))
+    lat = []
+    for i, t in enumerate(times):
+        rep = {"exercise": exercises[i % 3], "started_at": float(t) - 2.0, "ended_at": float(t),
+               "min_angle": float(rng.uniform(40, 90)), "max_angle": float(rng.uniform(160, 178)),
+               "feedback": [], "form": {"score": int(rng.integers(40, 101)), "label": "good"}}
+        s = time.perf_counter()
+        while not log.log(rep, f"user{i % users}"):
+            time.sleep(0.001)  # the bench wants every rep; the apps drop instead
+        lat.append(time.perf_counter() - s)
+    log.flush()
+    stats = log.stats()
+    print(f"logged {n} reps in {time.perf_counter() - t0:.1f} s, {stats['commits']} commits, "
+          f"queue full {stats['dropped']} times (retried), log() p99 {np.percentile(lat, 99) * 1e6:.0f} us")
+    for name, fn in [("history (newest 100)", lambda: log.history("user7")),
+                     ("history, one exercise", lambda: log.history("user7", "curl")),
+                     ("history, next page", lambda: log.history("user7", before=end - 30 * 86400)),
+                     ("weekly summary", lambda: log.weekly("user7"))]:
+        s = time.perf_counter()
+        rows = fn()
+        print(f"{name}: {len(rows)} rows in {(time.perf_counter() - s) * 1000:.1f} ms")
+    log.close()
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("history", "weekly"):
+        p = sub.add_parser(name)
+        p.add_argument("--user", default="default")
+        p.add_argument("--db", default=LOG_PATH)
+    sub.choices["history"].add_argument("--exercise")
+    sub.choices["history"].add_argument("--limit", type=int, default=20)
+    b = sub.add_parser("bench")
+    b.add_argument("--reps", type=int, default=1000000)
+    b.add_argument("--db", default=os.path.join(zenmotion_core.CACHE_DIR, "workouts_bench.db"))
+    args = ap.parse_args()
+    if args.cmd == "bench":
+        bench(args.db, args.reps)
+        return
+    log = WorkoutLog(args.db)
+    if args.cmd == "history":
+        for r in log.history(args.user, args.exercise, limit=args.limit):
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(r["ended_at"]))
+            print(f"{when}  {r['exercise']:<7} depth {r['min_angle']:.0f}  form {r['form_score']}  {r['feedback'] or ''}")
+    else:
+        for r in log.weekly(args.user):
+            print(f"{r['week']}  {r['exercise']:<7} {r['reps']:>5} reps  {r['seconds'] / 60:.0f} min  "
+                  f"avg form {r['avg_form']}  best depth {r['best_depth']}")
+    log.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+# zenmotion_multi.py
+# Multi-person mode for group classes.
+#   python zenmotion_multi.py --source 0 --exercise squat --workers 3
+#   python zenmotion_multi.py --source class.mp4 --exercise auto
+#
+# Every DETECT_EVERY frames a person detector finds people (OpenCV's bundled
+# HOG detector by default; any callable returning boxes can be passed in).
+# An IoU tracker, with a centroid fallback, keeps identities across frames.
+# Between detections each track's box follows its own pose landmarks. Each
+# frame, every tracked person's crop goes to a pose worker, all crops in one
+# batch per worker, and a person keeps the same worker so its MediaPipe
+# tracking state stays valid. Rep state (zenmotion_core.RepCounter) is kept
+# per tracked person, so the cost grows with people in view, not with frames.
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import zenmotion_core
+
+DETECT_EVERY = 5      # frames between detector passes
+DETECT_SCALE = 0.5    # detector runs on a downscaled frame
+MAX_PEOPLE = 8
+IOU_MATCH = 0.3
+MAX_MISSES = 15       # frames a track survives without a detection or a pose
+CROP_PAD = 0.15       # crop margin, as a fraction of the box size
+MIN_VISIBILITY = 0.5
+
+# ---------- detection ----------
+_hog = None
+
+def detect_people(frame, scale=DETECT_SCALE):
+    # HOG person detector -> [(x1, y1, x2, y2, score)] in full-frame pixels
+    import cv2
+    global _hog
+    if _hog is None:
+        _hog = cv2.HOGDescriptor()
+        _hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+    small = cv2.resize(frame, None, fx=scale, fy=scale)
+    rects, weights = _hog.detectMultiScale(small, winStride=(8, 8), padding=(8, 8), scale=1.05)
+    if len(rects) == 0:
+        return []
+    rects, weights = [list(map(int, r)) for r in rects], [float(w) for w in np.ravel(weights)]
+    keep = cv2.dnn.NMSBoxes(rects, weights, 0.3, 0.4)
+    return [((x / scale), (y / scale), (x + w) / scale, (y + h) / scale, weights[i])
+            for i, (x, y, w, h) in ((i, rects[i]) for i in np.ravel(keep))]
+
+def iou(a, b):
+    # (N, 4) x (M, 4) boxes -> (N, M)
+    a, b = np.asarray(a, float).reshape(-1, 4), np.asarray(b, float).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+# ----------------------------
+
+# ---------- tracking ----------
+class Track:
+    def __init__(self, track_id, box, exercise):
+        self.id = track_id
+        self.box = np.asarray(box[:4], float)
+        self.auto = exercise == "auto"
+        self.reps = zenmotion_core.RepCounter("squat" if self.auto else exercise)
+        self.detector = None
+        if self.auto:
+            import zenmotion_detect
+            self.detector = zenmotion_detect.ExerciseDetector()
+        self.misses = 0
+        self.landmarks = None   # (33, 4), full-frame normalized coordinates
+        self.feedback = ""
+
+    @property
+    def exercise(self):
+        return self.reps.exercise if not self.auto or self.detector.exercise else None
+
+    def update_pose(self, lm, frame_shape):
+        h, w = frame_shape[:2]
+        self.landmarks = lm
+        if lm is None:
+            self.misses += 1
+            return
+        self.misses = 0
+        seen = lm[lm[:, 3] >= MIN_VISIBILITY]
+        if len(seen) >= 4:
+            # the box follows the body between detector passes
+            x1, y1 = seen[:, 0].min() * w, seen[:, 1].min() * h
+            x2, y2 = seen[:, 0].max() * w, seen[:, 1].max() * h
+            self.box = np.array([x1, y1, x2, y2])
+        if self.auto:
+            detected = self.detector.update(lm)
+            if detected is None:
+                return
+            if detected != self.reps.exercise:
+                self.reps.reset(detected)
+        self.feedback = self.reps.update(zenmotion_core.joint_angle(lm, self.reps.exercise))
+
+
+class Tracker:
+    def __init__(self, exercise="squat", max_people=MAX_PEOPLE):
+        self.exercise = exercise
+        self.max_people = max_people
+        self.tracks = OrderedDict()
+        self.next_id = 1
+
+    def update(self, boxes):
+        # match detections to tracks; returns ids of tracks that were dropped
+        boxes = [np.asarray(b[:4], float) for b in boxes]
+        ids = list(self.tracks)
+        unmatched = set(range(len(boxes)))
+        if ids and boxes:
+            overlap = iou([self.tracks[i].box for i in ids], boxes)
+            pairs = sorted(((overlap[r, c], r, c) for r in range(len(ids)) for c in range(len(boxes))), reverse=True)
+            used_t = set()
+            for score, r, c in pairs:
+                if r in used_t or c not in unmatched:
+                    continue
+                t = self.tracks[ids[r]]
+                if score < IOU_MATCH:
+                    # centroid fallback for fast movers
+                    tc, bc = (t.box[:2] + t.box[2:]) / 2, (boxes[c][:2] + boxes[c][2:]) / 2
+                    if np.hypot(*(tc - bc)) > 0.5 * np.hypot(*(t.box[2:] - t.box[:2])):
+                        continue
+                t.box, t.misses = boxes[c], 0
+                used_t.add(r)
+                unmatched.discard(c)
+        for c in sorted(unmatched, key=lambda c: -(boxes[c][2] - boxes[c][0]) * (boxes[c][3] - boxes[c][1])):
+            if len(self.tracks) >= self.max_people:
+                break
+            self.tracks[self.next_id] = Track(self.next_id, boxes[c], self.exercise)
+            self.next_id += 1
+        return self.prune()
+
+    def prune(self):
+        gone = [i for i, t in self.tracks.items() if t.misses > MAX_MISSES]
+        for i in gone:
+            del self.tracks[i]
+        return gone
+# ----------------------------
+
+# ---------- pose workers ----------
+_poses = OrderedDict()
+_pose_args = {}
+
+def _init_worker(model_complexity, min_detection_confidence, min_tracking_confidence):
+    _pose_args.update(model_complexity=model_complexity,
+                      min_detection_confidence=min_detection_confidence,
+                      min_tracking_confidence=min_tracking_confidence)
+
+def _pose_crops(batch):
+    # [(track id, RGB crop or None to forget the track)] -> [landmarks in crop coordinates or None]
+    import mediapipe as mp
+    out = []
+    for track_id, crop in batch:
+        if crop is None:
+            pose = _poses.pop(track_id, None)
+            if pose is not None:
+                pose.close()
+            out.append(None)
+            continue
+        pose = _poses.get(track_id)
+        if pose is None:
+            pose = _poses[track_id] = mp.solutions.pose.Pose(**_pose_args)
+        results = pose.process(crop)
+        out.append(zenmotion_core.landmarks_to_array(results.pose_landmarks.landmark)
+                   if results.pose_landmarks else None)
+    return out
+
+
+class PosePool:
+    # workers=0 runs pose in this process (no pickling, one core)
+    def __init__(self, workers=None, model_complexity=1, min_detection_confidence=0.5, min_tracking_confidence=0.5):
+        args = (model_complexity, min_detection_confidence, min_tracking_confidence)
+        workers = max(1, (os.cpu_count() or 2) - 1) if workers is None else workers
+        if workers:
+            # spawn: forking a process that already runs MediaPipe / camera threads can deadlock
+            ctx = multiprocessing.get_context("spawn")
+            self.executors = [concurrent.futures.ProcessPoolExecutor(1, mp_context=ctx, initializer=_init_worker,
+                                                                     initargs=args)
+                              for _ in range(workers)]
+        else:
+            _init_worker(*args)
+            self.executors = []
+        self.assigned = {}   # track id -> worker
+        self.pending_forget = []
+
+    def forget(self, track_id):
+        if track_id in self.assigned:
+            self.pending_forget.append(track_id)
+
+    def run(self, crops):
+        # crops: {track id: RGB crop} -> {track id: landmarks (33, 4) in crop coordinates or None}
+        batches = {}
+        for track_id in self.pending_forget:
+            batches.setdefault(self.assigned.pop(track_id), []).append((track_id, None))
+        self.pending_forget = []
+        for track_id, crop in crops.items():
+            w = self.assigned.get(track_id)
+            if w is None:
+                load = [0] * max(1, len(self.executors))
+                for a in self.assigned.values():
+                    load[a] += 1
+                w = self.assigned[track_id] = int(np.argmin(load))
+            batches.setdefault(w, []).append((track_id, crop))
+        if not self.executors:
+            results = {w: _pose_crops(b) for w, b in batches.items()}
+        else:
+            futures = {w: self.executors[w].submit(_pose_crops, b) for w, b in batches.items()}
+            results = {w: f.result() for w, f in futures.items()}
+        out = {}
+        for w, batch in batches.items():
+            for (track_id, crop), lm in zip(batch, results[w]):
+                if crop is not None:
+                    out[track_id] = lm
+        return out
+
+    def close(self):
+        for ex in self.executors:
+            ex.shutdown(cancel_futures=True)
+# ----------------------------
+
+class MultiPersonCounter:
+    def __init__(self, exercise="squat", workers=None, detector=detect_people, detect_every=DETECT_EVERY,
+                 max_people=MAX_PEOPLE, **pose_args):
+        self.tracker = Tracker(exercise, max_people)
+        self.pool = PosePool(workers, **pose_args)
+        self.detector = detector
+        self.detect_every = detect_every
+        self.frame_no = 0
+        self.timings = {"detect_ms": 0.0, "pose_ms": 0.0}
+
+    def process(self, frame):
+        # frame: BGR uint8 -> list of Track
+        import cv2
+        h, w = frame.shape[:2]
+        if self.frame_no % self.detect_every == 0 or not self.tracker.tracks:
+            t0 = time.perf_counter()
+            for track_id in self.tracker.update(self.detector(frame)):
+                self.pool.forget(track_id)
+            self.timings["detect_ms"] = (time.perf_counter() - t0) * 1000
+        self.frame_no += 1
+
+        crops, origins = {}, {}
+        for t in self.tracker.tracks.values():
+            bw, bh = t.box[2] - t.box[0], t.box[3] - t.box[1]
+            x1, y1 = int(max(0, t.box[0] - CROP_PAD * bw)), int(max(0, t.box[1] - CROP_PAD * bh))
+            x2, y2 = int(min(w, t.box[2] + CROP_PAD * bw)), int(min(h, t.box[3] + CROP_PAD * bh))
+            if x2 - x1 < 16 or y2 - y1 < 16:
+                t.misses += 1
+                continue
+            crops[t.id] = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2RGB)
+            origins[t.id] = (x1, y1, x2 - x1, y2 - y1)
+        t0 = time.perf_counter()
+        results = self.pool.run(crops) if crops else {}
+        self.timings["pose_ms"] = (time.perf_counter() - t0) * 1000
+        for track_id, lm in results.items():
+            if lm is not None:
+                # crop-normalized -> frame-normalized, as the single-person apps use
+                x0, y0, cw, ch = origins[track_id]
+                lm = lm.copy()
+                lm[:, 0] = (x0 + lm[:, 0] * cw) / w
+                lm[:, 1] = (y0 + lm[:, 1] * ch) / h
+            self.tracker.tracks[track_id].update_pose(lm, frame.shape)
+        for track_id in self.tracker.prune():
+            self.pool.forget(track_id)
+        return list(self.tracker.tracks.values())
+
+    def close(self):
+        self.pool.close()
+
+def draw(image, tracks):
+    import cv2
+    import mediapipe as mp
+    h, w = image.shape[:2]
+    for t in tracks:
+        x1, y1, x2, y2 = t.box.astype(int)
+        cv2.rectangle(image, (x1, y1), (x2, y2), (245, 117, 16), 2)
+        if t.landmarks is not None:
+            pts = (t.landmarks[:, :2] * [w, h]).astype(int)
+            for a, b in mp.solutions.pose.POSE_CONNECTIONS:
+                if t.landmarks[a, 3] > MIN_VISIBILITY and t.landmarks[b, 3] > MIN_VISIBILITY:
+                    cv2.line(image, tuple(pts[a]), tuple(pts[b]), (255, 255, 255), 2)
+        label = f"#{t.id} {(t.exercise or '?').upper()} {t.reps.counter}"
+        cv2.putText(image, label, (x1, max(20, y1 - 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2, cv2.LINE_AA)
+        if t.feedback:
+            cv2.putText(image, t.feedback, (x1, y2 + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
+    return image
+
+def main():
+    import cv2
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--source", default="0", help="camera index or video file")
+    ap.add_argument("--exercise", default="squat", choices=list(zenmotion_core.EXERCISES) + ["auto"])
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--max-people", type=int, default=MAX_PEOPLE)
+    args = ap.parse_args()
+    cap = cv2.VideoCapture(int(args.source) if args.source.isdigit() else args.source)
+    counter = MultiPersonCounter(args.exercise, args.workers, max_people=args.max_people)
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            tracks = counter.process(frame)
+            draw(frame, tracks)
+            cv2.putText(frame, f"people {len(tracks)} | pose {counter.timings['pose_ms']:.0f} ms", (10, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2, cv2.LINE_AA)
+            cv2.imshow('ZenMotion - Group', frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        cap.release()
+        cv2.destroyAllWindows()
+        counter.close()
+        for t in counter.tracker.tracks.values():
+            print(f"person #{t.id}: {t.reps.counter} {t.exercise or ''} reps")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# zenmotion_recorder.py
+# Records annotated frames without slowing the live loop. The loop copies
+# each frame into a slot of a shared-memory ring and posts the slot number on
+# a queue. A separate encoder process writes the video and hands the slot
+# back. When the encoder falls behind and every slot is taken, the drop
+# policy decides what happens:
+#   "oldest"  reclaim the oldest queued frame (the clip skips, the loop never waits)
+#   "newest"  skip the frame being pushed
+#   "block"   wait up to block_timeout for a free slot
+#
+# Output in out_dir: set.mp4 with the whole set, rep_001.mp4... with one
+# clip per rep (cut where push(..., rep_done=True) is called, i.e. on the
+# stage transition back to the top), and clips.json listing them.
+import json
+import multiprocessing as mp
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+DROP_POLICIES = ("oldest", "newest", "block")
+
+# ---------- encoder process ----------
+def _encode(shm_name, shape, out_dir, fps, fourcc, per_rep, full_q, free_q, encoded):
+    import cv2
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    size = (shape[2], shape[1])
+    code = cv2.VideoWriter_fourcc(*fourcc)
+    whole = cv2.VideoWriter(os.path.join(out_dir, "set.mp4"), code, fps, size)
+    clip, clip_no = None, None
+    try:
+        while True:
+            msg = full_q.get()
+            if msg is None:
+                break
+            slot, clip_index = msg
+            frame = ring[slot]
+            whole.write(frame)
+            if per_rep:
+                if clip_index != clip_no:
+                    if clip is not None:
+                        clip.release()
+                    clip_no = clip_index
+                    clip = cv2.VideoWriter(os.path.join(out_dir, f"rep_{clip_no:03d}.mp4"), code, fps, size)
+                clip.write(frame)
+            free_q.put(slot)
+            with encoded.get_lock():
+                encoded.value += 1
+    finally:
+        whole.release()
+        if clip is not None:
+            clip.release()
+        del ring
+        shm.close()
+# ----------------------------
+
+
+class Recorder:
+    def __init__(self, out_dir, size=(640, 480), fps=15, slots=32, drop_policy="oldest",
+                 per_rep=True, fourcc="mp4v", block_timeout=0.05, start_method=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {DROP_POLICIES}")
+        self.out_dir = out_dir
+        self.size = size
+        self.fps = fps
+        self.slots = slots
+        self.drop_policy = drop_policy
+        self.per_rep = per_rep
+        self.fourcc = fourcc
+        self.block_timeout = block_timeout
+        self.start_method = start_method
+        self.proc = None
+        self.pushed = 0
+        self.dropped = 0
+        self.clip = 1
+        self.reps = []   # rep dicts, one per finished clip
+
+    def start(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        w, h = self.size
+        shape = (self.slots, h, w, 3)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+        self.ring = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf)
+        # Default: fork where available, since spawn re-runs the caller's
+        # script in the child and the ZenMotion scripts are not import-safe;
+        # such a script must start the recorder before MediaPipe so the fork
+        # happens before its threads exist. When the recorder starts later
+        # (a notebook's Record button), pass start_method="spawn": a notebook's
+        # __main__ is not a file, so the child only imports this module.
+        method = self.start_method or ("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+        ctx = mp.get_context(method)
+        self.full_q = ctx.Queue()
+        self.free_q = ctx.Queue()
+        for slot in range(self.slots):
+            self.free_q.put(slot)
+        self.encoded = ctx.Value("i", 0)
+        self.proc = ctx.Process(target=_encode, daemon=True,
+                                args=(self.shm.name, shape, self.out_dir, self.fps, self.fourcc, self.per_rep,
+                                      self.full_q, self.free_q, self.encoded))
+        self.proc.start()
+        return self
+
+    def _free_slot(self):
+        try:
+            return self.free_q.get_nowait()
+        except queue.Empty:
+            pass
+        if self.drop_policy == "block":
+            try:
+                return self.free_q.get(timeout=self.block_timeout)
+            except queue.Empty:
+                return None
+        if self.drop_policy == "oldest":
+            try:
+                slot, _ = self.full_q.get_nowait()
+                # the reclaimed frame was counted as pushed; it is dropped instead
+                self.pushed -= 1
+                self.dropped += 1
+                return slot
+            except queue.Empty:
+                return None
+        return None
+
+    def push(self, frame, rep_done=False, rep=None):
+        # frame: BGR uint8. rep_done marks it as the last frame of the current
+        # rep's clip; rep is an optional dict stored in clips.json.
+        if self.proc is None:
+            return False
+        slot = self._free_slot()
+        queued = slot is not None
+        if queued:
+            h, w = frame.shape[:2]
+            if (w, h) != self.size:
+                import cv2
+                frame = cv2.resize(frame, self.size)
+            np.copyto(self.ring[slot], frame)
+            self.full_q.put((slot, self.clip))
+            self.pushed += 1
+        else:
+            self.dropped += 1
+        if rep_done:
+            self.reps.append(rep or {})
+            self.clip += 1
+        return queued
+
+    def stats(self):
+        # pushed + dropped == frames offered; pushed == encoded after close()
+        return {"pushed": self.pushed, "dropped": self.dropped,
+                "encoded": self.encoded.value if hasattr(self, "encoded") else 0, "clips": self.clip - 1}
+
+    def close(self, timeout=30):
+        # finishes the queued frames, then writes clips.json
+        if self.proc is None:
+            return self.stats()
+        self.full_q.put(None)
+        self.proc.join(timeout)
+        if self.proc.is_alive():
+            self.proc.terminate()
+        stats = self.stats()
+        clips = []
+        if self.per_rep:
+            # the last clip is an unfinished rep; clips whose frames were all dropped were never written
+            for i, r in enumerate(self.reps + [None], start=1):
+                if os.path.exists(os.path.join(self.out_dir, f"rep_{i:03d}.mp4")):
+                    clips.append({"file": f"rep_{i:03d}.mp4", "rep": r})
+        with open(os.path.join(self.out_dir, "clips.json"), "w") as f:
+            json.dump({"set": "set.mp4", "fps": self.fps, "clips": clips, "stats": stats,
+                       "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f, indent=2)
+        del self.ring
+        self.shm.close()
+        self.shm.unlink()
+        self.proc = None
+        return stats
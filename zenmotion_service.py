@@ -0,0 +1,389 @@
+# zenmotion_service.py
+# Headless pose inference for kiosks and mobile clients. Clients send JPEG
+# frames and get back landmarks, rep count, stage and feedback.
+#
+#   python zenmotion_service.py --port 8765 --workers 4
+#
+#   POST /frame?client=ID&exercise=squat[&user=NAME]  body: JPEG -> JSON result
+#   GET  /ws?client=ID&exercise=squat[&user=NAME]     binary JPEG messages -> JSON results;
+#                                                     text {"exercise": ...} / {"reset": true}
+#   POST /reset?client=ID[&exercise=...]
+#   GET  /stats
+#
+# Each worker process owns MediaPipe Pose instances. A client sticks to one
+# worker, so tracking state stays valid between its frames. Frames queued for
+# the same worker go over in one batch per round trip. Rep counting
+# (zenmotion_core.RepCounter) stays in this process, one counter per client;
+# completed reps are scored against the zenmotion_form template library on
+# a scoring thread, off the event loop, and logged to the zenmotion_log
+# workout log under `user` (default: the client id).
+#
+# Frames are batched per worker: while a worker's round trip is in flight,
+# frames for it queue up and go over together on the next one. A client
+# has at most MAX_IN_FLIGHT frames out, so batches grow when several clients
+# share a worker, i.e. when there are more clients than workers.
+#
+# A worker process that dies is replaced; the frames it had get an error
+# reply with "retry": true (HTTP 503) and its clients' tracking restarts.
+#
+# --model-complexity auto --target-fps N (or --p95-ms N) picks the pose
+# settings with zenmotion_tune and moves them down/up with the measured
+# inference times; each batch carries the current settings to its worker.
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from aiohttp import web, WSMsgType
+
+import zenmotion_core
+import zenmotion_form
+import zenmotion_log
+import zenmotion_tune
+
+MAX_BATCH = 8              # frames per worker round trip
+MAX_QUEUE = 64             # frames waiting per worker before we start refusing
+MAX_IN_FLIGHT = 2          # per client; older clients are not starved by a fast one
+CLIENT_IDLE_SECONDS = 300
+POSES_PER_WORKER = 32      # Pose instances kept per worker (LRU by client)
+
+# ---------- worker process ----------
+_poses = OrderedDict()
+_pose_args = {}
+
+def _init_worker(model_complexity, min_detection_confidence, min_tracking_confidence):
+    _pose_args.update(model_complexity=model_complexity,
+                      min_detection_confidence=min_detection_confidence,
+                      min_tracking_confidence=min_tracking_confidence)
+
+def _pose_for(client):
+    import mediapipe as mp
+    pose = _poses.pop(client, None)
+    if pose is None:
+        if len(_poses) >= POSES_PER_WORKER:
+            _poses.popitem(last=False)[1].close()
+        pose = mp.solutions.pose.Pose(**_pose_args)
+    _poses[client] = pose
+    return pose
+
+def _drop_client(client):
+    pose = _poses.pop(client, None)
+    if pose is not None:
+        pose.close()
+
+def process_batch(batch, pose_args=None):
+    # batch: [(client, jpeg bytes)] -> [(landmarks (33, 4) float32 or None, error or None, ms)]
+    import cv2
+    if pose_args and pose_args != _pose_args:
+        # the tuner moved to another level: the next frames open new Pose instances
+        for client in list(_poses):
+            _drop_client(client)
+        _pose_args.update(pose_args)
+    out = []
+    for client, jpeg in batch:
+        t0 = time.perf_counter()
+        if jpeg is None:  # control message: client went away
+            _drop_client(client)
+            out.append((None, None, 0.0))
+            continue
+        image = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR) if jpeg else None
+        if image is None:
+            out.append((None, "not a JPEG image", 0.0))
+            continue
+        results = _pose_for(client).process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        lm = None
+        if results.pose_landmarks:
+            lm = zenmotion_core.landmarks_to_array(results.pose_landmarks.landmark)
+        out.append((lm, None, (time.perf_counter() - t0) * 1000))
+    return out
+# ----------------------------
+
+# ---------- dispatch ----------
+class WorkerFailed(Exception):
+    pass
+
+
+class Worker:
+    def __init__(self, n, pose_args):
+        self.n = n
+        self.pose_args = pose_args
+        self.pool = self._spawn()
+        self.queue = asyncio.Queue(MAX_QUEUE)
+        self.clients = 0
+        self.restarts = 0
+        self.task = None
+
+    def _spawn(self):
+        return concurrent.futures.ProcessPoolExecutor(1, initializer=_init_worker, initargs=self.pose_args)
+
+    async def run(self, stats, pose_args):
+        # pose_args() -> current Pose settings (None: the ones given at startup)
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < MAX_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                results = await loop.run_in_executor(self.pool, process_batch, [(c, j) for c, j, _ in batch],
+                                                     pose_args())
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    # the process died (killed, out of memory, crashed in MediaPipe)
+                    self.pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = self._spawn()
+                    self.restarts += 1
+                stats.worker_errors += 1
+                error = WorkerFailed(f"worker {self.n} failed: {type(e).__name__}: {e}"[:300])
+                for _, jpeg, fut in batch:
+                    if not fut.done():
+                        if jpeg is None:
+                            fut.set_result((None, None, 0.0))  # control message: nobody awaits it
+                        else:
+                            fut.set_exception(error)
+                continue
+            stats.batches[len(batch)] += 1
+            for (_, _, fut), res in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(res)
+
+
+class Client:
+    def __init__(self, client_id, exercise, worker, user=None):
+        self.id = client_id
+        self.user = user or client_id
+        self.reps = zenmotion_core.RepCounter(exercise)
+        self.worker = worker
+        self.in_flight = 0
+        self.last_seen = time.monotonic()
+
+
+class Stats:
+    def __init__(self):
+        self.started = time.time()
+        self.frames = 0
+        self.no_pose = 0
+        self.dropped = 0
+        self.latency_ms = collections.deque(maxlen=10000)    # queue + inference, per frame
+        self.inference_ms = collections.deque(maxlen=10000)
+        self.batches = collections.Counter()
+        self.worker_errors = 0
+
+    def as_dict(self, clients, tuner=None, workers=()):
+        def pct(values):
+            if not values:
+                return None
+            p = np.percentile(np.fromiter(values, float), [50, 95, 99])
+            return {"p50": round(p[0], 2), "p95": round(p[1], 2), "p99": round(p[2], 2)}
+        elapsed = time.time() - self.started
+        return {"uptime_s": round(elapsed, 1), "frames": self.frames, "no_pose": self.no_pose,
+                "dropped": self.dropped, "clients": clients, "fps": round(self.frames / elapsed, 1) if elapsed else 0,
+                "latency_ms": pct(self.latency_ms), "inference_ms": pct(self.inference_ms),
+                "batch_sizes": dict(sorted(self.batches.items())), "worker_errors": self.worker_errors,
+                "worker_restarts": sum(w.restarts for w in workers),
+                "pose": tuner.describe() if tuner else None}
+
+
+class Service:
+    def __init__(self, workers, pose_args, tuner=None, log_path=zenmotion_log.LOG_PATH):
+        self.workers = [Worker(i, pose_args) for i in range(workers)]
+        self.clients = {}
+        self.stats = Stats()
+        self.form = zenmotion_form.FormScorer()
+        # DTW costs milliseconds per rep: one thread, so the loop keeps serving
+        self.scoring = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="form-score")
+        self.log = zenmotion_log.WorkoutLog(log_path) if log_path else None
+        self.tuner = tuner  # zenmotion_tune.LevelGovernor, or None for fixed settings
+
+    def pose_args(self):
+        return self.tuner.settings if self.tuner else None
+
+    async def start(self, app):
+        for w in self.workers:
+            w.task = asyncio.create_task(w.run(self.stats, self.pose_args))
+        self._reaper = asyncio.create_task(self.expire_clients())
+
+    async def stop(self, app):
+        self._reaper.cancel()
+        for w in self.workers:
+            w.task.cancel()
+            w.pool.shutdown(wait=False, cancel_futures=True)
+        self.scoring.shutdown(wait=False, cancel_futures=True)
+        if self.log:
+            self.log.close()
+
+    def client(self, client_id, exercise=None, user=None):
+        c = self.clients.get(client_id)
+        if c is None:
+            worker = min(self.workers, key=lambda w: w.clients)
+            worker.clients += 1
+            c = self.clients[client_id] = Client(client_id, exercise or "squat", worker, user)
+        elif exercise and exercise != c.reps.exercise:
+            c.reps.reset(exercise)
+        c.last_seen = time.monotonic()
+        return c
+
+    def forget(self, client_id):
+        c = self.clients.pop(client_id, None)
+        if c is not None:
+            c.worker.clients -= 1
+            try:
+                c.worker.queue.put_nowait((client_id, None, asyncio.get_running_loop().create_future()))
+            except asyncio.QueueFull:
+                pass  # the worker's LRU will close it eventually
+
+    async def expire_clients(self):
+        while True:
+            await asyncio.sleep(30)
+            cutoff = time.monotonic() - CLIENT_IDLE_SECONDS
+            for client_id in [k for k, c in self.clients.items() if c.last_seen < cutoff and not c.in_flight]:
+                self.forget(client_id)
+
+    async def infer(self, c, jpeg):
+        if c.in_flight >= MAX_IN_FLIGHT:
+            self.stats.dropped += 1
+            return {"client": c.id, "dropped": True, "reason": "client has too many frames in flight"}
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            c.worker.queue.put_nowait((c.id, jpeg, fut))
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+            return {"client": c.id, "dropped": True, "reason": "server busy"}
+        t0 = time.perf_counter()
+        c.in_flight += 1
+        try:
+            lm, error, inference_ms = await fut
+        except WorkerFailed as e:
+            return {"client": c.id, "error": str(e), "retry": True}
+        finally:
+            c.in_flight -= 1
+        if error:
+            return {"client": c.id, "error": error}
+        self.stats.frames += 1
+        self.stats.latency_ms.append((time.perf_counter() - t0) * 1000)
+        self.stats.inference_ms.append(inference_ms)
+        if self.tuner and self.tuner.observe(inference_ms):
+            print(f"Pose model: {self.tuner.describe()}")
+        out = self.result(c, lm)
+        if out["rep"] is not None:
+            rep = c.reps.last_rep
+            out["rep"]["form"] = await asyncio.get_running_loop().run_in_executor(self.scoring, self.form.score, rep)
+            if self.log:
+                self.log.log(out["rep"], c.user)
+        return out
+
+    def result(self, c, lm):
+        reps = c.reps
+        out = {"client": c.id, "exercise": reps.exercise, "landmarks": None, "angle": None}
+        if lm is None:
+            self.stats.no_pose += 1
+        else:
+            angle = zenmotion_core.joint_angle(lm, reps.exercise)
+            reps.update(angle)
+            out["landmarks"] = np.round(lm, 4).tolist()
+            out["angle"] = round(angle, 1)
+        out.update(counter=reps.counter, stage=reps.stage, feedback=reps.feedback if lm is not None else "", rep=None)
+        if lm is not None and reps.last_rep is not None:
+            out["rep"] = reps.last_rep.as_dict()  # infer() adds the form score
+        return out
+# ----------------------------
+
+# ---------- handlers ----------
+def exercise_param(request):
+    exercise = request.query.get("exercise")
+    if exercise and exercise not in zenmotion_core.EXERCISES:
+        raise web.HTTPBadRequest(text=f"unknown exercise {exercise!r}")
+    return exercise
+
+async def post_frame(request):
+    svc = request.app["service"]
+    client_id = request.query.get("client") or request.remote
+    c = svc.client(client_id, exercise_param(request), request.query.get("user"))
+    out = await svc.infer(c, await request.read())
+    status = 503 if out.get("dropped") or out.get("retry") else 400 if out.get("error") else 200
+    return web.json_response(out, status=status)
+
+async def post_reset(request):
+    svc = request.app["service"]
+    c = svc.client(request.query.get("client") or request.remote, exercise_param(request))
+    c.reps.reset()
+    return web.json_response({"client": c.id, "exercise": c.reps.exercise, "counter": 0})
+
+async def get_stats(request):
+    svc = request.app["service"]
+    out = svc.stats.as_dict(len(svc.clients), svc.tuner, svc.workers)
+    out["workout_log"] = svc.log.stats() if svc.log else None
+    return web.json_response(out)
+
+async def websocket(request):
+    svc = request.app["service"]
+    client_id = request.query.get("client") or f"ws-{id(request)}"
+    c = svc.client(client_id, exercise_param(request), request.query.get("user"))
+    ws = web.WebSocketResponse(max_msg_size=8 * 1024 * 1024)
+    await ws.prepare(request)
+    try:
+        async for msg in ws:
+            if msg.type == WSMsgType.BINARY:
+                await ws.send_json(await svc.infer(c, msg.data))
+            elif msg.type == WSMsgType.TEXT:
+                try:
+                    cmd = json.loads(msg.data)
+                except ValueError:
+                    await ws.send_json({"error": "expected JSON"})
+                    continue
+                if cmd.get("exercise") in zenmotion_core.EXERCISES:
+                    c.reps.reset(cmd["exercise"])
+                if cmd.get("reset"):
+                    c.reps.reset()
+                await ws.send_json({"client": c.id, "exercise": c.reps.exercise, "counter": c.reps.counter})
+            c.last_seen = time.monotonic()
+    finally:
+        svc.forget(client_id)
+    return ws
+# ----------------------------
+
+def make_app(workers=None, model_complexity=1, min_detection_confidence=0.5, min_tracking_confidence=0.5,
+             target_fps=None, p95_ms=None, log_path=zenmotion_log.LOG_PATH):
+    # model_complexity="auto" tunes against target_fps / p95_ms (per frame, inference only)
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    tuner = None
+    if model_complexity == "auto":
+        # calibrated in a spawned process: the workers below are forked from this one
+        tuner = zenmotion_tune.LevelGovernor(zenmotion_tune.benchmarks(isolated=True),
+                                             zenmotion_tune.budget_ms(target_fps, p95_ms))
+        print(f"Pose model: {tuner.describe()}")
+        s = tuner.settings
+        model_complexity, min_detection_confidence, min_tracking_confidence = (
+            s["model_complexity"], s["min_detection_confidence"], s["min_tracking_confidence"])
+    svc = Service(workers, (model_complexity, min_detection_confidence, min_tracking_confidence), tuner, log_path)
+    app = web.Application(client_max_size=8 * 1024 * 1024)
+    app["service"] = svc
+    app.on_startup.append(svc.start)
+    app.on_cleanup.append(svc.stop)
+    app.router.add_post("/frame", post_frame)
+    app.router.add_post("/reset", post_reset)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_get("/ws", websocket)
+    return app
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=None, help="pose worker processes (default: CPUs - 1)")
+    ap.add_argument("--model-complexity", default="1", choices=("0", "1", "2", "auto"))
+    ap.add_argument("--target-fps", type=float, help="with --model-complexity auto: per-frame inference budget")
+    ap.add_argument("--p95-ms", type=float, help="with --model-complexity auto: p95 inference budget")
+    ap.add_argument("--workout-log", default=zenmotion_log.LOG_PATH, help="SQLite rep log ('' to disable)")
+    args = ap.parse_args()
+    complexity = args.model_complexity if args.model_complexity == "auto" else int(args.model_complexity)
+    web.run_app(make_app(args.workers, complexity, target_fps=args.target_fps, p95_ms=args.p95_ms,
+                         log_path=args.workout_log), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
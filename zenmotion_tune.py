@@ -0,0 +1,277 @@
+# zenmotion_tune.py
+# Picks the MediaPipe Pose settings for this machine from a latency budget:
+# a target FPS or a p95 in milliseconds, for pose inference alone.
+#
+# LEVELS runs from the most accurate setting to the cheapest. calibrate()
+# times every level on a short clip: CALIBRATION_CLIP when there is one,
+# otherwise a drawn figure doing squats, which Pose tracks like a person.
+# Levels that cannot load are skipped (the heavy and lite models are
+# downloaded on first use). Timings are cached per machine in
+# CACHE_DIR/pose_tuning.json, so later starts only read the file and retry
+# the levels that failed to load, e.g. because the download failed offline.
+#
+# At runtime LevelGovernor keeps a rolling p95. Over budget, it steps down a
+# level. It steps back up when the level above would fit with HEADROOM to
+# spare: that level's calibrated p95, scaled by how much slower than
+# calibrated the current level runs right now. AdaptivePose wraps Pose with
+# it and sets `changed` on the frame the level changes, for the caller to
+# show; the inference service feeds a governor from its workers' timings.
+#
+#   python zenmotion_tune.py --target-fps 20          # show the timings and the pick
+#   python zenmotion_tune.py --target-fps 20 --recalibrate
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import time
+
+import numpy as np
+
+import zenmotion_core
+
+LEVELS = [
+    {"model_complexity": 2, "min_detection_confidence": 0.5, "min_tracking_confidence": 0.5},
+    {"model_complexity": 1, "min_detection_confidence": 0.5, "min_tracking_confidence": 0.5},
+    {"model_complexity": 0, "min_detection_confidence": 0.5, "min_tracking_confidence": 0.5},
+    # cheapest: keep tracking weaker landmarks rather than re-running the person detector
+    {"model_complexity": 0, "min_detection_confidence": 0.5, "min_tracking_confidence": 0.3},
+]
+CALIBRATION_CLIP = os.environ.get("ZENMOTION_CALIBRATION_CLIP",
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibration.mp4"))
+CACHE_PATH = os.path.join(zenmotion_core.CACHE_DIR, "pose_tuning.json")
+CALIBRATION_FRAMES = 60
+WARMUP_FRAMES = 10   # first frames per level are not timed (model load, first detection)
+WINDOW = 60          # frames in the runtime p95
+COOLDOWN = 120       # frames after a switch before the next decision
+HEADROOM = 0.8       # step up only when predicted under 80% of the budget
+
+# ---------- calibration ----------
+def machine_key():
+    import mediapipe as mp
+    info = [platform.node(), platform.machine(), platform.processor(), str(os.cpu_count()), mp.__version__]
+    return hashlib.sha1("|".join(info).encode()).hexdigest()[:16]
+
+def figure(t, size=(480, 640)):
+    # BGR frame of a figure squatting; t in cycles (0 standing, 0.5 at the bottom)
+    import cv2
+    h, w = size
+    img = np.full((h, w, 3), (200, 210, 220), np.uint8)
+    s = 0.5 + 0.5 * np.cos(2 * np.pi * t)
+    cx = w // 2
+    hip_y = int(240 + 60 * (1 - s))
+    knee_y, ankle_y = int(hip_y + 60 + 20 * s), 430
+    shoulder_y = hip_y - 110
+    head_y = shoulder_y - 45
+    skin, shirt, pants = (140, 170, 220), (60, 60, 180), (90, 50, 30)
+    cv2.ellipse(img, (cx, head_y), (26, 34), 0, 0, 360, skin, -1)
+    for ex in (-9, 9):
+        cv2.circle(img, (cx + ex, head_y - 6), 4, (30, 30, 30), -1)
+    cv2.ellipse(img, (cx, head_y + 14), (10, 4), 0, 0, 180, (40, 40, 120), 2)
+    cv2.rectangle(img, (cx - 45, shoulder_y), (cx + 45, hip_y), shirt, -1)
+    for side in (-1, 1):
+        cv2.line(img, (cx + side * 40, shoulder_y + 8), (cx + side * 70, shoulder_y + 60), shirt, 22)
+        cv2.line(img, (cx + side * 70, shoulder_y + 60), (cx + side * 60, shoulder_y + 115), skin, 18)
+        knee_x = cx + side * (25 + int(35 * (1 - s)))
+        cv2.line(img, (cx + side * 22, hip_y), (knee_x, knee_y), pants, 28)
+        cv2.line(img, (knee_x, knee_y), (cx + side * 25, ankle_y), pants, 24)
+        cv2.ellipse(img, (cx + side * 32, ankle_y + 8), (22, 9), 0, 0, 360, (20, 20, 20), -1)
+    return img
+
+def calibration_frames(clip=CALIBRATION_CLIP, n=CALIBRATION_FRAMES):
+    import cv2
+    frames = []
+    if clip and os.path.exists(clip):
+        cap = cv2.VideoCapture(clip)
+        while len(frames) < n:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(cv2.resize(frame, (640, 480)))
+        cap.release()
+    return frames or [figure(i / 30) for i in range(n)]
+
+def time_level(settings, frames):
+    import cv2
+    import mediapipe as mp
+    times, found = [], 0
+    with mp.solutions.pose.Pose(**settings) as pose:
+        for i, frame in enumerate(frames):
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            t0 = time.perf_counter()
+            results = pose.process(rgb)
+            if i >= WARMUP_FRAMES:
+                times.append((time.perf_counter() - t0) * 1000)
+                found += results.pose_landmarks is not None
+    p50, p95 = np.percentile(times, [50, 95])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "detected": round(found / len(times), 2)}
+
+def _calibrate(clip, levels=LEVELS):
+    frames = calibration_frames(clip)
+    out = []
+    for settings in levels:
+        try:
+            result = time_level(settings, frames)
+        except (OSError, RuntimeError) as e:  # model download failed, graph did not load
+            result = {"error": f"{type(e).__name__}: {e}"[:200]}
+        out.append(dict(result, settings=settings))
+    return out
+
+def calibrate(clip=CALIBRATION_CLIP, isolated=False, levels=LEVELS):
+    # isolated: in a spawned process, so MediaPipe's threads never live in a
+    # caller that forks later (the service's workers). Needs an import-safe
+    # __main__; the ZenMotion scripts are not, and calibrate in-process.
+    if not isolated:
+        return _calibrate(clip, levels)
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as ex:
+        return ex.submit(_calibrate, clip, levels).result()
+
+def benchmarks(clip=CALIBRATION_CLIP, path=CACHE_PATH, recalibrate=False, isolated=False):
+    # per-level timings for this machine, calibrating on the first call
+    key = machine_key()
+    cache = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            cache = json.load(f)
+    entry = cache.get(key)
+    if recalibrate or entry is None or [b["settings"] for b in entry["levels"]] != LEVELS:
+        entry = cache[key] = {"machine": platform.node(), "calibrated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                              "clip": clip if clip and os.path.exists(clip) else "synthetic",
+                              "levels": calibrate(clip, isolated)}
+    else:
+        # levels that failed to load last time (a model download, say) get another try
+        failed = [i for i, b in enumerate(entry["levels"]) if "error" in b]
+        if not failed:
+            return entry["levels"]
+        retried = calibrate(clip, isolated, [LEVELS[i] for i in failed])
+        if all("error" in b for b in retried):
+            return entry["levels"]
+        for i, b in zip(failed, retried):
+            entry["levels"][i] = b
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(cache, f, indent=2)
+    return entry["levels"]
+# ----------------------------
+
+# ---------- choosing ----------
+def budget_ms(target_fps=None, p95_ms=None):
+    if p95_ms:
+        return float(p95_ms)
+    if target_fps:
+        return 1000.0 / target_fps
+    raise ValueError("give a target FPS or a p95 latency")
+
+def choose(bench, budget):
+    # most accurate level whose calibrated p95 fits; the cheapest usable one otherwise
+    usable = [i for i, b in enumerate(bench) if "p95_ms" in b]
+    if not usable:
+        raise RuntimeError("no pose model could be loaded: " + "; ".join(b.get("error", "") for b in bench))
+    return next((i for i in usable if bench[i]["p95_ms"] <= budget), usable[-1])
+
+
+class LevelGovernor:
+    def __init__(self, bench, budget, window=WINDOW, cooldown=COOLDOWN):
+        self.bench = bench
+        self.budget = budget
+        self.usable = [i for i, b in enumerate(bench) if "p95_ms" in b]
+        self.level = choose(bench, budget)
+        self.times = collections.deque(maxlen=window)
+        self.cooldown = cooldown
+        self.switches = 0
+        self._since = 0
+
+    @property
+    def settings(self):
+        return self.bench[self.level]["settings"]
+
+    def p95(self):
+        return float(np.percentile(self.times, 95)) if self.times else None
+
+    def observe(self, ms):
+        # one inference time; True when the level changed
+        self.times.append(ms)
+        self._since += 1
+        if self._since < self.cooldown or len(self.times) < self.times.maxlen:
+            return False
+        p95 = self.p95()
+        pos = self.usable.index(self.level)
+        if p95 > self.budget:
+            return pos + 1 < len(self.usable) and self._switch(self.usable[pos + 1])
+        if pos > 0:
+            load = p95 / self.bench[self.level]["p95_ms"]
+            up = self.usable[pos - 1]
+            if self.bench[up]["p95_ms"] * load <= self.budget * HEADROOM:
+                return self._switch(up)
+        return False
+
+    def _switch(self, level):
+        self.level = level
+        self.times.clear()
+        self._since = 0
+        self.switches += 1
+        return True
+
+    def describe(self):
+        s = self.settings
+        p95 = self.p95()
+        return (f"complexity {s['model_complexity']}, tracking {s['min_tracking_confidence']}, "
+                f"p95 {p95 if p95 is None else round(p95, 1)} / {round(self.budget, 1)} ms")
+# ----------------------------
+
+
+class AdaptivePose:
+    # stands in for mp.solutions.pose.Pose(...): process(), close(), `with`
+    def __init__(self, target_fps=None, p95_ms=None, clip=CALIBRATION_CLIP):
+        self.governor = LevelGovernor(benchmarks(clip), budget_ms(target_fps, p95_ms))
+        self.pose = None
+        self.changed = False  # True on the frame the level changed
+        self._open()
+
+    def _open(self):
+        import mediapipe as mp
+        if self.pose is not None:
+            self.pose.close()
+        self.pose = mp.solutions.pose.Pose(**self.governor.settings)
+
+    def process(self, image):
+        t0 = time.perf_counter()
+        results = self.pose.process(image)
+        self.changed = self.governor.observe((time.perf_counter() - t0) * 1000)
+        if self.changed:
+            self._open()
+        return results
+
+    def close(self):
+        if self.pose is not None:
+            self.pose.close()
+            self.pose = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--target-fps", type=float)
+    ap.add_argument("--p95-ms", type=float)
+    ap.add_argument("--clip", default=CALIBRATION_CLIP)
+    ap.add_argument("--recalibrate", action="store_true")
+    args = ap.parse_args()
+    bench = benchmarks(args.clip, recalibrate=args.recalibrate)
+    for i, b in enumerate(bench):
+        s = b["settings"]
+        timing = b.get("error") or f"p50 {b['p50_ms']} ms  p95 {b['p95_ms']} ms  pose found {b['detected']:.0%}"
+        print(f"{i}: complexity {s['model_complexity']}, tracking {s['min_tracking_confidence']}: {timing}")
+    if args.target_fps or args.p95_ms:
+        budget = budget_ms(args.target_fps, args.p95_ms)
+        print(f"pick for {budget:.1f} ms: level {choose(bench, budget)}")
+    print(f"cached in {CACHE_PATH}")
+
+if __name__ == "__main__":
+    main()